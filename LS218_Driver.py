@@ -1,31 +1,71 @@
 from enum import Enum
 
+from async_driver import async_driver_class
+from cache import ALL
 from driver import *
+from feature import command_feature
 from processors import *
 from validators import *
 
+ALL_INPUTS = ('input 1', 'input 2', 'input 3', 'input 4', 'input 5', 'input 6', 'input 7', 'input 8')
+
 
 class LS218_Driver(Driver):
+    models = ('MODEL218', 'MODEL218E', 'MODEL218S')
+    eeprom_commands = ('ALARM', 'ANALOG', 'BAUD', 'CRVDEL', 'CRVHDR', 'CRVPT', 'INTYPE')
+
+    audible_alarm = command_feature('get_audible_alarm_state', 'set_audible_alarm_state')
+    input_alarm = command_feature('get_input_alarm_parameters', 'set_input_alarm_parameters', indexed=True,
+                                  fields=('off_on', 'source', 'high value', 'low value', 'deadband', 'latch enable'))
+    analog_output = command_feature('get_analog_output_parameters', 'set_analog_output_parameters', indexed=True,
+                                    fields=('bipolar enable', 'mode', 'input', 'source', 'high value', 'low value',
+                                            'manual value'))
+
+    alarm_inputs = (1, 2, 3, 4, 5, 6, 7, 8)
+    # The alarms are polled, see read_status_summary
+    requests_service = False
+
     def __init__(self, resource):
         super().__init__(resource)
 
+    @Query(cache=True)
     def identification(self):
         return self.query('*IDN?')
 
+    @Write()
     def clear_interface(self):
-        return self.write("*CLS")
+        self.send("*CLS")
 
+    @Write(invalidates=ALL)
     def reset_instrument(self):
-        self.write("*RST")
+        self.send("*RST")
 
     @NotSupported('This command is not supported in the Model 218.')
     def wait_to_continue(self):
-        self.write("*WAI")
+        self.send("*WAI")
 
     @Query(processors=ProcessInteger())
     def self_test(self):
         return self.query("*TST?")
 
+    @Query(processors=ProcessInteger())
+    def get_status_byte(self):
+        return self.query("*STB?")
+
+    @Write(validators={'mask': (ValidateInteger(), ValidateRange(min=0, max=255))})
+    def set_service_request_enable(self, mask):
+        self.send("*SRE {}".format(mask))
+
+    def enable_status_reporting(self):
+        # Nothing to configure, the alarms are not reported in the status byte
+        pass
+
+    def read_status_summary(self):
+        # The status byte has no alarm bit to rely on, the summary is the alarm status of every input
+        with self.batch() as batch:
+            statuses = [batch.get_input_alarm_status(input) for input in self.alarm_inputs]
+        return any(any(status.value.values()) for status in statuses), {}
+
     @Write(validators={'input': (ValidateInteger(), ValidateRange(min=1, max=8)),
                        'off_on': ValidateInArray((0, 1)),
                        'source': ValidateInArray((1, 2, 3, 4)),
@@ -33,7 +73,8 @@ class LS218_Driver(Driver):
                        'low_value': ValidateReal(),
                        'deadband': ValidateReal(),
                        'latch_enable': ValidateInArray((0, 1))
-                       })
+                       },
+           invalidates=('get_input_alarm_parameters',))
     def set_input_alarm_parameters(self, input, off_on, source, high_value, low_value, deadband, latch_enable):
         self.send("ALARM {input},{off_on},{source},{high_value},{low_value},{deadband},{latch_enable}".format(
             input=input, off_on=off_on, source=source, high_value=high_value, low_value=low_value, deadband=deadband,
@@ -43,7 +84,8 @@ class LS218_Driver(Driver):
            processors=ProcessCSV(names=('off_on', 'source', 'high value', 'low value',
                                         'deadband', 'latch enable'),
                                  processors=(ProcessInteger(), ProcessInteger(), ProcessReal(), ProcessReal(),
-                                             ProcessReal(), ProcessInteger())))
+                                             ProcessReal(), ProcessInteger())),
+           cache=60)
     def get_input_alarm_parameters(self, input):
         return self.query("ALARM? {}".format(input))
 
@@ -52,14 +94,15 @@ class LS218_Driver(Driver):
     def get_input_alarm_status(self, input):
         return self.query("ALARMST? {}".format(input))
 
-    @Write(validators={"on_off": ValidateInArray((0, 1))})
+    @Write(validators={"on_off": ValidateInArray((0, 1))}, invalidates=('get_audible_alarm_state',))
     def set_audible_alarm_state(self, on_off):
         self.send("ALMB {}".format(on_off))
 
-    @Query(processors=ProcessInteger())
+    @Query(processors=ProcessInteger(), cache=60)
     def get_audible_alarm_state(self):
         return self.query("ALMB?")
 
+    @Write()
     def reset_latched_audible_alarms(self):
         self.send("ALMRST")
 
@@ -70,7 +113,8 @@ class LS218_Driver(Driver):
                        'source': ValidateInArray((1, 2, 3, 4)),
                        'high_value': ValidateReal(),
                        'low_value': ValidateReal(),
-                       'manual_value': ValidateReal()})
+                       'manual_value': ValidateReal()},
+           invalidates=('get_analog_output_parameters',))
     def set_analog_output_parameters(self, output, bipolar_enable, mode, input, source, high_value, low_value, manual_value):
         self.send("ANALOG {},{},{},{},{},{},{},{}".format(output, bipolar_enable, mode, input, source, high_value, low_value, manual_value))
 
@@ -78,7 +122,8 @@ class LS218_Driver(Driver):
            processors=ProcessCSV(names=('bipolar enable', 'mode', 'input', 'source',
                                         'high value', 'low value', 'manual value'),
                                  processors=(ProcessInteger(), ProcessInteger(), ProcessInteger(), ProcessInteger(),
-                                             ProcessReal(), ProcessReal(), ProcessReal())))
+                                             ProcessReal(), ProcessReal(), ProcessReal())),
+           cache=60)
     def get_analog_output_parameters(self, output):
         return self.query("ANALOG? {}".format(output))
 
@@ -87,7 +132,7 @@ class LS218_Driver(Driver):
     def get_analog_output(self, output):
         return self.query("AOUT? {}".format(output))
 
-    @Write(validators={"bps": ValidateInArray((0,1,2))})
+    @Write(validators={"bps": ValidateInArray((0,1,2))}, invalidates=('get_baud_rate',))
     def set_baud_rate(self, bps):
         """
         :param bps:
@@ -95,9 +140,9 @@ class LS218_Driver(Driver):
         1 = 1200
         2 = 9600
         """
-        self.write("BAUD {}".format(bps))
+        self.send("BAUD {}".format(bps))
 
-    @Query(processors=ProcessInteger())
+    @Query(processors=ProcessInteger(), cache=60)
     def get_baud_rate(self):
         """
         0 = 300
@@ -121,21 +166,21 @@ class LS218_Driver(Driver):
     def get_sensor_reading(self, input):
         return self.query("SRDG? {}".format(input))
 
-    @Query(processors=ProcessCSV(names=('input 1', 'input 2', 'input 3', 'input 4', 'input 5', 'input 6', 'input 7', 'input 8')))
+    @Query(processors=ProcessCSV(names=ALL_INPUTS, output='array'))
     def get_celsius_reading_all(self):
         return self.query("CRDG? 0")
 
-    @Query(processors=ProcessCSV(
-        names=('input 1', 'input 2', 'input 3', 'input 4', 'input 5', 'input 6', 'input 7', 'input 8')))
+    @Query(processors=ProcessCSV(names=ALL_INPUTS, output='array'))
     def get_kelvin_reading_all(self):
         return self.query("KRDG? 0")
 
-    @Query(processors=ProcessCSV(
-        names=('input 1', 'input 2', 'input 3', 'input 4', 'input 5', 'input 6', 'input 7', 'input 8')))
+    @Query(processors=ProcessCSV(names=ALL_INPUTS, output='array'))
     def get_sensor_reading_all(self):
         return self.query("SRDG? 0")
 
     @Write(validators={'input': (ValidateInteger(), ValidateRange(min=1, max=8))})
     def delete_user_curve(self, input):
         # Curves 21-28 are the user curves, so add 20 to the input number to select which to delete
-        self.send("CRVDEL {}".format(input + 20))
\ No newline at end of file
+        self.send("CRVDEL {}".format(input + 20))
+
+AsyncLS218_Driver = async_driver_class(LS218_Driver)
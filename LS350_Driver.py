@@ -1,20 +1,45 @@
+import numpy as np
+
+import curves
+from async_driver import async_driver_class
 from driver import *
+from feature import command_feature
 from processors import *
 from validators import *
 
+# Operation summary bit of the status byte, set when an enabled bit of the operation event register is set
+STATUS_OPERATION = 0x80
+# Alarm bit of the operation event and condition registers
+OPERATION_ALARM = 0x01
+
 
 class LS350_Driver(Driver):
+    models = ('MODEL350',)
+    eeprom_commands = ('PID', 'RAMP', 'BRIGT', 'CRVHDR', 'CRVPT', 'CRVDEL', 'INCRV')
+
+    brightness = command_feature('get_brightness', 'set_brightness')
+    input_curve = command_feature('get_input_curve_number', 'set_input_curve_number', indexed=True)
+    pid = command_feature('get_pid', 'set_pid', indexed=True, fields=('P', 'I', 'D'))
+    ramp = command_feature('get_ramp_parameters', 'set_setpoint_ramp_parameters', indexed=True,
+                           fields=('on/off', 'rate value'))
+    heater_range = command_feature('get_heater_range', 'set_heater_range', indexed=True)
+    setpoint = command_feature('get_setpoint', 'set_setpoint', indexed=True)
+
+    alarm_inputs = ('A', 'B', 'C', 'D')
+    heater_outputs = (1, 2)
+
     def __init__(self, resource):
         super().__init__(resource)
 
+    @Query(cache=True)
     def identification(self):
         return self.query('*IDN?')
 
-    @Query(processors=[ProcessInteger()])
+    @Query(processors=[ProcessInteger()], cache=60)
     def get_brightness(self):
         return self.query('BRIGT?')
 
-    @Write(validators={"contrast": [ValidateRange(1, 32)]})
+    @Write(validators={"contrast": [ValidateRange(1, 32)]}, invalidates=('get_brightness',))
     def set_brightness(self, contrast):
         self.send("BRIGT {}".format(contrast))
 
@@ -30,9 +55,10 @@ class LS350_Driver(Driver):
     def get_sensor_reading(self, input):
         return self.query("SRDG? {}".format(input))
 
-    @Query(validators={"curve": {ValidateInteger(), ValidateRange(min=1, max=59)}},
+    @Query(validators={"curve": [ValidateInteger(), ValidateRange(min=1, max=59)]},
            processors=[ProcessCSV(names=('name', 'SN', 'format', 'limit value', 'coefficient'),
-                                  processors=(None, None, ProcessInteger(), ProcessReal(), ProcessInteger()))])
+                                  processors=(None, None, ProcessInteger(), ProcessReal(), ProcessInteger()))],
+           cache=60)
     def get_curve_header(self, curve):
         return self.query("CRVHDR? {}".format(curve))
 
@@ -43,6 +69,65 @@ class LS350_Driver(Driver):
     def get_curve_data_point(self, curve, index):
         return self.query("CRVPT? {},{}".format(curve, index))
 
+    @Write(validators={"curve": [ValidateInteger(), ValidateRange(min=21, max=59)],
+                       "name": [ValidateLength(max=15)],
+                       "serial_number": [ValidateLength(max=10)],
+                       "format": [ValidateInArray((1, 2, 3, 4))],
+                       "limit": [ValidateReal()],
+                       "coefficient": [ValidateInArray((1, 2))]},
+           invalidates=('get_curve_header',))
+    def set_curve_header(self, curve, name, serial_number, format, limit, coefficient):
+        """
+        :param format: 1 = mV/K, 2 = V/K, 3 = Ohm/K, 4 = log Ohm/K
+        :param coefficient: 1 = negative, 2 = positive
+        """
+        self.send("CRVHDR {},{},{},{},{},{}".format(curve, name, serial_number, format, limit, coefficient))
+
+    @Write(validators={"curve": [ValidateInteger(), ValidateRange(min=21, max=59)],
+                       "index": [ValidateInteger(), ValidateRange(min=1, max=200)],
+                       "units": [ValidateReal()],
+                       "temperature": [ValidateReal()]})
+    def set_curve_data_point(self, curve, index, units, temperature):
+        self.send("CRVPT {},{},{},{}".format(curve, index, curves.point_value(units),
+                                             curves.point_value(temperature)))
+
+    @Write(validators={"curve": [ValidateInteger(), ValidateRange(min=21, max=59)]},
+           invalidates=('get_curve_header',))
+    def delete_curve(self, curve):
+        self.send("CRVDEL {}".format(curve))
+
+    def read_curve(self, curve, store=None):
+        """
+        Read all points of a curve as NumPy arrays (units, temperatures).
+
+        :param store: curves.CurveStore, if the curve is in the store it is not downloaded again
+        """
+        header = self.get_curve_header(curve)
+        if store is not None:
+            cached = store.get(header)
+            if cached is not None:
+                return cached
+
+        units, temperatures = curves.download_curve(self, curve)
+        if store is not None:
+            store.put(header, units, temperatures)
+        return units, temperatures
+
+    def write_curve(self, curve, points, name, serial_number, format, limit, coefficient, store=None):
+        """
+        Replace a user curve (21-59), read it back and check it (raises curves.CurveMismatch).
+
+        :param points: sequence of (units, temperature) pairs
+        :param store: curves.CurveStore, the points read back are stored
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.set_curve_header(curve, name, serial_number, format, limit, coefficient)
+        curves.upload_curve(self, curve, points[:, 0], points[:, 1])
+        units, temperatures = curves.download_curve(self, curve)
+        curves.check_points(curve, points[:, 0], points[:, 1], units, temperatures)
+        if store is not None:
+            store.put(self.get_curve_header(curve), units, temperatures)
+
     @Query(validators={"output": [ValidateInteger(), ValidateInArray((1, 2))]},
            processors=ProcessReal())
     def get_heater_output(self, output):
@@ -54,27 +139,76 @@ class LS350_Driver(Driver):
         return self.query("HTRST? {}".format(output))
 
     @Query(validators={"input": ValidateInArray(('A', 'B', 'C', 'D'))},
-           processors=ProcessInteger())
+           processors=ProcessCSV(names=('high status', 'low status'), processors=(ProcessInteger(), ProcessInteger())))
+    def get_input_alarm_status(self, input):
+        return self.query("ALARMST? {}".format(input))
+
+    @Query(processors=ProcessInteger())
+    def get_status_byte(self):
+        return self.query("*STB?")
+
+    @Write(validators={"mask": [ValidateInteger(), ValidateRange(min=0, max=255)]})
+    def set_service_request_enable(self, mask):
+        self.send("*SRE {}".format(mask))
+
+    @Query(processors=ProcessInteger())
+    def get_operation_event(self):
+        """Operation event register, cleared when read. Bit 0 = alarm."""
+        return self.query("OPST?")
+
+    @Query(processors=ProcessInteger())
+    def get_operation_condition(self):
+        return self.query("OPSTR?")
+
+    @Write(validators={"mask": [ValidateInteger(), ValidateRange(min=0, max=255)]})
+    def set_operation_event_enable(self, mask):
+        self.send("OPSTE {}".format(mask))
+
+    def enable_status_reporting(self):
+        # An alarm sets the operation summary bit, which requests service
+        self.set_operation_event_enable(OPERATION_ALARM)
+        self.set_service_request_enable(STATUS_OPERATION)
+
+    def read_status_summary(self):
+        # There is no status bit for heater faults, their status comes in the same message
+        with self.batch() as batch:
+            event = batch.get_operation_event()
+            condition = batch.get_operation_condition()
+            heaters = [(output, batch.get_heater_status(output)) for output in self.heater_outputs]
+        alarming = bool((event.value | condition.value) & OPERATION_ALARM)
+        return alarming, {output: status.value for output, status in heaters}
+
+    @Query(validators={"input": ValidateInArray(('A', 'B', 'C', 'D'))},
+           processors=ProcessInteger(), cache=60)
     def get_input_curve_number(self, input):
         return self.query("INCRV? {}".format(input))
 
+    @Write(validators={"input": ValidateInArray(('A', 'B', 'C', 'D')),
+                       "curve": [ValidateInteger(), ValidateRange(min=0, max=59)]},
+           invalidates=('get_input_curve_number',))
+    def set_input_curve_number(self, input, curve):
+        self.send("INCRV {},{}".format(input, curve))
+
     @Query(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))]},
            processors=ProcessCSV(names=("P", "I", "D"),
-                                 processors=(ProcessReal(), ProcessReal(), ProcessReal())))
+                                 processors=(ProcessReal(), ProcessReal(), ProcessReal())),
+           cache=60)
     def get_pid(self, output):
         return self.query("PID? {}".format(output))
 
     @Write(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))],
                        "p": [ValidateReal(), ValidateRange(min=0, max=9999.9)],
                        "i": [ValidateReal(), ValidateRange(min=0, max=9999.9)],
-                       "d": [ValidateReal(), ValidateRange(min=0, max=200)]})
+                       "d": [ValidateReal(), ValidateRange(min=0, max=200)]},
+           invalidates=('get_pid',))
     def set_pid(self, output, p, i, d):
         # TODO: Check if the PID parameters really change beyond p=1000, i=1000 (these are the limits in the manual)
         self.send("PID {},{},{},{}".format(output, p, i, d))
 
     @Query(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))]},
            processors=ProcessCSV(names=("on/off", "rate value"),
-                                 processors=(ProcessInteger(), ProcessReal())))
+                                 processors=(ProcessInteger(), ProcessReal())),
+           cache=60)
     def get_ramp_parameters(self, output):
         return self.query("RAMP? {}".format(output))
 
@@ -84,12 +218,13 @@ class LS350_Driver(Driver):
         return self.query("RAMPST? {}".format(output))
 
     @Query(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))]},
-           processors=ProcessInteger())
+           processors=ProcessInteger(), cache=60)
     def get_heater_range(self, output):
         return self.query("RANGE? {}".format(output))
 
     @Write(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))],
-                       "range": [ValidateInteger(), ValidateRange(min=1, max=5)]})
+                       "range": [ValidateInteger(), ValidateRange(min=1, max=5)]},
+           invalidates=('get_heater_range',))
     def set_heater_range(self, output, range):
         self.send("RANGE {},{}".format(output, range))
 
@@ -112,9 +247,21 @@ class LS350_Driver(Driver):
 
     @Write(validators={"output": [ValidateInteger(), ValidateInArray((1, 2, 3, 4))],
                        "on_off": ValidateInArray((0, 1)),
-                       "rate": [ValidateReal(), ValidateRange(min=0, max=100)]})
+                       "rate": [ValidateReal(), ValidateRange(min=0, max=100)]},
+           invalidates=('get_ramp_parameters',))
     def set_setpoint_ramp_parameters(self, output, on_off, rate):
         self.send("RAMP {},{},{}".format(output, on_off, rate))
 
     def set_setpoint_ramping_off(self, output):
-        self.set_setpoint_ramp_parameters(output, 0, 0);
\ No newline at end of file
+        self.set_setpoint_ramp_parameters(output, 0, 0);
+
+class AsyncLS350_Driver(async_driver_class(LS350_Driver)):
+    async def get_setpoint_celsius(self, output):
+        return await self.get_setpoint(output) - 273.15
+
+    async def set_setpoint_celsius(self, output, value):
+        # Assumes that the sensor units is set to Kelvin
+        await self.set_setpoint(output, value + 273.15)
+
+    async def set_setpoint_ramping_off(self, output):
+        await self.set_setpoint_ramp_parameters(output, 0, 0)
@@ -0,0 +1,45 @@
+"""
+Concurrent acquisition stage.
+
+The instrument poll and the pressure read are independent, so they run on separate workers and are joined into one
+record per cycle. The cycle takes as long as the slower of the two instead of their sum.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConcurrentSampler(object):
+    def __init__(self, poll, pressure_source, clock=time.time, failed_pressure=-1):
+        """
+        :param poll: callable returning a tuple of instrument readings
+        :param pressure_source: daq.PressureSource
+        :param clock: returns the timestamp of a record
+        :param failed_pressure: value recorded for every pressure channel when the pressure read fails
+        """
+        self.poll = poll
+        self.pressure_source = pressure_source
+        self.clock = clock
+        self.failed_pressure = failed_pressure
+        self.n_pressures = None
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sampler')
+
+    def read_pressures(self):
+        try:
+            pressures = tuple(self.pressure_source.read())
+            self.n_pressures = len(pressures)
+            return pressures
+        except Exception:
+            logging.exception('Pressure read failed')
+            return (self.failed_pressure,) * (self.n_pressures or 2)
+
+    def sample(self):
+        """Return (timestamp, *readings, *pressures) once both workers have finished."""
+        readings = self.executor.submit(self.poll)
+        pressures = self.executor.submit(self.read_pressures)
+        values = tuple(readings.result()) + pressures.result()
+        return (self.clock(),) + values
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pressure_source.close()
@@ -0,0 +1,156 @@
+"""
+Alarm and heater fault monitoring from the status registers of an instrument.
+
+Reading the alarm status of every input (ALARMST? 1 ... ALARMST? 8 on a Model 218) on every scan is a round trip per
+input. AlarmMonitor only reads one summary per scan, the operation event and condition registers of the Model 350
+together with the heater status in the same compound message, and reads the status of every input only while the
+summary shows an alarm (a new alarm on a second input does not change the summary, and clearing alarms must be seen
+too). The status byte of the Model 218 has no alarm bit, its summary is the alarm status of all inputs, batched in one
+compound message:
+    LS218 = mux.driver(LS218_Driver, NORMAL)
+    LS218.on_alarm(lambda input, status: logging.warning('Input {} alarm: {}'.format(input, status)))
+    LS218.alarm_monitor.start()
+
+Subscribing configures the service request enable registers so that an alarm requests service. Where the transport
+can wait for a service request (wait_for_srq of a pyvisa GPIB resource) and the driver's alarms request service
+(requests_service) the monitor sleeps until the instrument asks, with srq_timeout as a fallback scan; otherwise it
+scans every interval seconds. Heater faults of the Model 350 do not request service, they are seen on the next scan.
+
+The driver declares which inputs have alarms (alarm_inputs) and which outputs have a heater (heater_outputs), and
+implements enable_status_reporting() and read_status_summary() for its registers.
+
+The monitor runs in its own thread, so its driver must not be shared with another thread; a driver on a channel of a
+multiplexer.ResourceMultiplexer is safe.
+"""
+import logging
+import threading
+import time
+
+from transport import is_timeout
+
+ALARM = 'alarm'
+HEATER_FAULT = 'heater fault'
+
+HEATER_STATUS = {0: 'no error', 1: 'heater open load', 2: 'heater short'}
+
+
+class AlarmMonitor(object):
+    def __init__(self, driver, interval=1.0, use_srq=True, srq_timeout=5.0, sleep=time.sleep):
+        """
+        :param driver: driver with alarm_inputs, heater_outputs, enable_status_reporting() and read_status_summary()
+        :param interval: seconds between scans when the transport cannot wait for a service request
+        :param use_srq: wait for service requests where the transport supports it
+        :param srq_timeout: longest time in seconds to wait for a service request before scanning anyway
+        """
+        self.driver = driver
+        self.interval = interval
+        self.use_srq = use_srq
+        self.srq_timeout = srq_timeout
+        self.sleep = sleep
+
+        self.subscribers = {ALARM: [], HEATER_FAULT: []}
+        self.configured = False
+        self.alarming = False  # The last summary showed an alarm
+        self.alarm_states = {}  # Input -> status values last seen
+        self.heater_states = {}  # Output -> heater status code last seen
+        self.scans = 0
+        self.detail_reads = 0
+
+        self.running = False
+        self.thread = None
+
+    def subscribe(self, event, callback):
+        """
+        Call callback when event (ALARM or HEATER_FAULT) changes:
+            ALARM         callback(input, status) with the processed alarm status of the input
+            HEATER_FAULT  callback(output, code), see HEATER_STATUS; code 0 means the fault was cleared
+        """
+        if event not in self.subscribers:
+            raise ValueError('Unknown event {}, must be one of {}'.format(event, tuple(self.subscribers)))
+        self.subscribers[event].append(callback)
+        self.configured = False
+        return callback
+
+    def unsubscribe(self, event, callback):
+        self.subscribers[event].remove(callback)
+
+    def scan(self):
+        """Read the status summary, and the status of the inputs if needed. Returns the events found."""
+        if not self.configured:
+            self.driver.enable_status_reporting()
+            self.configured = True
+
+        self.scans += 1
+        alarming, heaters = self.driver.read_status_summary()
+        events = []
+        if self.subscribers[ALARM] and (alarming or self.alarming):
+            events.extend(self.read_alarms())
+        self.alarming = alarming
+
+        for output, code in heaters.items():
+            if code != self.heater_states.get(output, 0):
+                self.heater_states[output] = code
+                events.append((HEATER_FAULT, output, code))
+
+        for event, source, value in events:
+            for callback in self.subscribers[event]:
+                try:
+                    callback(source, value)
+                except Exception:
+                    logging.exception('{} callback for {} failed'.format(event, source))
+        return events
+
+    def read_alarms(self):
+        """Read the alarm status of every input in as few messages as possible, return the changes."""
+        self.detail_reads += 1
+        with self.driver.batch() as batch:
+            results = [(input, batch.get_input_alarm_status(input)) for input in self.driver.alarm_inputs]
+
+        events = []
+        for input, result in results:
+            status = result.value
+            values = tuple(status.values())
+            previous = self.alarm_states.get(input)
+            if previous is None:
+                previous = (0,) * len(values)
+            if values != previous:
+                self.alarm_states[input] = values
+                events.append((ALARM, input, status))
+        return events
+
+    def wait(self):
+        """Wait until the next scan is due: a service request where the transport supports it, else the interval."""
+        wait_for_srq = None
+        if self.use_srq and self.driver.requests_service:
+            wait_for_srq = getattr(self.driver.instrument, 'wait_for_srq', None)
+        if wait_for_srq is None:
+            self.sleep(self.interval)
+            return
+        try:
+            wait_for_srq(int(self.srq_timeout * 1000))
+        except Exception as e:
+            if not is_timeout(e):
+                raise
+
+    def run(self):
+        while self.running:
+            try:
+                self.scan()
+            except Exception:
+                logging.exception('Alarm scan of {} failed'.format(type(self.driver).__name__))
+            if self.running:
+                self.wait()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='alarms', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread after its current wait."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
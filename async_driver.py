@@ -0,0 +1,254 @@
+"""
+Asyncio version of the driver layer.
+
+AsyncDriver has the same pacing, batching and command classes as Driver but talks to the instrument through an
+AsyncTransport, so one event loop can poll many instruments at the same time.
+
+AsyncQuery and AsyncWrite decorate new coroutine commands. Existing Driver subclasses do not have to be rewritten:
+async_driver_class(LS350_Driver) builds an AsyncDriver subclass where every @Query/@Write method of the synchronous
+driver becomes a coroutine that composes the same message, awaits the transport and runs the same processors.
+
+Either way a command behaves like its synchronous twin: arguments are validated, cached queries are served from the
+driver's cache until they expire or a Write invalidates them, and a reply that cannot be processed is sent again as
+long as the transport can recover (see Driver.recover). Features and transactions are synchronous and are not
+available on an AsyncDriver.
+"""
+import asyncio
+import functools
+import time
+
+from cache import MISSING
+from driver import Driver, Query, Write
+from pacing import QUERY
+from processors import ProcessorError
+
+
+async def resend(driver, send, process, error):
+    """Send a query again after a reply that could not be processed, while the driver allows it (see Query.retry)."""
+    attempt = 1
+    while await driver.recover(attempt):
+        try:
+            return process(await send())
+        except ProcessorError as e:
+            error = e
+            attempt += 1
+    raise error
+
+
+class AsyncQuery(Query):
+    def __call__(self, func):
+        self.compile(func)
+        validate = self.validate
+        process = self.process
+        name = func.__name__
+        ttl = self.cache
+
+        @functools.wraps(func)
+        async def query(*args, **kwargs):
+            driver = args[0]
+            cached = ttl is not None and not kwargs
+            if cached:
+                val = driver.cache.get(name, args[1:])
+                if val is not MISSING:
+                    return val
+
+            validate(args, kwargs)
+            try:
+                val = process(driver, await func(*args, **kwargs))
+            except ProcessorError as e:
+                val = await resend(driver, lambda: func(*args, **kwargs), lambda val: process(driver, val), e)
+            if cached:
+                driver.cache.put(name, args[1:], val, ttl)
+            return val
+
+        query.process = self.process
+        query.query_command = self
+        return query
+
+
+class AsyncWrite(Write):
+    def __call__(self, func):
+        self.compile(func)
+        self.name = func.__name__
+        validate = self.validate
+        invalidate = self.invalidate
+
+        @functools.wraps(func)
+        async def write(*args, **kwargs):
+            validate(args, kwargs)
+            await func(*args, **kwargs)
+            invalidate(args)
+
+        write.write_command = self
+        return write
+
+
+class AsyncBatch(object):
+    """
+    Asynchronous counterpart of driver.Batch:
+        async with driver.batch() as batch:
+            temperature = batch.get_celsius_reading('A')
+        print(temperature.value)
+    """
+    def __init__(self, driver):
+        self.batch = driver.sync_batch()
+
+    def __getattr__(self, name):
+        return getattr(self.batch, name)
+
+    async def execute(self):
+        calls, self.batch.calls = self.batch.calls, []
+        values = await self.batch.driver.query_many([(method, args) for method, args, _ in calls])
+        for (_, _, result), value in zip(calls, values):
+            result.set(value)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.execute()
+
+
+class AsyncDriver(Driver):
+    def __init__(self, transport):
+        super().__init__(transport)
+        self.transport = transport
+        # Only one transaction may be in flight on an instrument at a time
+        self.lock = asyncio.Lock()
+
+    async def transaction(self, command_class, operation, message):
+        metrics = self.metrics
+        async with self.lock:
+            start = time.perf_counter()
+            await asyncio.sleep(self.pacer.remaining(command_class))
+            self.pacer.start(command_class)
+            sent = time.perf_counter()
+            try:
+                return await operation(message)
+            except Exception:
+                if metrics is not None:
+                    metrics.error(self.mnemonic(message))
+                raise
+            finally:
+                self.pacer.completed()
+                if metrics is not None:
+                    metrics.transaction(self.mnemonic(message), time.perf_counter() - sent, sent - start)
+
+    async def query(self, query_string):
+        val = await self.transaction(QUERY, self.transport.query, query_string)
+
+        if val is None or not val.strip():
+            self.pacer.failure(QUERY)
+            if self.metrics is not None:
+                self.metrics.error(self.mnemonic(query_string))
+        else:
+            self.pacer.success(QUERY)
+        return val
+
+    async def recover(self, attempt):
+        """Coroutine version of Driver.recover, the transport decides whether the query may be sent again."""
+        return await self.transport.recover(attempt)
+
+    async def send(self, message):
+        command_class = self.command_class(message)
+        await self.transaction(command_class, self.transport.write, message)
+        self.pacer.success(command_class)
+
+    def sync_batch(self):
+        return super().batch()
+
+    def batch(self):
+        return AsyncBatch(self)
+
+    async def query_many(self, calls):
+        results = [self.cached_result(method, args) for method, args in calls]
+        pending = [(i, method, args) for i, ((method, args), result) in enumerate(zip(calls, results))
+                   if result is MISSING]
+        messages = [method.compose(method.__self__, *args) for _, method, args in pending]
+
+        replies = []
+        for chunk in self.split_messages(messages):
+            reply = await self.query(self.compound_separator.join(chunk))
+            parts = reply.strip().split(self.compound_separator)
+            if len(parts) != len(chunk):
+                parts = [await self.query(message) for message in chunk]
+            replies.extend(parts)
+
+        for (i, method, args), message, reply in zip(pending, messages, replies):
+            try:
+                results[i] = self.process_reply(method, reply, message)
+            except ProcessorError as e:
+                # Send the query that was garbled again, on its own
+                results[i] = await resend(self, lambda: self.query(message),
+                                          lambda reply: self.process_reply(method, reply, message), e)
+            if method.query_command.cache is not None:
+                self.cache.put(method.__name__, tuple(args), results[i], method.query_command.cache)
+        return results
+
+    async def send_many(self, messages):
+        for chunk in self.split_messages(messages):
+            await self.send(self.compound_separator.join(chunk))
+
+    async def close(self):
+        await self.transport.close()
+
+
+def async_query(method):
+    command = method.query_command
+
+    name = method.__name__
+
+    @functools.wraps(method)
+    async def query(self, *args):
+        if command.cache is not None:
+            val = self.cache.get(name, args)
+            if val is not MISSING:
+                return val
+
+        message = method.compose(self, *args)
+        try:
+            val = self.process_reply(method, await self.query(message), message)
+        except ProcessorError as e:
+            val = await resend(self, lambda: self.query(message),
+                               lambda reply: self.process_reply(method, reply, message), e)
+        if command.cache is not None:
+            self.cache.put(name, args, val, command.cache)
+        return val
+
+    query.compose = method.compose
+    query.process = command.process
+    query.query_command = command
+    return query
+
+
+def async_write(method):
+    command = method.write_command
+
+    @functools.wraps(method)
+    async def write(self, *args):
+        await self.send(method.compose(self, *args))
+        command.invalidate((self,) + args)
+
+    write.compose = method.compose
+    write.write_command = method.write_command
+    return write
+
+
+def async_driver_class(driver_class):
+    """
+    Build an AsyncDriver subclass from the @Query/@Write commands of a synchronous Driver subclass.
+
+    Methods that are not decorated (e.g. helpers that combine several commands) are not converted and have to be
+    written as coroutines on the returned class.
+    """
+    namespace = {'eeprom_commands': driver_class.eeprom_commands,
+                 'input_buffer_size': driver_class.input_buffer_size,
+                 'compound_separator': driver_class.compound_separator}
+    for klass in reversed(driver_class.__mro__):
+        for name, value in vars(klass).items():
+            if hasattr(value, 'query_command'):
+                namespace[name] = async_query(value)
+            elif hasattr(value, 'write_command'):
+                namespace[name] = async_write(value)
+    return type('Async' + driver_class.__name__, (AsyncDriver,), namespace)
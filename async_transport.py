@@ -0,0 +1,113 @@
+"""
+Transports used by AsyncDriver.
+
+A transport moves messages to and from one instrument without blocking the event loop:
+    VisaTransport    wraps a pyvisa resource and runs its blocking calls in an executor
+    SerialTransport  talks to a serial port through asyncio streams (needs pyserial-asyncio)
+    MemoryTransport  wraps any object with query()/write() methods, e.g. a simulated instrument
+"""
+import asyncio
+
+
+class TransportError(Exception):
+    pass
+
+
+class AsyncTransport(object):
+    async def query(self, message):
+        raise NotImplementedError
+
+    async def write(self, message):
+        raise NotImplementedError
+
+    async def recover(self, attempt):
+        """
+        Called when a reply could not be processed, return True if the stream was resynchronised and the query may be
+        sent again (see Driver.recover).
+        """
+        return False
+
+    async def close(self):
+        pass
+
+
+class VisaTransport(AsyncTransport):
+    def __init__(self, resource, executor=None):
+        self.resource = resource
+        self.executor = executor  # None uses the event loop's default executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def query(self, message):
+        return await self._run(self.resource.query, message)
+
+    async def write(self, message):
+        await self._run(self.resource.write, message)
+
+    async def recover(self, attempt):
+        recover = getattr(self.resource, 'recover', None)
+        return recover is not None and bool(await self._run(recover, attempt))
+
+    async def close(self):
+        await self._run(self.resource.close)
+
+
+class SerialTransport(AsyncTransport):
+    def __init__(self, reader, writer, read_termination='\r\n', write_termination='\r\n', encoding='ascii',
+                 timeout=2.0):
+        self.reader = reader
+        self.writer = writer
+        self.read_termination = read_termination.encode(encoding)
+        self.write_termination = write_termination
+        self.encoding = encoding
+        self.timeout = timeout
+
+    @classmethod
+    async def open(cls, port, baudrate=9600, bytesize=7, parity='O', stopbits=1, **kwargs):
+        """Open a serial port, with the Lake Shore defaults of 7 data bits and odd parity."""
+        try:
+            import serial_asyncio
+        except ImportError as e:
+            raise TransportError("SerialTransport needs the pyserial-asyncio package") from e
+
+        reader, writer = await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate, bytesize=bytesize,
+                                                                     parity=parity, stopbits=stopbits)
+        return cls(reader, writer, **kwargs)
+
+    async def write(self, message):
+        self.writer.write((message + self.write_termination).encode(self.encoding))
+        await self.writer.drain()
+
+    async def query(self, message):
+        await self.write(message)
+        try:
+            reply = await asyncio.wait_for(self.reader.readuntil(self.read_termination), self.timeout)
+        except asyncio.TimeoutError as e:
+            raise TransportError("No reply to {!r} within {} s".format(message, self.timeout)) from e
+        return reply[:-len(self.read_termination)].decode(self.encoding)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class MemoryTransport(AsyncTransport):
+    def __init__(self, resource, latency=0.0):
+        self.resource = resource
+        self.latency = latency
+
+    async def query(self, message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.resource.query(message)
+
+    async def write(self, message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.resource.write(message)
+
+    async def recover(self, attempt):
+        recover = getattr(self.resource, 'recover', None)
+        return recover is not None and bool(recover(attempt))
@@ -0,0 +1,72 @@
+"""
+Benchmark of the ProcessCSV output modes against the original dict path.
+
+The "legacy dict" numbers use a copy of the original ProcessCSV, which dispatched on TypeError for every field.
+
+Usage:
+    python benchmark_csv.py [number of calls]
+"""
+import sys
+import timeit
+
+from processors import ProcessCSV, ProcessInteger, ProcessReal
+
+
+class LegacyProcessCSV(object):
+    def __init__(self, names, processors=None, strip=True):
+        self.strip = strip
+        self.param_names = names
+        self.processors = processors
+
+    def __call__(self, value):
+        values = value.split(',')
+        result = {}
+        for i, (name, val) in enumerate(zip(self.param_names, values)):
+            if self.strip:
+                val = val.strip()
+            if self.processors is not None:
+                try:
+                    for processor in self.processors[i]:
+                        val = processor(val)
+                except TypeError:
+                    if self.processors[i] is not None:
+                        val = self.processors[i](val)
+            result[name] = val
+        return result
+
+
+ALL_INPUTS = ('input 1', 'input 2', 'input 3', 'input 4', 'input 5', 'input 6', 'input 7', 'input 8')
+ALL_READING = '+21.850,+11.850,+1.850,-8.150,-18.150,-28.150,-38.150,-48.150'
+ALARM_NAMES = ('off_on', 'source', 'high value', 'low value', 'deadband', 'latch enable')
+ALARM_PROCESSORS = (ProcessInteger(), ProcessInteger(), ProcessReal(), ProcessReal(), ProcessReal(), ProcessInteger())
+ALARM_READING = '1,1,+300.000,+4.000,+1.000,0'
+
+CASES = (
+    ('8 inputs, strings', ALL_READING, LegacyProcessCSV(ALL_INPUTS), (('dict', ProcessCSV(ALL_INPUTS)),)),
+    ('8 inputs, reals', ALL_READING, LegacyProcessCSV(ALL_INPUTS, (ProcessReal(),) * 8),
+     (('dict', ProcessCSV(ALL_INPUTS, (ProcessReal(),) * 8)),
+      ('record', ProcessCSV(ALL_INPUTS, (ProcessReal(),) * 8, output='record')),
+      ('array', ProcessCSV(ALL_INPUTS, output='array')))),
+    ('alarm parameters', ALARM_READING, LegacyProcessCSV(ALARM_NAMES, ALARM_PROCESSORS),
+     (('dict', ProcessCSV(ALARM_NAMES, ALARM_PROCESSORS)),
+      ('record', ProcessCSV(ALARM_NAMES, ALARM_PROCESSORS, output='record')),
+      ('array', ProcessCSV(ALARM_NAMES, ALARM_PROCESSORS, output='array')))),
+)
+
+
+def measure(processor, value, number):
+    return min(timeit.repeat(lambda: processor(value), number=number, repeat=3)) / number * 1e6
+
+
+def main(number=20000):
+    print('{:<20} {:<14} {:>10} {:>8}'.format('reply', 'output', 'time (us)', 'speedup'))
+    for label, value, legacy, processors in CASES:
+        reference = measure(legacy, value, number)
+        print('{:<20} {:<14} {:>10.2f} {:>8}'.format(label, 'legacy dict', reference, ''))
+        for output, processor in processors:
+            duration = measure(processor, value, number)
+            print('{:<20} {:<14} {:>10.2f} {:>7.1f}x'.format('', output, duration, reference / duration))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,114 @@
+"""
+Microbenchmark of the per-call overhead added by the Query/Write decorators.
+
+The "before" numbers use a copy of the original decorators that inspected the signature and dispatched on TypeError on
+every call, the "after" numbers use the decorators in driver.py that compile their plan when they are applied. The
+instrument is replaced by a resource that answers immediately and pacing is disabled, so only the decorator cost is
+measured. Only uncached queries are used, a cache hit would not exercise the decorator. The "metrics" numbers are the
+"after" numbers with driver.enable_metrics(), i.e. the cost of the instrumentation.
+
+Usage:
+    python benchmark_decorators.py [number of calls]
+"""
+import inspect
+import sys
+import timeit
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from pacing import NullPacer
+
+
+class LegacyQuery(object):
+    def __init__(self, validators=None, processors=None):
+        self.processors = processors
+        self.validators = validators
+
+    def validate(self, func, *args):
+        signature = inspect.signature(func)
+        if self.validators is not None:
+            for name, value in zip(signature.parameters.keys(), args):
+                validators = self.validators.get(name)
+                if validators is None:
+                    continue
+                try:
+                    for validator in validators:
+                        validator(value)
+                except TypeError:
+                    validators(value)
+
+    def __call__(self, func):
+        def query(*args):
+            self.validate(func, *args)
+            val = func(*args)
+            if self.processors is not None:
+                try:
+                    for processor in self.processors:
+                        val = processor(val)
+                except TypeError:
+                    val = self.processors(val)
+            return val
+        return query
+
+
+class LegacyWrite(LegacyQuery):
+    def __call__(self, func):
+        def write(*args):
+            self.validate(func, *args)
+            func(*args)
+        return write
+
+
+class ImmediateResource(object):
+    def __init__(self, replies):
+        self.replies = replies
+
+    def query(self, message):
+        return self.replies[message.split()[0]]
+
+    def write(self, message):
+        pass
+
+
+def legacy(method):
+    """Re-decorate the undecorated function behind method with the original decorators."""
+    func = method.__wrapped__
+    if hasattr(method, 'query_command'):
+        command = method.query_command
+        return LegacyQuery(command.validators, command.processors)(func)
+    return LegacyWrite(method.write_command.validators)(func)
+
+
+CASES = (
+    (LS218_Driver, 'get_celsius_reading', (3,)),
+    (LS218_Driver, 'get_input_alarm_status', (2,)),
+    (LS218_Driver, 'set_input_alarm_parameters', (1, 1, 1, 300.0, 4.0, 1.0, 0)),
+    (LS350_Driver, 'get_celsius_reading', ('A',)),
+    (LS350_Driver, 'get_setpoint', (1,)),
+    (LS350_Driver, 'get_curve_data_point', (21, 7)),
+    (LS350_Driver, 'set_pid', (1, 50.0, 20.0, 0.0)),
+    (LS350_Driver, 'set_setpoint', (2, 295.0)),
+)
+
+REPLIES = {'CRDG?': '+25.000', 'ALARMST?': '0,1', 'SETP?': '+295.000', 'CRVPT?': '+0.12345,+295.000'}
+
+
+def main(number=20000):
+    print('{:<15} {:<30} {:>12} {:>12} {:>8} {:>12}'.format('driver', 'method', 'before (us)', 'after (us)', 'speedup',
+                                                             'metrics (us)'))
+    for driver_class, name, args in CASES:
+        driver = driver_class(ImmediateResource(REPLIES))
+        driver.pacer = NullPacer()
+
+        method = getattr(driver, name)
+        old = legacy(method)
+        before = min(timeit.repeat(lambda: old(driver, *args), number=number, repeat=3)) / number * 1e6
+        after = min(timeit.repeat(lambda: method(*args), number=number, repeat=3)) / number * 1e6
+        driver.enable_metrics()
+        instrumented = min(timeit.repeat(lambda: method(*args), number=number, repeat=3)) / number * 1e6
+        print('{:<15} {:<30} {:>12.2f} {:>12.2f} {:>7.1f}x {:>12.2f}'.format(driver_class.__name__, name, before, after,
+                                                                                before / after, instrumented))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
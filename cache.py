@@ -0,0 +1,71 @@
+"""
+Per-driver cache of Query results.
+
+A query opts in with Query(cache=ttl), where ttl is the number of seconds a result stays valid (True keeps it until it
+is invalidated). Results are keyed by method name and arguments. A Write declares which queries it makes stale with
+Write(invalidates=(...)): only the entries whose arguments agree with the write's arguments of the same name are
+evicted, so set_pid(1, ...) evicts get_pid(1) but not get_pid(2). Write(invalidates=ALL) empties the cache.
+
+A cache can be shared by several drivers of the same instrument in different threads (see
+multiplexer.ResourceMultiplexer): every method only iterates over a snapshot of the entries.
+"""
+import copy
+import time
+
+# Passed as invalidates to evict every cached result (e.g. after a reset)
+ALL = '*'
+
+MISSING = object()
+
+
+class QueryCache(object):
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.entries = {}  # name -> {args: (value, expiry)}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name, args):
+        """Return the cached value, or MISSING."""
+        entry = self.entries.get(name, {}).get(args)
+        if entry is None or entry[1] < self.clock():
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        # Callers get their own copy so that modifying a result (e.g. a dict) does not modify the cache
+        return copy.copy(entry[0])
+
+    def put(self, name, args, value, ttl):
+        expiry = float('inf') if ttl is True else self.clock() + ttl
+        self.entries.setdefault(name, {})[args] = (copy.copy(value), expiry)
+
+    def invalidate(self, name, match=None):
+        """
+        Evict cached results of name.
+
+        :param match: dict of {argument position: value}, only entries with these argument values are evicted
+        """
+        entries = self.entries.get(name)
+        if not entries:
+            return
+        if not match:
+            self.evictions += len(entries)
+            entries.clear()
+            return
+        for args in [args for args in list(entries)
+                     if all(args[i] == value for i, value in match.items() if i < len(args))]:
+            if entries.pop(args, None) is not None:
+                self.evictions += 1
+
+    def clear(self):
+        self.evictions += sum(len(entries) for entries in list(self.entries.values()))
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': sum(len(entries) for entries in list(self.entries.values())),
+                'hit rate': self.hits / lookups if lookups else 0.0}
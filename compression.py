@@ -0,0 +1,205 @@
+"""
+Compression of the recorded samples before they are written to the data log.
+
+During a soak nothing changes for an hour, yet every sample is written. RecordCompressor only passes on the records
+that are needed to rebuild every column within its tolerance:
+    - DEADBAND columns (setpoints) are rebuilt by holding the last stored value, a record is stored when the value moves
+      away from it by more than the tolerance
+    - SWINGING_DOOR columns (temperatures, sensor readings, pressures) are rebuilt by linear interpolation between the
+      stored records. The door is the range of slopes from the last stored record that pass within the tolerance of
+      every record since; while a new record lies inside the door it is held back, when it falls outside the held
+      record is stored and the door starts again from it
+Records are stored whole, so the door of every column restarts from any stored record. At least one record is stored
+every heartbeat seconds, which also shows that the acquisition was running, and records with NaN values are stored
+as they are.
+
+CompressedLog puts a compressor in front of a datalog.BinaryLogWriter, with the same write/segment/close interface,
+and stores the held record at every segment marker so that the segments keep their exact ends:
+    compressor = RecordCompressor(COLUMNS, {'Sample Setpoint (C)': (DEADBAND, 0.001),
+                                            'Sample Temperature (C)': (SWINGING_DOOR, 0.01)}, heartbeat=60)
+    station = Station(LS350, pressure_source, CompressedLog(data_log, compressor), ...)
+
+resample() rebuilds the columns on a uniform time grid from the stored records.
+"""
+import numpy as np
+
+DEADBAND = 'deadband'
+SWINGING_DOOR = 'swinging door'
+
+
+class RecordCompressor(object):
+    def __init__(self, columns, tolerances, heartbeat=None):
+        """
+        :param columns: names of the columns, the first one is the time
+        :param tolerances: dict of column name -> (DEADBAND or SWINGING_DOOR, tolerance); columns that are not listed
+                           are kept exactly (a record is stored whenever they change)
+        :param heartbeat: longest time in seconds between stored records, None for no limit
+        """
+        self.columns = tuple(columns)
+        self.heartbeat = heartbeat
+        unknown = set(tolerances) - set(self.columns[1:])
+        if unknown:
+            raise KeyError('Unknown columns {}'.format(sorted(unknown)))
+
+        n = len(self.columns) - 1
+        self.tolerance = np.zeros(n)
+        self.door = np.zeros(n, dtype=bool)  # Swinging door columns, the others use a deadband
+        for index, name in enumerate(self.columns[1:]):
+            kind, tolerance = tolerances.get(name, (DEADBAND, 0.0))
+            if kind not in (DEADBAND, SWINGING_DOOR):
+                raise ValueError('Unknown compression {!r} for {}'.format(kind, name))
+            self.tolerance[index] = tolerance
+            self.door[index] = kind == SWINGING_DOOR
+
+        self.received = 0
+        self.stored = 0
+        self.reset()
+
+    def reset(self):
+        """Start again, the next record is stored."""
+        self.archived = None  # Last stored record
+        self.held = None  # Last record received and not stored
+        self.upper = np.full(len(self.tolerance), -np.inf)  # Bounds of the door
+        self.lower = np.full(len(self.tolerance), np.inf)
+
+    def restart(self, record):
+        self.archived = record
+        self.held = None
+        self.upper[:] = -np.inf
+        self.lower[:] = np.inf
+
+    def slopes(self, record):
+        """Slopes from the last stored record to record and to its tolerance band."""
+        # Records at the same time only fit in the door if they have the same values
+        dt = max(record[0] - self.archived[0], 1e-9)
+        difference = record[1:] - self.archived[1:]
+        return difference / dt, (difference - self.tolerance) / dt, (difference + self.tolerance) / dt
+
+    def must_store(self, record):
+        """True when record cannot be held back after the last stored record."""
+        if np.isnan(record).any() or np.isnan(self.archived).any():
+            return True
+        if self.heartbeat is not None and record[0] - self.archived[0] >= self.heartbeat:
+            return True
+        deadband = ~self.door
+        return bool((np.abs(record[1:][deadband] - self.archived[1:][deadband]) > self.tolerance[deadband]).any())
+
+    def in_door(self, slope):
+        door = self.door
+        return bool(((slope[door] >= self.upper[door]) & (slope[door] <= self.lower[door])).all())
+
+    def add(self, record):
+        """Return the records to store (none, one or two) after record was received."""
+        record = np.array(record, dtype=float)
+        self.received += 1
+        if self.archived is None:
+            self.restart(record)
+            return self.store([record])
+
+        stored = []
+        slope, upper, lower = self.slopes(record)
+        if self.held is not None and not self.in_door(slope):
+            # The held record is the last one the line from the stored record passes within tolerance of
+            stored.append(self.held)
+            self.restart(self.held)
+            slope, upper, lower = self.slopes(record)
+
+        if self.must_store(record):
+            stored.append(record)
+            self.restart(record)
+        else:
+            self.held = record
+            np.maximum(self.upper, upper, out=self.upper)
+            np.minimum(self.lower, lower, out=self.lower)
+        return self.store(stored)
+
+    def flush(self):
+        """Return the held record, if any, and start again."""
+        stored = [self.held] if self.held is not None else []
+        self.reset()
+        return self.store(stored)
+
+    def store(self, records):
+        self.stored += len(records)
+        return records
+
+    @property
+    def ratio(self):
+        """Records received per record stored."""
+        return self.received / self.stored if self.stored else 0.0
+
+
+class CompressedLog(object):
+    """Data log that only writes the records a RecordCompressor keeps."""
+    def __init__(self, data_log, compressor):
+        self.data_log = data_log
+        self.compressor = compressor
+
+    def write(self, record):
+        for stored in self.compressor.add(record):
+            self.data_log.write(stored)
+
+    def segment(self, text):
+        self.flush_held()
+        self.data_log.segment(text)
+
+    def flush_held(self):
+        for stored in self.compressor.flush():
+            self.data_log.write(stored)
+
+    def flush(self):
+        self.flush_held()
+        self.data_log.flush()
+
+    def close(self):
+        self.flush_held()
+        self.data_log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def resample(records, columns, tolerances, interval, start=None, end=None, max_gap=None):
+    """
+    Rebuild compressed records on a uniform time grid.
+
+    :param records: stored records (n_records x n_columns), the time in the first column
+    :param tolerances: the tolerances the records were compressed with, to know which columns are interpolated
+                       (SWINGING_DOOR) and which hold their last value (DEADBAND and columns without tolerance)
+    :param interval: seconds between the points of the grid
+    :param max_gap: the points of the grid in a gap between stored records longer than this are NaN, e.g. where
+                    nothing was recorded between two segments; the compression heartbeat plus the sampling interval
+                    is a good choice
+    :return: array (n_points x n_columns), the grid in the first column
+    """
+    records = np.asarray(records, dtype=float)
+    if not len(records):
+        return np.empty((0, len(columns)))
+    times = records[:, 0]
+    start = times[0] if start is None else start
+    end = times[-1] if end is None else end
+    grid = np.arange(start, end + interval / 2, interval)
+
+    result = np.empty((len(grid), len(columns)))
+    result[:, 0] = grid
+    # Index of the last stored record at or before every point
+    previous = np.searchsorted(times, grid, side='right') - 1
+    outside = (previous < 0) | (grid > times[-1])
+    for index, name in enumerate(columns[1:], 1):
+        kind = tolerances.get(name, (DEADBAND, 0.0))[0]
+        if kind == DEADBAND:
+            result[:, index] = records[np.clip(previous, 0, None), index]
+        else:
+            result[:, index] = np.interp(grid, times, records[:, index])
+    result[outside, 1:] = np.nan
+
+    if max_gap is not None:
+        gaps = np.diff(times) > max_gap
+        inside_gap = np.zeros(len(grid), dtype=bool)
+        inner = (previous >= 0) & (previous < len(times) - 1)
+        inside_gap[inner] = gaps[previous[inner]] & (grid[inner] > times[previous[inner]])
+        result[inside_gap, 1:] = np.nan
+    return result
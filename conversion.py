@@ -0,0 +1,171 @@
+"""
+Convert raw sensor readings to temperatures on the host.
+
+Asking the controller for CRDG?, KRDG? and SRDG? of the same input costs three transactions for one measurement.
+CurveConverter reads the calibration curve assigned to each input once (INCRV?, CRVHDR? and the curve points, see
+LS350_Driver.read_curve) and from then on converts the SRDG? reading locally by linear interpolation in the curve, in
+log10 of the units for log Ohm curves (format 4), like the controller does. Only one query per input is left:
+    converter = CurveConverter(LS350, store=CurveStore('curves'))
+    with LS350.batch() as batch:
+        A = converter.add(batch, 'A')
+        B = converter.add(batch, 'B')
+    print(A.sensor, A.kelvin, B.celsius)
+
+With validate=True the KRDG? reading is fetched in the same batch and compared with the local conversion; readings that
+differ by more than the tolerance are logged, which shows whether the local conversion can be trusted for a setup.
+
+A reading outside the curve cannot be interpolated. Its temperature is then taken from the controller (the KRDG? of
+the batch in validation mode, one extra KRDG? query otherwise) and a warning is logged when an input leaves the curve.
+
+The curve of an input is looked up once per reading, when it is added to a batch. Its number is read through the
+driver's query cache, so a curve assigned with set_input_curve_number() is picked up by the readings added once the
+cached number expires or is invalidated.
+"""
+import logging
+
+import numpy as np
+
+LOG_OHM = 4  # Curve format that stores log10 of the resistance
+
+
+class ConversionError(Exception):
+    pass
+
+
+class CurveTable(object):
+    def __init__(self, number, header, units, temperatures):
+        self.number = number
+        self.header = header
+        self.log = header['format'] == LOG_OHM
+        # np.interp needs increasing units, curves of sensors with a negative coefficient decrease
+        order = np.argsort(units)
+        self.units = np.asarray(units, dtype=float)[order]
+        self.temperatures = np.asarray(temperatures, dtype=float)[order]
+
+    def kelvin(self, sensor):
+        """Temperature (K) for the sensor reading(s), NaN outside the curve."""
+        sensor = np.asarray(sensor, dtype=float)
+        if self.log:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sensor = np.log10(sensor)
+        return np.interp(sensor, self.units, self.temperatures, left=np.nan, right=np.nan)
+
+
+class Reading(object):
+    """Sensor reading of one input added to a batch, converted once the batch has been executed."""
+    def __init__(self, converter, input, table, sensor, reference=None):
+        """:param table: CurveTable of the curve assigned to input when the reading was added"""
+        self.converter = converter
+        self.input = input
+        self.table = table
+        self.result = sensor
+        self.reference = reference  # BatchResult of KRDG? in validation mode
+
+    @property
+    def sensor(self):
+        return self.result.value
+
+    @property
+    def kelvin(self):
+        kelvin = float(self.table.kelvin(self.sensor))
+        if np.isnan(kelvin):
+            return self.converter.outside_curve(self.input, self.sensor, self.reference, self.table)
+        self.converter.inside_curve(self.input)
+        if self.reference is not None:
+            self.converter.check(self.input, kelvin, self.reference.value)
+        return kelvin
+
+    @property
+    def celsius(self):
+        return self.kelvin - 273.15
+
+
+class CurveConverter(object):
+    def __init__(self, driver, store=None, validate=False, tolerance=0.05):
+        """
+        :param driver: driver with read_curve (e.g. LS350_Driver)
+        :param store: curves.CurveStore so that curves are not downloaded again on the next run
+        :param validate: also query KRDG? and compare it with the local conversion
+        :param tolerance: largest difference (K) with KRDG? that is not reported
+        """
+        self.driver = driver
+        self.store = store
+        self.validate = validate
+        self.tolerance = tolerance
+        self.tables = {}  # Curve number -> CurveTable
+
+        self.checked = 0
+        self.mismatches = 0
+        self.max_error = 0.0
+        self.outside = set()  # Inputs whose last reading was outside their curve
+        self.outside_readings = 0
+
+    def table(self, input):
+        number = self.driver.get_input_curve_number(input)
+        if number == 0:
+            raise ConversionError('No curve is assigned to input {}'.format(input))
+        table = self.tables.get(number)
+        if table is None:
+            header = self.driver.get_curve_header(number)
+            units, temperatures = self.driver.read_curve(number, store=self.store)
+            if not len(units):
+                raise ConversionError('Curve {} of input {} has no points'.format(number, input))
+            table = self.tables[number] = CurveTable(number, header, units, temperatures)
+        return table
+
+    def reload(self):
+        """Forget the curves, e.g. after a curve was rewritten."""
+        self.tables.clear()
+
+    def kelvin(self, input, sensor):
+        """Convert sensor reading(s) of input to K."""
+        return self.table(input).kelvin(sensor)
+
+    def celsius(self, input, sensor):
+        return self.kelvin(input, sensor) - 273.15
+
+    def add(self, batch, input):
+        """Add the queries for a reading of input to a driver batch, return a Reading."""
+        # Load the curve now, so that its queries are not mixed into the batch
+        table = self.table(input)
+        reference = batch.get_kelvin_reading(input) if self.validate else None
+        return Reading(self, input, table, batch.get_sensor_reading(input), reference)
+
+    def read(self, *inputs):
+        """Read and convert inputs in one compound query, return a list of (sensor, K) pairs."""
+        with self.driver.batch() as batch:
+            readings = [self.add(batch, input) for input in inputs]
+        return [(reading.sensor, reading.kelvin) for reading in readings]
+
+    def outside_curve(self, input, sensor, reference=None, table=None):
+        """
+        Temperature (K) of a reading outside the curve of input, from the controller.
+
+        :param table: CurveTable the reading was converted with, the curve assigned to input by default
+        """
+        self.outside_readings += 1
+        if input not in self.outside:
+            self.outside.add(input)
+            if table is None:
+                table = self.table(input)
+            logging.warning('Sensor reading {} of input {} is outside curve {}, using the controller\'s '
+                            'temperature'.format(sensor, input, table.number))
+        if reference is not None:
+            return reference.value
+        return self.driver.get_kelvin_reading(input)
+
+    def inside_curve(self, input):
+        if input in self.outside:
+            self.outside.discard(input)
+            logging.info('Input {} is back inside its curve'.format(input))
+
+    def check(self, input, kelvin, reference):
+        self.checked += 1
+        error = abs(kelvin - reference)
+        if np.isnan(error):
+            error = np.inf
+        self.max_error = max(self.max_error, error)
+        if error > self.tolerance:
+            self.mismatches += 1
+            logging.warning('Local conversion of input {} gives {} K, the controller {} K'.format(input, kelvin,
+                                                                                                 reference))
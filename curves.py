@@ -0,0 +1,117 @@
+"""
+Bulk transfer of calibration curves and a local curve store.
+
+Reading a curve point by point costs one round trip per point. download_curve pipelines the CRVPT? queries through
+Driver.query_many, so several points travel in each message, and stops at the end of the curve (the first point of
+(0, 0)). upload_curve does the same for CRVPT writes with Driver.send_many.
+
+The values are sent in fixed point notation with up to SENT_DIGITS significant digits. The instrument keeps
+INSTRUMENT_DIGITS of them. check_points compares a curve read back from the instrument with the points that were sent,
+within that precision.
+
+CurveStore keeps downloaded curves on disk keyed by the name and serial number in the curve header, so a curve that
+has not changed is never downloaded again.
+"""
+import json
+import os
+import re
+
+import numpy as np
+
+MAX_POINTS = 200
+# Significant digits the instrument keeps of the sensor units and of the temperature of a point
+INSTRUMENT_DIGITS = 6
+# Significant digits sent, more than the instrument keeps so that it does the only rounding
+SENT_DIGITS = 10
+
+
+class CurveMismatch(ValueError):
+    pass
+
+
+def point_value(value):
+    """Format a sensor units or temperature value of a curve point, without exponent."""
+    return np.format_float_positional(value, precision=SENT_DIGITS, unique=True, fractional=False, trim='-')
+
+
+def download_curve(driver, curve, block=20):
+    """
+    Read all points of curve.
+
+    :param block: number of points asked for before checking for the end of the curve
+    :return: (units, temperatures) as NumPy arrays
+    """
+    units = []
+    temperatures = []
+    for start in range(1, MAX_POINTS + 1, block):
+        indices = range(start, min(start + block, MAX_POINTS + 1))
+        points = driver.query_many([(driver.get_curve_data_point, (curve, index)) for index in indices])
+        for point in points:
+            if point['units value'] == 0 and point['temp value'] == 0:
+                return np.array(units), np.array(temperatures)
+            units.append(point['units value'])
+            temperatures.append(point['temp value'])
+    return np.array(units), np.array(temperatures)
+
+
+def upload_curve(driver, curve, units, temperatures):
+    """Write the points of a curve, followed by the (0, 0) point that ends it if there is room."""
+    units = np.asarray(units, dtype=float)
+    temperatures = np.asarray(temperatures, dtype=float)
+    if units.shape != temperatures.shape or units.ndim != 1:
+        raise ValueError("units and temperatures must be one dimensional arrays of the same length")
+    if len(units) > MAX_POINTS:
+        raise ValueError("A curve has at most {} points, got {}".format(MAX_POINTS, len(units)))
+
+    compose = driver.set_curve_data_point.compose
+    messages = [compose(driver, curve, index, float(unit), float(temperature))
+                for index, (unit, temperature) in enumerate(zip(units, temperatures), start=1)]
+    if len(units) < MAX_POINTS:
+        messages.append(compose(driver, curve, len(units) + 1, 0.0, 0.0))
+    driver.send_many(messages)
+
+
+def check_points(curve, units, temperatures, read_units, read_temperatures):
+    """Raise CurveMismatch if the points read back differ from those sent by more than the instrument's rounding."""
+    units = np.asarray(units, dtype=float)
+    temperatures = np.asarray(temperatures, dtype=float)
+    if len(read_units) != len(units):
+        raise CurveMismatch('Curve {} has {} points, {} were written'.format(curve, len(read_units), len(units)))
+    rtol = 10.0 ** (1 - INSTRUMENT_DIGITS)
+    for name, sent, read in (('units', units, read_units), ('temperature', temperatures, read_temperatures)):
+        wrong = ~np.isclose(read, sent, rtol=rtol, atol=0.0)
+        if wrong.any():
+            index = int(np.argmax(wrong))
+            raise CurveMismatch('Point {} of curve {} has {} {}, {} was written'.format(
+                index + 1, curve, name, read[index], sent[index]))
+
+
+class CurveStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, header):
+        key = '{}_{}'.format(header['name'], header['SN'])
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', key) + '.npz')
+
+    def get(self, header):
+        """Return (units, temperatures) of the curve with this header, or None if it is not in the store."""
+        if not header['name']:
+            return None
+        try:
+            with np.load(self.path(header)) as data:
+                if json.loads(str(data['header'])) != header:
+                    return None
+                return data['units'], data['temperatures']
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, header, units, temperatures):
+        if not header['name']:
+            # Empty curve slots have no name to key them by
+            return
+        path = self.path(header)
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, header=json.dumps(header), units=units, temperatures=temperatures)
+        os.replace(temporary, path)
@@ -0,0 +1,256 @@
+"""
+Pressure acquisition from the NI-DAQ.
+
+The measurement code only needs a PressureSource, something whose read() returns the latest pressures in mbar:
+    FinitePressureSource      arms a finite nidaqmx task and reads it on every call
+    ContinuousPressureSource  streams samples from a SampleReader into a ring buffer on a background thread and keeps
+                              the statistics of the latest block, so read() returns immediately
+    StaticPressureSource      stands in for the DAQ with fixed values
+
+SampleReader hides the hardware: NIDAQReader reads a continuous nidaqmx task, SyntheticReader generates a signal so
+that the continuous acquisition can be exercised without a DAQ.
+"""
+import threading
+import time
+
+import numpy as np
+
+# Conversion from gauge voltage to mbar for the two pressure channels
+PRESSURE_GAINS = (1.33322 * 1, 1.33322 * 100)
+PRESSURE_CHANNELS = ('Dev1/ai29', 'Dev1/ai21')
+
+
+def create_pressure_task(channels=PRESSURE_CHANNELS, rate=1000, samples=100):
+    """Create a finite acquisition task reading samples points per channel at rate Hz."""
+    import nidaqmx
+    from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+
+    task = nidaqmx.Task()
+    for channel in channels:
+        task.ai_channels.add_ai_voltage_chan(channel, terminal_config=TerminalConfiguration.RSE, min_val=-10, max_val=10)
+    task.timing.cfg_samp_clk_timing(rate=rate, sample_mode=AcquisitionType.FINITE, samps_per_chan=samples)
+    return task
+
+
+class PressureSource(object):
+    def read(self):
+        """Return a tuple with one pressure (mbar) per channel."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FinitePressureSource(PressureSource):
+    def __init__(self, task, samples=100, gains=PRESSURE_GAINS):
+        self.task = task
+        self.samples = samples
+        self.gains = gains
+
+    def read(self):
+        data = self.task.read(number_of_samples_per_channel=self.samples)
+        return tuple(np.mean(channel) * gain for channel, gain in zip(data, self.gains))
+
+    def close(self):
+        self.task.close()
+
+
+class StaticPressureSource(PressureSource):
+    """Stand-in for the DAQ that returns fixed pressures, optionally taking acquisition_time to do so."""
+    def __init__(self, pressures=(0.0, 0.0), acquisition_time=0.0):
+        self.pressures = tuple(pressures)
+        self.acquisition_time = acquisition_time
+
+    def read(self):
+        if self.acquisition_time:
+            time.sleep(self.acquisition_time)
+        return self.pressures
+
+
+class SampleReader(object):
+    channels = 2
+    rate = 1000.0
+
+    def start(self):
+        pass
+
+    def read_into(self, buffer):
+        """Fill buffer, of shape (channels, samples), with the next samples and return the number of samples read."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NIDAQReader(SampleReader):
+    def __init__(self, channels=PRESSURE_CHANNELS, rate=1000, buffer_size=10000, timeout=10.0):
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+        from nidaqmx.stream_readers import AnalogMultiChannelReader
+
+        self.channels = len(channels)
+        self.rate = rate
+        self.timeout = timeout
+        self.task = nidaqmx.Task()
+        for channel in channels:
+            self.task.ai_channels.add_ai_voltage_chan(channel, terminal_config=TerminalConfiguration.RSE, min_val=-10,
+                                                      max_val=10)
+        self.task.timing.cfg_samp_clk_timing(rate=rate, sample_mode=AcquisitionType.CONTINUOUS,
+                                             samps_per_chan=buffer_size)
+        self.reader = AnalogMultiChannelReader(self.task.in_stream)
+
+    def start(self):
+        self.task.start()
+
+    def read_into(self, buffer):
+        return self.reader.read_many_sample(buffer, number_of_samples_per_channel=buffer.shape[1],
+                                            timeout=self.timeout)
+
+    def close(self):
+        self.task.stop()
+        self.task.close()
+
+
+class SyntheticReader(SampleReader):
+    def __init__(self, signal=None, channels=2, rate=1000.0, realtime=True):
+        """
+        :param signal: callable taking an array of times (s) and returning an array of shape (channels, len(times));
+                       by default every channel is a constant 1 V
+        :param realtime: deliver samples no faster than a real DAQ sampling at rate would
+        """
+        self.signal = signal
+        self.channels = channels
+        self.rate = rate
+        self.realtime = realtime
+        self.n_samples = 0
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.monotonic()
+
+    def read_into(self, buffer):
+        n = buffer.shape[1]
+        times = (self.n_samples + np.arange(n)) / self.rate
+        if self.signal is None:
+            buffer[:] = 1.0
+        else:
+            buffer[:] = self.signal(times)
+        self.n_samples += n
+
+        if self.realtime:
+            delay = self.start_time + self.n_samples / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return n
+
+
+class RingBuffer(object):
+    """Preallocated buffer holding the last capacity samples of every channel."""
+    def __init__(self, channels, capacity):
+        self.data = np.zeros((channels, capacity))
+        self.capacity = capacity
+        self.index = 0  # Where the next sample goes
+        self.count = 0  # Total number of samples appended
+
+    def append(self, block):
+        n = block.shape[1]
+        if n >= self.capacity:
+            self.data[:] = block[:, -self.capacity:]
+            self.index = 0
+        else:
+            end = self.index + n
+            if end <= self.capacity:
+                self.data[:, self.index:end] = block
+            else:
+                split = self.capacity - self.index
+                self.data[:, self.index:] = block[:, :split]
+                self.data[:, :n - split] = block[:, split:]
+            self.index = end % self.capacity
+        self.count += n
+
+    def latest(self, n):
+        """Return a copy of the last n samples of every channel, oldest first."""
+        n = min(n, self.count, self.capacity)
+        start = self.index - n
+        if start >= 0:
+            return self.data[:, start:self.index].copy()
+        # The samples wrap around the end of the buffer
+        return np.concatenate((self.data[:, start:], self.data[:, :self.index]), axis=1)
+
+
+class ContinuousPressureSource(PressureSource):
+    # Rows of the statistics array
+    MEAN = 0
+    MIN = 1
+    MAX = 2
+
+    def __init__(self, reader, block_size=100, capacity=10000, gains=PRESSURE_GAINS, timeout=10.0):
+        """
+        :param reader: SampleReader providing the raw gauge voltages
+        :param block_size: number of samples per channel averaged into one reading
+        :param capacity: number of samples per channel kept in the ring buffer
+        """
+        self.reader = reader
+        self.gains = np.asarray(gains, dtype=float)
+        self.timeout = timeout
+        self.ring = RingBuffer(reader.channels, capacity)
+        self.block = np.empty((reader.channels, block_size))
+
+        # Two statistics slots: the background thread fills one while readers use the other, then swaps them
+        self.slots = np.full((2, 3, reader.channels), np.nan)
+        self.active = 0
+        self.n_blocks = 0
+        self.first_block = threading.Event()
+
+        self.error = None
+        self.running = True
+        self.reader.start()
+        self.thread = threading.Thread(target=self.run, name='daq', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while self.running:
+                n = self.reader.read_into(self.block)
+                block = self.block[:, :n]
+                self.ring.append(block)
+
+                stats = self.slots[1 - self.active]
+                np.mean(block, axis=1, out=stats[self.MEAN])
+                np.min(block, axis=1, out=stats[self.MIN])
+                np.max(block, axis=1, out=stats[self.MAX])
+                stats *= self.gains
+                # Readers check n_blocks to know whether the slot they copied was reused meanwhile
+                self.active = 1 - self.active
+                self.n_blocks += 1
+                self.first_block.set()
+        except Exception as e:
+            self.error = e
+            self.first_block.set()
+
+    def statistics(self, retries=1000):
+        """
+        Return the mean, min and max of each channel over the latest block, scaled to mbar.
+
+        The array has shape (3, channels) and is a copy. The background thread only writes to a slot after the next
+        swap, so the copy is retried while a block was completed during it (see supervisor.TelemetryTable.read_row).
+        """
+        if not self.first_block.wait(self.timeout):
+            raise TimeoutError('No samples from the DAQ after {} s'.format(self.timeout))
+        if self.error is not None:
+            raise self.error
+        for _ in range(retries):
+            n_blocks = self.n_blocks
+            copy = self.slots[self.active].copy()
+            if self.n_blocks == n_blocks:
+                return copy
+            time.sleep(0)
+        raise TimeoutError('The statistics of the DAQ change faster than they can be read')
+
+    def read(self):
+        return tuple(self.statistics()[self.MEAN].tolist())
+
+    def close(self):
+        self.running = False
+        self.thread.join(self.timeout)
+        self.reader.close()
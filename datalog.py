@@ -0,0 +1,228 @@
+"""
+Buffered, crash-safe binary data log.
+
+Records are collected in preallocated NumPy chunks and written by a background thread, so the measurement loop never
+waits for the disk or formats floats as text. A chunk is handed to the thread when it is full or when its first record
+is flush_interval seconds old, and fsync'd once written, so a crash loses at most the last flush_interval seconds.
+
+File layout (all integers little endian):
+    magic       b'PYINSTR-LOG\n'
+    header      uint32 length + JSON {"columns": [...], "metadata": [[key, value], ...]}
+    blocks      type (1 byte) + uint32 payload length + payload + uint32 CRC32 of the payload
+                    b'D'  data: uint32 number of rows + rows * columns float64 values, row by row
+                    b'S'  segment marker: UTF-8 text, e.g. 'Cycle 0 BEGIN'
+A block that is cut short or fails its CRC ends the file (it was being written when the program stopped).
+
+export_csv() reproduces the text layout that measurement.py used to write:
+    python datalog.py run.bin run.dat
+"""
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+MAGIC = b'PYINSTR-LOG\n'
+DATA = b'D'
+SEGMENT = b'S'
+
+_length = struct.Struct('<I')
+
+
+class LogFormatError(Exception):
+    pass
+
+
+class BinaryLogWriter(object):
+    def __init__(self, path, columns, metadata=(), chunk_size=1024, chunks=4, append=False, flush_interval=10.0,
+                 clock=time.monotonic):
+        """
+        :param columns: names of the columns of every record
+        :param metadata: sequence of (key, value) header lines, e.g. [('SETUP', 'Ramp Rate=10 C/minute'), ...]
+        :param chunk_size: number of records per chunk
+        :param chunks: number of preallocated chunks, the writer blocks when all of them are waiting for the disk
+        :param append: continue an existing log (e.g. when a run is resumed) instead of overwriting it; the header of
+                       the existing log is kept and an incomplete last block is dropped
+        :param flush_interval: longest time in seconds a record waits in memory before it is written, None to only
+                               write full chunks
+        """
+        self.path = path
+        self.columns = tuple(columns)
+        self.metadata = [tuple(item) for item in metadata]
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        if append and os.path.exists(path):
+            with open(path, 'rb') as file:
+                columns, metadata, _, end = scan(file.read(), path)
+            if columns != self.columns:
+                raise LogFormatError("{} has columns {}, expected {}".format(path, columns, self.columns))
+            self.metadata = metadata
+            self.file = open(path, 'r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+            header = json.dumps({'columns': self.columns, 'metadata': self.metadata}).encode('utf-8')
+            self.file.write(MAGIC + _length.pack(len(header)) + header)
+        self.sync()
+
+        self.free = queue.Queue()
+        for _ in range(chunks):
+            self.free.put(np.empty((chunk_size, len(self.columns))))
+        self.chunk = self.free.get()
+        self.n_rows = 0
+        self.chunk_start = None  # Time the first record of the chunk was written
+
+        self.error = None
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='datalog', daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        if self.error is not None:
+            raise self.error
+        self.chunk[self.n_rows] = record
+        self.n_rows += 1
+        if self.n_rows == 1:
+            self.chunk_start = self.clock()
+        if self.n_rows == self.chunk_size or \
+                (self.flush_interval is not None and self.clock() - self.chunk_start >= self.flush_interval):
+            self.submit()
+
+    def segment(self, text):
+        """Mark the start or end of a segment, e.g. 'Cycle 0 BEGIN'."""
+        self.submit()
+        self.pending.put((SEGMENT, text))
+
+    def submit(self):
+        """Hand the records collected so far to the background thread."""
+        if self.error is not None:
+            raise self.error
+        if self.n_rows:
+            self.pending.put((DATA, (self.chunk, self.n_rows)))
+            self.chunk = self.free.get()
+            self.n_rows = 0
+
+    def flush(self):
+        self.submit()
+        self.pending.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                kind, payload = item
+                if kind == DATA:
+                    chunk, n_rows = payload
+                    try:
+                        self.write_block(DATA, _length.pack(n_rows) + chunk[:n_rows].astype('<f8').tobytes())
+                    finally:
+                        self.free.put(chunk)
+                else:
+                    self.write_block(SEGMENT, payload.encode('utf-8'))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+    def write_block(self, kind, payload):
+        self.file.write(kind + _length.pack(len(payload)) + payload + _length.pack(zlib.crc32(payload)))
+        self.sync()
+
+
+def read_log(path):
+    """
+    Read a log written by BinaryLogWriter.
+
+    :return: (columns, metadata, blocks) where blocks is a list of ('data', array) and ('segment', text) items
+    """
+    with open(path, 'rb') as file:
+        columns, metadata, blocks, _ = scan(file.read(), path)
+    return columns, metadata, blocks
+
+
+def scan(content, path=''):
+    """Parse the content of a log, returning (columns, metadata, blocks, offset of the end of the last block)."""
+    if not content.startswith(MAGIC):
+        raise LogFormatError("{} is not a binary data log".format(path))
+    offset = len(MAGIC)
+    (length,) = _length.unpack_from(content, offset)
+    offset += _length.size
+    header = json.loads(content[offset:offset + length].decode('utf-8'))
+    offset += length
+    columns = tuple(header['columns'])
+    metadata = [tuple(item) for item in header['metadata']]
+
+    blocks = []
+    while offset + 1 + 2 * _length.size <= len(content):
+        kind = content[offset:offset + 1]
+        (length,) = _length.unpack_from(content, offset + 1)
+        start = offset + 1 + _length.size
+        end = start + length
+        if end + _length.size > len(content):
+            break
+        payload = content[start:end]
+        if _length.unpack_from(content, end)[0] != zlib.crc32(payload):
+            break
+        if kind == DATA:
+            (n_rows,) = _length.unpack_from(payload)
+            data = np.frombuffer(payload, dtype='<f8', offset=_length.size).reshape(n_rows, len(columns))
+            blocks.append(('data', data))
+        elif kind == SEGMENT:
+            blocks.append(('segment', payload.decode('utf-8')))
+        else:
+            break
+        offset = end + _length.size
+    return columns, metadata, blocks, offset
+
+
+def export_csv(path, output_path):
+    """Write the log as the text file measurement.py used to produce."""
+    columns, metadata, blocks = read_log(path)
+    line_format = ','.join(['{}'] * len(columns)) + '\n'
+    with open(output_path, 'w') as file:
+        for key, value in metadata:
+            file.write('{}: {}\n'.format(key, value) if value != '' else '{}:\n'.format(key))
+        file.write('\n')
+        file.write('DATA:\n')
+        file.write(','.join(columns) + '\n')
+        for kind, block in blocks:
+            if kind == 'data':
+                for row in block.tolist():
+                    file.write(line_format.format(*row))
+            else:
+                file.write('INFO: {}\n'.format(block))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('Usage: python datalog.py <log file> [<csv file>]')
+        sys.exit(1)
+    export_csv(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else os.path.splitext(sys.argv[1])[0] + '.dat')
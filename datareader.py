@@ -0,0 +1,212 @@
+"""
+Random access to the segments of the .dat files written by measurement.py (see datalog.export_csv).
+
+A data file is a header of 'KEY: value' lines, a 'DATA:' line, the column names and the records as CSV lines, with
+'INFO: <name> BEGIN' / 'INFO: <name> END' marker lines around the segments of the protocol (cycles, ramps, soaks, ...).
+
+DataFile memory-maps the file and indexes it once: the header fields and the byte range of every segment, found with a
+regular expression over the mapped file, without parsing any records. The index is kept in a sidecar file
+(<file>.index.json) and reused as long as the data file has the same size and modification time. Records are only
+parsed for the segment asked for, line by line and only the columns asked for, into a NumPy array:
+    data = DataFile('ASY-1212A_Test1_ThermalCycling_Run1.dat')
+    soak = data.read('Cycle 2/Soak', columns=('Time', 'Sample Temperature (C)'))
+
+Segments are addressed by their path of names, e.g. 'Cycle 2/Soak'. Every cycle has two soaks, the second one is
+'Cycle 2/Soak[1]'.
+"""
+import json
+import mmap
+import os
+import re
+
+import numpy as np
+
+INDEX_VERSION = 1
+
+_marker = re.compile(rb'^INFO: ?(.*?) (BEGIN|END)\r?$', re.MULTILINE)
+_path_part = re.compile(r'^(.*?)(?:\[(\d+)\])?$')
+
+
+class DataFormatError(Exception):
+    pass
+
+
+class Segment(object):
+    def __init__(self, name, start, end, parent=None, occurrence=0, complete=True):
+        """
+        :param start: offset of the first record, after the BEGIN marker
+        :param end: offset of the END marker (the end of the file for a segment that was not ended)
+        :param parent: index of the enclosing segment in DataFile.segments, None at the top level
+        :param occurrence: number of earlier segments with the same name in the same parent
+        """
+        self.name = name
+        self.start = start
+        self.end = end
+        self.parent = parent
+        self.occurrence = occurrence
+        self.complete = complete
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return 'Segment({!r}, {}, {}, occurrence={})'.format(self.name, self.start, self.end, self.occurrence)
+
+
+class DataFile(object):
+    def __init__(self, path, use_index_file=True):
+        self.path = path
+        self.index_path = path + '.index.json'
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            raise DataFormatError('{} is empty'.format(path))
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index = self.load_index() if use_index_file else None
+        if index is None:
+            index = self.build_index()
+            if use_index_file:
+                self.save_index(index)
+        self.metadata = [tuple(item) for item in index['metadata']]
+        self.columns = tuple(index['columns'])
+        self.data_start = index['data_start']
+        self.segments = [Segment(**segment) for segment in index['segments']]
+        self.rejected = 0  # Records skipped by read() because they did not have one field per column
+
+    def signature(self):
+        stat = os.fstat(self.file.fileno())
+        return [INDEX_VERSION, stat.st_size, stat.st_mtime_ns]
+
+    def load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if index.get('signature') != self.signature():
+            return None
+        return index
+
+    def save_index(self, index):
+        temporary = self.index_path + '.tmp'
+        try:
+            with open(temporary, 'w') as file:
+                json.dump(index, file)
+            os.replace(temporary, self.index_path)
+        except OSError:
+            # A read-only directory only costs the next open the indexing
+            pass
+
+    def build_index(self):
+        data = self.map.find(b'\nDATA:')
+        if data < 0:
+            raise DataFormatError('{} has no DATA: line'.format(self.path))
+        header = self.map[:data].decode('utf-8')
+        metadata = []
+        for line in header.splitlines():
+            if line.strip():
+                key, _, value = line.partition(':')
+                metadata.append((key.strip(), value.strip()))
+
+        columns_start = self.map.find(b'\n', data + 1) + 1
+        columns_end = self.map.find(b'\n', columns_start)
+        if columns_start == 0 or columns_end < 0:
+            raise DataFormatError('{} has no column names'.format(self.path))
+        columns = self.map[columns_start:columns_end].decode('utf-8').strip().split(',')
+
+        segments = []
+        open_segments = []  # Indices into segments, innermost last
+        occurrences = {}  # (parent, name) -> number of segments seen
+        for match in _marker.finditer(self.map, columns_end):
+            name = match.group(1).decode('utf-8')
+            if match.group(2) == b'BEGIN':
+                parent = open_segments[-1] if open_segments else None
+                occurrence = occurrences.get((parent, name), 0)
+                occurrences[(parent, name)] = occurrence + 1
+                segments.append(Segment(name, match.end() + 1, len(self.map), parent, occurrence, complete=False))
+                open_segments.append(len(segments) - 1)
+            else:
+                # Close the innermost open segment of that name, and any segment left open inside it
+                for depth in range(len(open_segments) - 1, -1, -1):
+                    if segments[open_segments[depth]].name == name:
+                        for index in open_segments[depth:]:
+                            segments[index].end = match.start()
+                        segments[open_segments[depth]].complete = True
+                        del open_segments[depth:]
+                        break
+
+        return {'signature': self.signature(),
+                'metadata': metadata,
+                'columns': columns,
+                'data_start': columns_end + 1,
+                'segments': [segment.to_dict() for segment in segments]}
+
+    def header(self, key):
+        """Values of the header lines with this key, e.g. header('SETUP')."""
+        return [value for item_key, value in self.metadata if item_key == key]
+
+    def find(self, path):
+        """Return the Segment at path, e.g. 'Cycle 2/Soak' or 'Cycle 2/Soak[1]'."""
+        parent = None
+        segment = None
+        for part in path.strip('/').split('/'):
+            name, occurrence = _path_part.match(part.strip()).groups()
+            occurrence = int(occurrence) if occurrence is not None else 0
+            for index, candidate in enumerate(self.segments):
+                if candidate.parent == parent and candidate.name == name and candidate.occurrence == occurrence:
+                    parent, segment = index, candidate
+                    break
+            else:
+                raise KeyError('{} has no segment {}'.format(self.path, path))
+        return segment
+
+    def children(self, segment=None):
+        """Segments directly inside segment (the top level segments for None)."""
+        parent = None if segment is None else self.segments.index(segment)
+        return [candidate for candidate in self.segments if candidate.parent == parent]
+
+    def read_range(self, start, end, columns=None):
+        """
+        Parse the records between two byte offsets, return an array (n_records x n_columns).
+
+        A record without one field per column (e.g. the last record of a file that is still being written) is skipped
+        and counted in self.rejected, a field that is not a number is read as NaN.
+        """
+        names = self.columns if columns is None else columns
+        usecols = [self.columns.index(column) for column in names]
+        lines = []
+        for line in self.map[start:end].splitlines():
+            # Markers of nested segments are skipped
+            if not line.strip() or line.startswith(b'INFO:'):
+                continue
+            if line.count(b',') != len(self.columns) - 1:
+                self.rejected += 1
+                continue
+            lines.append(line)
+        if not lines:
+            return np.empty((0, len(usecols)))
+        values = np.genfromtxt(lines, delimiter=',', usecols=usecols, dtype=float)
+        return values.reshape(-1, len(usecols))
+
+    def read(self, path=None, columns=None):
+        """
+        Parse the records of a segment (all records for None).
+
+        :param columns: names of the columns to return, all of them by default
+        :return: array of the records, one row per record
+        """
+        if path is None:
+            return self.read_range(self.data_start, len(self.map), columns)
+        segment = self.find(path)
+        return self.read_range(segment.start, segment.end, columns)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
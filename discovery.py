@@ -0,0 +1,322 @@
+"""
+Find the instruments connected to the host and pick their drivers.
+
+Discovery probes the resources of a pyvisa ResourceManager at the same time, each probing thread through a
+ResourceManager of its own. Serial ports are tried with each SerialProfile in turn until one answers *IDN?; the model in
+the reply selects the driver class registered for it (see Driver.models and DriverMeta). What was found is cached in a
+JSON file, keyed by port and serial number, so on the next start no port is opened at all: the cached address ->
+instrument map is used as it is, and only ports that are not in the cache are probed. Ports where nothing answered are
+cached for silent_ttl seconds, then probed again. connect() checks the *IDN? reply of the port it opens against the
+cache, and probes every port again if another instrument was plugged in:
+    discovery = Discovery(rm)
+    for instrument in discovery.scan():
+        print(instrument.address, instrument.model, instrument.serial_number)
+    LS350 = discovery.connect(model='MODEL350')
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+
+from driver import DriverMeta
+
+# Importing the drivers registers their models
+import LS218_Driver
+import LS350_Driver
+
+
+class DiscoveryError(Exception):
+    pass
+
+
+class SerialProfile(object):
+    def __init__(self, baud_rate, data_bits=7, parity='odd', stop_bits=1, read_termination='\r\n'):
+        """:param parity: name of a pyvisa Parity constant ('none', 'odd', 'even', ...)"""
+        self.baud_rate = baud_rate
+        self.data_bits = data_bits
+        self.parity = parity
+        self.stop_bits = stop_bits
+        self.read_termination = read_termination
+
+    def apply(self, resource):
+        import visa
+
+        resource.baud_rate = self.baud_rate
+        resource.data_bits = self.data_bits
+        resource.parity = getattr(visa.constants.Parity, self.parity)
+        resource.stop_bits = {1: visa.constants.StopBits.one, 2: visa.constants.StopBits.two}[self.stop_bits]
+        resource.read_termination = self.read_termination
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __eq__(self, other):
+        return isinstance(other, SerialProfile) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return 'SerialProfile({baud_rate}, {data_bits}, {parity!r}, {stop_bits})'.format(**vars(self))
+
+
+# The serial settings of the Lake Shore controllers, most likely first
+LAKESHORE_PROFILES = (SerialProfile(56000), SerialProfile(9600), SerialProfile(57600), SerialProfile(1200))
+
+
+class Instrument(object):
+    def __init__(self, address, idn, profile=None):
+        """
+        :param idn: reply to *IDN?, e.g. 'LSCI,MODEL350,1234567,1.5'
+        :param profile: SerialProfile the instrument answered with, None for resources that are not serial ports
+        """
+        self.address = address
+        self.idn = idn
+        self.profile = profile
+        fields = [field.strip() for field in idn.split(',')] + [''] * 4
+        self.manufacturer, self.model, self.serial_number, self.firmware = fields[:4]
+
+    @property
+    def key(self):
+        """Key of the instrument in the cache: its port and serial number."""
+        return '{}#{}'.format(self.address, self.serial_number)
+
+    @property
+    def driver_class(self):
+        return DriverMeta.lookup(self.model)
+
+    def to_dict(self):
+        return {'address': self.address, 'idn': self.idn,
+                'profile': self.profile.to_dict() if self.profile is not None else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = SerialProfile(**data['profile']) if data['profile'] is not None else None
+        return cls(data['address'], data['idn'], profile)
+
+    def __repr__(self):
+        return 'Instrument({!r}, {!r}, {!r})'.format(self.address, self.idn, self.profile)
+
+
+def is_serial(address):
+    return address.upper().startswith('ASRL')
+
+
+class Discovery(object):
+    def __init__(self, rm, profiles=LAKESHORE_PROFILES, timeout=500, cache_path='instruments.json', max_workers=16,
+                 rm_factory=None, silent_ttl=3600.0, clock=time.time):
+        """
+        :param rm: pyvisa ResourceManager
+        :param profiles: serial settings to try, in order
+        :param timeout: timeout (ms) of a probe, short because a port with the wrong settings never answers
+        :param cache_path: JSON file to keep what was found between runs, None to always probe
+        :param max_workers: maximum number of ports probed at the same time
+        :param rm_factory: returns a new ResourceManager for a probing thread, the class of rm by default
+        :param silent_ttl: seconds a port where nothing answered is skipped by scan() before it is probed again
+        """
+        self.rm = rm
+        self.profiles = tuple(profiles)
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.rm_factory = type(rm) if rm_factory is None else rm_factory
+        self.silent_ttl = silent_ttl
+        self.clock = clock
+        self.instruments = {}  # address -> Instrument found by the last scan
+        self.silent = {}  # Address where nothing answered -> time it was probed
+
+    def load_cache(self):
+        """Return ({address: Instrument}, {address where nothing answered: time it was probed}) from the cache."""
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}, {}
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+            instruments = {}
+            for key, data in cache['instruments'].items():
+                instrument = Instrument.from_dict(data)
+                if key != instrument.key:
+                    # The entry does not describe the instrument it is filed under, probe its port again
+                    logging.warning('Ignoring cached instrument {}, it is {}'.format(key, instrument.key))
+                    continue
+                instruments[instrument.address] = instrument
+            now = self.clock()
+            silent = {address: probed for address, probed in cache['silent'].items()
+                      if now - probed < self.silent_ttl and address not in instruments}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logging.warning('Ignoring unreadable instrument cache {}'.format(self.cache_path))
+            return {}, {}
+        return instruments, silent
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        temporary = self.cache_path + '.tmp'
+        cache = {'instruments': {instrument.key: instrument.to_dict() for instrument in self.instruments.values()},
+                 'silent': self.silent}
+        with open(temporary, 'w') as file:
+            json.dump(cache, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.cache_path)
+
+    def identify(self, address, profile, rm=None):
+        """Ask the resource at address for *IDN? with profile, return the reply or None if it did not answer."""
+        try:
+            resource = (self.rm if rm is None else rm).open_resource(address)
+        except Exception as e:
+            logging.debug('Could not open {}: {}'.format(address, e))
+            return None
+        try:
+            resource.timeout = self.timeout
+            if profile is not None:
+                profile.apply(resource)
+            idn = resource.query('*IDN?').strip()
+        except Exception as e:
+            logging.debug('No reply from {} with {}: {}'.format(address, profile, e))
+            return None
+        finally:
+            resource.close()
+        # A port with the wrong settings may return noise instead of timing out
+        if idn.count(',') < 3:
+            return None
+        return idn
+
+    def probe(self, address, known=None, rm=None):
+        """
+        Identify the instrument at address, trying the profile of the instrument known there first.
+
+        :return: Instrument, or None if nothing answered
+        """
+        if not is_serial(address):
+            idn = self.identify(address, None, rm)
+            return Instrument(address, idn) if idn is not None else None
+
+        profiles = list(self.profiles)
+        if known is not None and known.profile is not None:
+            profiles = [known.profile] + [profile for profile in profiles if profile != known.profile]
+        for profile in profiles:
+            idn = self.identify(address, profile, rm)
+            if idn is not None:
+                return Instrument(address, idn, profile)
+        return None
+
+    def probe_all(self, addresses, known):
+        """
+        Probe addresses at the same time, the profiles of one port one after the other.
+
+        :param known: address -> Instrument last found there
+        :return: dict of address -> Instrument or None
+        """
+        if not addresses:
+            return {}
+        # A ResourceManager is not meant to be used from several threads, every worker opens its ports with its own
+        local = threading.local()
+        managers = []
+        lock = threading.Lock()
+
+        def probe(address):
+            rm = getattr(local, 'rm', None)
+            if rm is None:
+                rm = local.rm = self.rm_factory()
+                with lock:
+                    managers.append(rm)
+            return self.probe(address, known.get(address), rm)
+
+        workers = max(1, min(self.max_workers, len(addresses)))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                return dict(zip(addresses, pool.map(probe, addresses)))
+        finally:
+            for rm in managers:
+                # pyvisa may hand out the same manager again, that one stays open for connect()
+                if rm is not self.rm:
+                    rm.close()
+
+    def scan(self, resources=None, refresh=False):
+        """
+        Find the instruments on all (or the given) resources.
+
+        :param refresh: ignore the cache and probe every port again
+        :return: list of Instrument, one per resource that answered
+        """
+        if resources is None:
+            resources = self.rm.list_resources()
+        cache, silent = ({}, {}) if refresh else self.load_cache()
+
+        known = dict(self.instruments)
+        known.update(cache)
+        probed = self.probe_all([address for address in resources if address not in cache and address not in silent],
+                                known)
+
+        found = []
+        now = self.clock()
+        for address in resources:
+            instrument = cache[address] if address in cache else probed.get(address)
+            if instrument is None:
+                self.instruments.pop(address, None)
+                # A port skipped because of the cache keeps the time it was probed, so that its entry expires
+                self.silent[address] = silent.get(address, now)
+                continue
+            self.silent.pop(address, None)
+            if instrument.driver_class is None:
+                logging.info('No driver registered for {} at {}'.format(instrument.model, address))
+            self.instruments[address] = instrument
+            found.append(instrument)
+
+        self.save_cache()
+        return found
+
+    def find(self, model=None, serial_number=None):
+        """Return the instrument found by the last scan with this model and/or serial number."""
+        for instrument in self.instruments.values():
+            if (model is None or instrument.model == model) and \
+                    (serial_number is None or instrument.serial_number == serial_number):
+                return instrument
+        raise DiscoveryError('No instrument with model {} and serial number {} was found'.format(model, serial_number))
+
+    def connect(self, instrument=None, model=None, serial_number=None):
+        """
+        Open an instrument found by scan() with the settings it answered with and return its driver.
+
+        The instrument is given directly, or looked up by model and/or serial number (scanning first if needed). If the
+        instrument is not at its cached port any more, every port is probed again.
+        """
+        if instrument is None:
+            if not self.instruments:
+                self.scan()
+            try:
+                instrument = self.find(model, serial_number)
+            except DiscoveryError:
+                self.scan(refresh=True)
+                instrument = self.find(model, serial_number)
+
+        resource = self.open(instrument)
+        if resource is None:
+            logging.info('{} {} is no longer at {}, probing again'.format(instrument.model,
+                                                                         instrument.serial_number,
+                                                                         instrument.address))
+            self.scan(refresh=True)
+            instrument = self.find(instrument.model, instrument.serial_number)
+            resource = self.open(instrument)
+            if resource is None:
+                raise DiscoveryError('{} at {} does not answer'.format(instrument.model, instrument.address))
+
+        driver_class = instrument.driver_class
+        if driver_class is None:
+            resource.close()
+            raise DiscoveryError('No driver registered for {} at {}'.format(instrument.model, instrument.address))
+        return driver_class(resource)
+
+    def open(self, instrument):
+        """Open the port of instrument, return the resource if the same instrument answers there, None otherwise."""
+        resource = self.rm.open_resource(instrument.address)
+        try:
+            if instrument.profile is not None:
+                instrument.profile.apply(resource)
+            answered = Instrument(instrument.address, resource.query('*IDN?').strip())
+        except Exception as e:
+            logging.debug('No reply from {}: {}'.format(instrument.address, e))
+            answered = None
+        if answered is not None and (answered.model, answered.serial_number) == \
+                (instrument.model, instrument.serial_number):
+            return resource
+        resource.close()
+        return None
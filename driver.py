@@ -1,96 +1,696 @@
+import contextlib
+import functools
 import inspect
+import itertools
 from collections import OrderedDict
 
 import time
 
+from alarms import ALARM, HEATER_FAULT, AlarmMonitor
+from cache import ALL, MISSING, QueryCache
+from instrumentation import DriverMetrics
+from pacing import AdaptivePacer, QUERY, WRITE, EEPROM
+from processors import ProcessorError
+
+
+def as_tuple(items):
+    """Normalise a single validator/processor, or a collection of them, into a tuple."""
+    if items is None:
+        return ()
+    if isinstance(items, (list, tuple, set, frozenset)):
+        return tuple(items)
+    return (items,)
+
 
 class Communication(object):
-    def validate(self, func, *args):
-        signature = inspect.signature(func)
+    validators = None
 
-        # Make sure that the inputs are valid
+    def compile(self, func):
+        """
+        Build the validation plan once, when the decorator is applied.
+
+        The plan is a tuple of (argument index, argument name, validators) for every argument that has validators, so
+        the wrapper only has to index into args instead of inspecting the signature on every call.
+        """
+        self.parameter_names = tuple(inspect.signature(func).parameters.keys())
+
+        plan = []
         if self.validators is not None:
-            for name, value in zip(signature.parameters.keys(), args):
-                validators = self.validators.get(name)
-                if validators is None:
-                    continue
-                try:
-                    for validator in validators:
-                        validator(value)
-                except TypeError:
-                    # Validators is not an array
-                    validators(value)
+            for index, name in enumerate(self.parameter_names):
+                validators = as_tuple(self.validators.get(name))
+                if validators:
+                    plan.append((index, name, validators))
+        self.plan = tuple(plan)
+
+    def validate(self, args, kwargs=None):
+        n_args = len(args)
+        for index, name, validators in self.plan:
+            if index < n_args:
+                value = args[index]
+            elif kwargs and name in kwargs:
+                value = kwargs[name]
+            else:
+                continue
+            for validator in validators:
+                validator(value)
+
+    def compose(self, func, driver, *args):
+        """Return the message that the command would send, without sending it."""
+        self.validate((driver,) + args)
+
+        recorder = CommandRecorder(driver)
+        func(recorder, *args)
+        if len(recorder.messages) != 1:
+            raise ValueError("{} does not send exactly one message".format(func.__name__))
+        return recorder.messages[0]
 
 
 class Query(Communication):
-    def __init__(self, validators=None, processors=None):
+    def __init__(self, validators=None, processors=None, cache=None):
+        """
+        :param cache: seconds a result may be served from the driver's cache, True to keep it until a Write
+                      invalidates it, None to always ask the instrument
+        """
         self.processors = processors
         self.validators = validators
+        self.processor_plan = as_tuple(processors)
+        self.cache = cache
 
     def __call__(self, func):
-        def query(*args):
-            self.validate(func, *args)
+        self.compile(func)
+        validate = self.validate
+        process = self.process
 
-            # Run the query function
-            val = func(*args)
+        if self.cache is None:
+            @functools.wraps(func)
+            def query(*args, **kwargs):
+                if args[0].metrics is not None:
+                    return self.timed_call(func, args, kwargs)
 
-            # Process the output
-            if self.processors is not None:
+                validate(args, kwargs)
+
+                # Run the query function
+                val = func(*args, **kwargs)
+
+                # Process the output
                 try:
-                    for processor in self.processors:
-                        val = processor(val)
-                except TypeError:
-                    # Processor is a single element
-                    val = self.processors(val)
-            return val
+                    return process(args[0], val)
+                except ProcessorError as e:
+                    return self.retry(func, args, kwargs, e)
+        else:
+            name = func.__name__
+            ttl = self.cache
+
+            @functools.wraps(func)
+            def query(*args, **kwargs):
+                cache = args[0].cache
+                if not kwargs:
+                    val = cache.get(name, args[1:])
+                    if val is not MISSING:
+                        return val
+
+                if args[0].metrics is not None:
+                    val = self.timed_call(func, args, kwargs)
+                else:
+                    validate(args, kwargs)
+                    val = func(*args, **kwargs)
+                    try:
+                        val = process(args[0], val)
+                    except ProcessorError as e:
+                        val = self.retry(func, args, kwargs, e)
+                if not kwargs:
+                    cache.put(name, args[1:], val, ttl)
+                return val
+
+        # Allow the query to be composed into a batch (see Driver.query_many)
+        query.compose = lambda *args: self.compose(func, *args)
+        query.process = self.process
+        query.query_command = self
         return query
 
+    def process(self, driver, val):
+        raw = val
+        try:
+            for processor in self.processor_plan:
+                val = processor(val)
+        except ProcessorError:
+            # A reply that cannot be parsed usually means the instrument was not ready yet. Empty replies have
+            # already been reported by Driver.query.
+            pacer = getattr(driver, 'pacer', None)
+            if pacer is not None and raw:
+                pacer.failure(QUERY)
+            raise
+        return val
+
+    def timed_call(self, func, args, kwargs):
+        """Run the query like the wrapper does, adding the validation and processing time to the driver's metrics."""
+        driver = args[0]
+        metrics = driver.metrics
+        clock = metrics.clock
+        start = clock()
+        self.validate(args, kwargs)
+        validated = clock()
+        # The processing time goes to the command this call sent, even while other threads use the driver
+        tracker = QueryTracker(driver)
+        val = func(tracker, *args[1:], **kwargs)
+        received = clock()
+        mnemonic = driver.mnemonic(tracker.message) if tracker.message is not None else func.__name__
+        try:
+            return self.process(driver, val)
+        except ProcessorError as e:
+            metrics.error(mnemonic)
+            error = e
+        finally:
+            metrics.processing(mnemonic, validated - start + clock() - received)
+        return self.retry(func, args, kwargs, error)
+
+    def retry(self, func, args, kwargs, error):
+        """Send the query again after a reply that could not be processed, as long as the driver allows it."""
+        driver = args[0]
+        attempt = 1
+        while driver.recover(attempt):
+            try:
+                return self.process(driver, func(*args, **kwargs))
+            except ProcessorError as e:
+                error = e
+                attempt += 1
+        raise error
+
 
 class Write(Communication):
-    def __init__(self, validators=None):
+    def __init__(self, validators=None, invalidates=()):
+        """
+        :param invalidates: names of the cached queries made stale by this write, or cache.ALL
+        """
         self.validators = validators
+        self.invalidates = invalidates
+        self.invalidation_plans = {}  # Driver class -> [(query name, {query argument position: write argument index})]
+        # Driver class -> [(feature name, write argument index of every index of the feature, None for any)]
+        self.shadow_plans = {}
+        self.name = None
 
     def __call__(self, func):
-        def write(*args):
-            self.validate(func, args)
+        self.compile(func)
+        self.name = func.__name__
+        validate = self.validate
+        invalidate = self.invalidate
+
+        @functools.wraps(func)
+        def write(*args, **kwargs):
+            validate(args, kwargs)
 
             # Write the data to the instrument
-            func(*args)
+            func(*args, **kwargs)
+
+            invalidate(args)
+
+        write.compose = lambda *args: self.compose(func, *args)
+        write.write_command = self
         return write
 
+    def invalidation_plan(self, driver_class):
+        """Work out, once per driver class, which write arguments select the cached entries to evict."""
+        plan = self.invalidation_plans.get(driver_class)
+        if plan is None:
+            plan = []
+            for name in self.invalidates:
+                query_command = getattr(driver_class, name).query_command
+                match = {position: self.parameter_names.index(parameter)
+                         for position, parameter in enumerate(query_command.parameter_names[1:])
+                         if parameter in self.parameter_names}
+                plan.append((name, match))
+            self.invalidation_plans[driver_class] = plan
+        return plan
+
+    def shadow_plan(self, driver_class):
+        """
+        Work out, once per driver class, which Feature shadow values this write makes stale: those of the features it
+        is the setter of, and of the features whose getter it invalidates.
+        """
+        plan = self.shadow_plans.get(driver_class)
+        if plan is None:
+            plan = []
+            features = {}
+            for klass in reversed(driver_class.__mro__):
+                features.update((name, value) for name, value in vars(klass).items()
+                                if getattr(value, 'getter_name', None) is not None)
+            for name, feature in features.items():
+                getter = getattr(driver_class, feature.getter_name).query_command
+                index_names = getter.parameter_names[1:]
+                if feature.setter_name == self.name:
+                    plan.append((name, tuple(range(1, len(index_names) + 1))))
+                elif feature.getter_name in as_tuple(self.invalidates):
+                    plan.append((name, tuple(self.parameter_names.index(parameter)
+                                             if parameter in self.parameter_names else None
+                                             for parameter in index_names)))
+            self.shadow_plans[driver_class] = plan
+        return plan
+
+    def invalidate(self, args):
+        driver = args[0]
+        transaction = driver.transaction_in_progress
+        if transaction is not None:
+            # The write is only sent when the transaction ends, evict again once it has been
+            transaction.invalidations.append((self, args))
+        if self.invalidates == ALL:
+            driver.cache.clear()
+            driver.shadow.clear()
+            if transaction is not None:
+                transaction.shadow.clear()
+            return
+        for name, match in self.invalidation_plan(type(driver)):
+            driver.cache.invalidate(name, {position: args[index] for position, index in match.items()
+                                           if index < len(args)})
+        for name, positions in self.shadow_plan(type(driver)):
+            evict_shadow(driver.shadow, name, positions, args)
+            if transaction is not None:
+                evict_shadow(transaction.shadow, name, positions, args)
+
+
+def evict_shadow(shadow, name, positions, args):
+    """Remove the shadow values of feature name whose indices match the write arguments at positions."""
+    # The shadow may be shared with the drivers of other threads (see multiplexer.ResourceMultiplexer)
+    for key in [key for key in list(shadow) if key[0] == name and
+                all(position is None or position >= len(args) or key[i] == args[position]
+                    for i, position in enumerate(positions, 1))]:
+        shadow.pop(key, None)
+
 
 class NotSupported(Communication):
     def __init__(self, message):
         self.message = message
 
     def __call__(self, func):
-        def not_supported(*args):
+        @functools.wraps(func)
+        def not_supported(*args, **kwargs):
             raise NotImplementedError(self.message)
         return not_supported
 
 
+class CommandRecorder(object):
+    """Stands in for a driver and captures the messages a command would send instead of sending them."""
+    def __init__(self, driver):
+        self.driver = driver
+        self.messages = []
+
+    def query(self, query_string):
+        self.messages.append(query_string)
+        return ''
+
+    def send(self, message):
+        self.messages.append(message)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class QueryTracker(object):
+    """Stands in for a driver and remembers the message a command sent."""
+    def __init__(self, driver):
+        self.driver = driver
+        self.message = None
+
+    def query(self, query_string):
+        self.message = query_string
+        return self.driver.query(query_string)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class BatchResult(object):
+    """Placeholder for the result of a query in a batch, filled in when the batch is executed."""
+    def __init__(self):
+        self.ready = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self.ready:
+            raise RuntimeError("The batch has not been executed yet")
+        return self._value
+
+    def set(self, value):
+        self._value = value
+        self.ready = True
+
+
+class Batch(object):
+    """
+    Collects Query calls and sends them as compound messages:
+        with driver.batch() as batch:
+            temperature = batch.get_celsius_reading('A')
+            setpoint = batch.get_setpoint(1)
+        print(temperature.value, setpoint.value)
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.driver, name)
+        if not hasattr(method, 'query_command'):
+            raise AttributeError("{} is not a Query and cannot be batched".format(name))
+
+        def add(*args):
+            result = BatchResult()
+            self.calls.append((method, args, result))
+            return result
+        return add
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        values = self.driver.query_many([(method, args) for method, args, _ in calls])
+        for (_, _, result), value in zip(calls, values):
+            result.set(value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+
+class Transaction(object):
+    """
+    Defers the writes of a driver and sends them together as compound messages when the block ends:
+        with driver.transaction():
+            driver.setpoint[1] = 295
+            driver.set_heater_range(1, 3)
+    Nothing is sent if the block raises. Queries inside the block see the instrument as it was before the block.
+    See feature.py for how Feature setters are coalesced.
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.writes = OrderedDict()  # Key -> messages, Features are keyed by (name, index), other writes by order
+        self.order = itertools.count()
+        self.shadow = {}  # Feature values the driver has once the writes are sent
+        self.invalidations = []  # (Write, args) to evict from the cache once the writes are sent
+        self.key = None
+
+    def add(self, message):
+        key = self.key if self.key is not None else next(self.order)
+        self.writes.setdefault(key, []).append(message)
+
+    @contextlib.contextmanager
+    def collect(self, key, value):
+        """Collect the messages sent in the block under key, as the write that sets a Feature to value."""
+        self.key = key
+        try:
+            yield
+        finally:
+            self.key = None
+        self.shadow[key] = value
+
+    def discard(self, key):
+        self.writes.pop(key, None)
+        self.shadow.pop(key, None)
+
+    def commit(self):
+        driver = self.driver
+        driver.send_many([message for messages in self.writes.values() for message in messages])
+        for write_command, args in self.invalidations:
+            write_command.invalidate(args)
+        driver.shadow.update(self.shadow)
+
+    def __enter__(self):
+        if self.driver.transaction_in_progress is not None:
+            raise RuntimeError("A transaction is already in progress on this driver")
+        self.driver.transaction_in_progress = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.driver.transaction_in_progress = None
+        if exc_type is None:
+            self.commit()
+
+
 class DriverMeta(type):
+    """Registers every driver class that declares the models it supports, e.g. models = ('MODEL350',)."""
+    registry = {}
+
     def __init__(cls, name, bases, namespace):
         super().__init__(name, bases, namespace)
         cls.query_commands = [value for value in namespace.values() if isinstance(value, Query)]
         for query_command in cls.query_commands:
             query_command.instance = cls
 
+        # Only classes that declare models themselves are registered, so subclasses (e.g. the asyncio versions)
+        # do not take over the models of their base
+        for model in namespace.get('models', ()):
+            DriverMeta.registry[model] = cls
+
+    @staticmethod
+    def lookup(model):
+        """Return the driver class registered for model (the second field of the *IDN? reply), or None."""
+        return DriverMeta.registry.get(model)
+
+
+class Driver(object, metaclass=DriverMeta):
+    # Models (as reported by *IDN?) this driver supports
+    models = ()
+    # Mnemonics of the commands that write to non-volatile memory and need a longer turnaround
+    eeprom_commands = ()
+    # Shortest turnaround in seconds the pacer probes for queries and writes, the instrument's real turnaround at its
+    # baud rate is learned above it. Probing below the real turnaround spoils replies, a transport.ResilientResource
+    # sends those queries again
+    minimum_turnaround = 0.01
+    # Number of characters the instrument can buffer in one message (used to split compound queries)
+    input_buffer_size = 64
+    # Separator between the queries of a compound message and between their replies
+    compound_separator = ';'
+    # instrumentation.DriverMetrics while metrics are enabled
+    metrics = None
+    # Transaction collecting the writes, see Driver.transaction
+    transaction_in_progress = None
+    # Inputs with an alarm and outputs with a heater, watched by the alarm monitor
+    alarm_inputs = ()
+    heater_outputs = ()
+    # An alarm requests service once enable_status_reporting() ran, so the alarm monitor can wait for it
+    requests_service = True
+    # alarms.AlarmMonitor once a callback subscribed, see Driver.on_alarm
+    alarm_monitor = None
 
-class Driver(object):
     def __init__(self, resource):
+        # Initial turnaround between commands, the pacer learns the real minimum from here
         self.wait_time = 0.06 # TODO: Check why we need 0.06s instead of 0.05s delay for LS350
         self.instrument = resource
+        self.pacer = AdaptivePacer(self.wait_time, self.minimum_turnaround)
+        self.cache = QueryCache()
+        self.metrics = None
+        self.transaction_in_progress = None
+        self.alarm_monitor = None
+        self.shadow = {}  # (Feature name, index) -> last value read or written, see feature.py
 
         self.query_commands = [value for value in self.__dict__.keys() if isinstance(value, Query)]
         for query_command in self.query_commands:
             query_command.instance = self
 
+    def mnemonics(self, message):
+        return [part.split(None, 1)[0] for part in message.split(self.compound_separator) if part.strip()]
+
+    def mnemonic(self, message):
+        """Key of a message in the metrics, e.g. 'KRDG?' or 'KRDG?;SETP?' for a compound message."""
+        return self.compound_separator.join(self.mnemonics(message))
+
+    def command_class(self, message):
+        mnemonics = self.mnemonics(message)
+        if any(mnemonic.endswith('?') for mnemonic in mnemonics):
+            return QUERY
+        if any(mnemonic in self.eeprom_commands for mnemonic in mnemonics):
+            return EEPROM
+        return WRITE
+
+    def enable_metrics(self, name=None):
+        """
+        Start recording per-command latencies and bus utilization.
+
+        :param name: name of the instrument in the metrics, the resource name by default
+        :return: the instrumentation.DriverMetrics
+        """
+        if name is None:
+            name = getattr(self.instrument, 'resource_name', type(self).__name__)
+        self.metrics = DriverMetrics(name)
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def timed_transaction(self, command_class, operation, message):
+        metrics = self.metrics
+        clock = metrics.clock
+        mnemonic = self.mnemonic(message)
+        start = clock()
+        self.pacer.wait(command_class)
+        sent = clock()
+        try:
+            return operation(message)
+        except Exception:
+            metrics.error(mnemonic)
+            raise
+        finally:
+            self.pacer.completed()
+            metrics.transaction(mnemonic, clock() - sent, sent - start)
+
+    def process_reply(self, method, reply, message):
+        """Run the processors of a batched query on its reply."""
+        metrics = self.metrics
+        if metrics is None:
+            return method.process(self, reply)
+
+        mnemonic = self.mnemonic(message)
+        start = metrics.clock()
+        try:
+            return method.process(self, reply)
+        except ProcessorError:
+            metrics.error(mnemonic)
+            raise
+        finally:
+            metrics.processing(mnemonic, metrics.clock() - start)
+
+    def recover(self, attempt):
+        """
+        Called when the reply to a query could not be processed, e.g. because it was garbled on the line.
+
+        :param attempt: number of times the query failed so far
+        :return: True to send the query again. Only a transport that can resynchronise the stream allows it (see
+                 transport.ResilientResource), otherwise the next reply could belong to the query that failed.
+        """
+        recover = getattr(self.instrument, 'recover', None)
+        return recover is not None and recover(attempt)
+
+    def monitor(self):
+        """The alarms.AlarmMonitor of this driver, created on first use."""
+        if self.alarm_monitor is None:
+            self.alarm_monitor = AlarmMonitor(self)
+        return self.alarm_monitor
+
+    def on_alarm(self, callback):
+        """
+        Call callback(input, status) when the alarm status of an input changes. Start the monitor with
+        driver.alarm_monitor.start(), or call driver.alarm_monitor.scan() from the acquisition loop.
+        """
+        return self.monitor().subscribe(ALARM, callback)
+
+    def on_heater_fault(self, callback):
+        """Call callback(output, code) when the heater status of an output changes, see alarms.HEATER_STATUS."""
+        return self.monitor().subscribe(HEATER_FAULT, callback)
+
+    def enable_status_reporting(self):
+        """Configure the status enable registers so that an alarm shows in the status summary and requests service."""
+        raise NotImplementedError('{} does not report alarms in its status registers'.format(type(self).__name__))
+
+    def read_status_summary(self):
+        """
+        Read the status registers in one round trip.
+
+        :return: (True if an alarm is or was active since the last read, {heater output: heater status code})
+        """
+        raise NotImplementedError('{} does not report alarms in its status registers'.format(type(self).__name__))
+
     def query(self, query_string):
-        val = self.instrument.query(query_string)
-        time.sleep(self.wait_time)
+        if self.metrics is not None:
+            val = self.timed_transaction(QUERY, self.instrument.query, query_string)
+        else:
+            self.pacer.wait(QUERY)
+            try:
+                val = self.instrument.query(query_string)
+            finally:
+                self.pacer.completed()
+
+        if val is None or not val.strip():
+            self.pacer.failure(QUERY)
+            if self.metrics is not None:
+                self.metrics.error(self.mnemonic(query_string))
+        else:
+            self.pacer.success(QUERY)
         return val
 
+    def batch(self):
+        return Batch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def query_many(self, calls):
+        """
+        Run several Query methods in as few round trips as possible.
+
+        :param calls: sequence of (bound query method, args) pairs, e.g. [(driver.get_setpoint, (1,)), ...]
+        :return: list with the processed result of each query
+        """
+        results = [self.cached_result(method, args) for method, args in calls]
+        pending = [(i, method, args) for i, ((method, args), result) in enumerate(zip(calls, results))
+                   if result is MISSING]
+        messages = [method.compose(method.__self__, *args) for _, method, args in pending]
+
+        replies = []
+        for chunk in self.split_messages(messages):
+            reply = self.query(self.compound_separator.join(chunk))
+            parts = reply.strip().split(self.compound_separator)
+            if len(parts) != len(chunk):
+                # The instrument did not answer every part of the compound message, fall back to one at a time
+                parts = [self.query(message) for message in chunk]
+            replies.extend(parts)
+
+        for (i, method, args), message, reply in zip(pending, messages, replies):
+            results[i] = self.process_batch_reply(method, reply, message)
+            if method.query_command.cache is not None:
+                self.cache.put(method.__name__, tuple(args), results[i], method.query_command.cache)
+        return results
+
+    def process_batch_reply(self, method, reply, message):
+        attempt = 0
+        while True:
+            try:
+                return self.process_reply(method, reply, message)
+            except ProcessorError:
+                attempt += 1
+                if not self.recover(attempt):
+                    raise
+            # Send the query that was garbled again, on its own
+            reply = self.query(message)
+
+    def cached_result(self, method, args):
+        if method.query_command.cache is None:
+            return MISSING
+        return self.cache.get(method.__name__, tuple(args))
+
+    def split_messages(self, messages):
+        """Group messages into compound messages that fit in the instrument's input buffer."""
+        chunks = []
+        chunk = []
+        length = 0
+        for message in messages:
+            added = len(message) + (len(self.compound_separator) if chunk else 0)
+            if chunk and length + added > self.input_buffer_size:
+                chunks.append(chunk)
+                chunk = []
+                added = len(message)
+                length = 0
+            chunk.append(message)
+            length += added
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def send_many(self, messages):
+        """Send several messages in as few compound messages as fit in the instrument's input buffer."""
+        for chunk in self.split_messages(messages):
+            self.send(self.compound_separator.join(chunk))
+
     def send(self, message):
-        self.instrument.write(message)
-        time.sleep(self.wait_time)
\ No newline at end of file
+        if self.transaction_in_progress is not None:
+            self.transaction_in_progress.add(message)
+            return
+        command_class = self.command_class(message)
+        if self.metrics is not None:
+            self.timed_transaction(command_class, self.instrument.write, message)
+        else:
+            self.pacer.wait(command_class)
+            try:
+                self.instrument.write(message)
+            finally:
+                self.pacer.completed()
+        self.pacer.success(command_class)
\ No newline at end of file
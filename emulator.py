@@ -0,0 +1,677 @@
+"""
+In-process emulators of the Lake Shore Model 218 and Model 350.
+
+The emulators have the same query()/write()/read() surface as a pyvisa resource, so a driver can be built on top of
+them without hardware:
+    LS350 = LS350_Driver(LS350Emulator(latency=0.01, jitter=0.005))
+
+They implement the commands used by the drivers, keep state (setpoints, ramps, PID, curves, alarms, ...) and model the
+temperature of each input with a first order lag towards the setpoint of the output that controls it. The model is
+deliberately simple: it is good enough to exercise the driver layer, not to predict the real cryostat.
+
+Latency, jitter and error injection make it possible to measure throughput and robustness of the driver layer:
+    latency     fixed time (s) every transaction takes
+    jitter      standard deviation (s) of a random extra delay
+    turnaround  minimum time (s) between commands, replies to commands sent sooner come back garbled
+    error_rate  probability that a reply is spoiled by one of the errors in errors:
+                    'empty'    the reply is an empty string
+                    'garbled'  some characters of the reply are corrupted
+                    'timeout'  no reply, TimeoutError is raised and the reply is lost
+                    'late'     TimeoutError is raised but the reply arrives with the next read
+"""
+import collections
+import math
+import random
+import string
+import threading
+import time
+
+ERRORS = ('empty', 'garbled', 'timeout', 'late')
+
+
+def handles(*mnemonics):
+    """Register the decorated method as the handler of mnemonics."""
+    def decorator(func):
+        func.mnemonics = mnemonics
+        return func
+    return decorator
+
+
+def pt100_curve(n_points=40, t_min=75.0, t_max=800.0):
+    """Standard platinum curve (Callendar-Van Dusen) as a list of (Ohm, K) points in increasing units."""
+    points = []
+    for i in range(n_points):
+        temperature = t_min + (t_max - t_min) * i / (n_points - 1)
+        t = temperature - 273.15
+        resistance = 100 * (1 + 3.9083e-3 * t - 5.775e-7 * t ** 2)
+        if t < 0:
+            resistance += 100 * -4.183e-12 * (t - 100) * t ** 3
+        points.append((resistance, temperature))
+    return points
+
+
+class Curve(object):
+    def __init__(self, name='', serial_number='', format=3, limit=800.0, coefficient=2, points=()):
+        self.name = name
+        self.serial_number = serial_number
+        self.format = format  # 1 = mV/K, 2 = V/K, 3 = Ohm/K, 4 = log Ohm/K
+        self.limit = limit
+        self.coefficient = coefficient  # 1 = negative, 2 = positive
+        self.points = list(points)
+
+    def sensor_units(self, temperature):
+        """Invert the curve: sensor units at temperature (K)."""
+        # A point of (0, 0) marks the end of the curve
+        points = sorted((point for point in self.points if point != (0.0, 0.0)), key=lambda point: point[1])
+        if not points:
+            return 0.0
+        if temperature <= points[0][1]:
+            units = points[0][0]
+        elif temperature >= points[-1][1]:
+            units = points[-1][0]
+        else:
+            for (u0, t0), (u1, t1) in zip(points, points[1:]):
+                if t0 <= temperature <= t1:
+                    units = u0 + (u1 - u0) * (temperature - t0) / (t1 - t0)
+                    break
+        if self.format == 4:
+            # Log Ohm curves store log10 of the resistance
+            return 10 ** units
+        return units
+
+
+class LakeShoreEmulator(object):
+    idn = 'LSCI,MODEL000,EMULATOR,1.0'
+
+    def __init__(self, latency=0.0, jitter=0.0, turnaround=0.0, error_rate=0.0, errors=('empty', 'garbled', 'timeout'),
+                 noise=0.0, seed=None, clock=time.monotonic, sleep=time.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self.turnaround = turnaround
+        self.error_rate = error_rate
+        for error in errors:
+            if error not in ERRORS:
+                raise ValueError("Unknown error {}, must be one of {}".format(error, ERRORS))
+        self.errors = errors
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+
+        # pyvisa resource attributes, kept so that code configuring a real port works unchanged
+        self.timeout = 2000
+        self.read_termination = '\r\n'
+        self.write_termination = '\r\n'
+        self.baud_rate = 9600
+        self.data_bits = 7
+        self.parity = None
+
+        self.handlers = {}
+        for klass in reversed(type(self).__mro__):
+            for value in vars(klass).values():
+                for mnemonic in getattr(value, 'mnemonics', ()):
+                    self.handlers[mnemonic] = value
+
+        self.lock = threading.RLock()
+        self.replies = collections.deque()
+        self.late = collections.deque()  # Replies held back by a 'late' error
+        self.received = []  # Every message written to the instrument
+        self.last_command_time = None
+        self.too_fast = False
+
+        self.event_status = 0
+        self.event_status_enable = 0
+        self.service_request_enable = 0
+        self.last_update = self.clock()
+
+        self.reset()
+
+    # ------------------------------------------------------------------
+    # pyvisa resource surface
+    # ------------------------------------------------------------------
+    def query(self, message):
+        with self.lock:
+            self.write(message)
+            return self.read()
+
+    def write(self, message):
+        with self.lock:
+            self.wait()
+            now = self.clock()
+            self.too_fast = self.last_command_time is not None and now - self.last_command_time < self.turnaround
+            self.last_command_time = now
+            self.received.append(message)
+
+            self.update()
+            replies = []
+            for command in message.strip().split(';'):
+                if not command.strip():
+                    continue
+                reply = self.execute(command.strip())
+                if reply is not None:
+                    replies.append(reply)
+            if replies:
+                self.replies.append(';'.join(replies))
+
+    def read(self):
+        with self.lock:
+            if self.late:
+                self.replies.appendleft(self.late.popleft())
+            if not self.replies:
+                raise TimeoutError('No reply from the emulated instrument')
+            reply = self.replies.popleft()
+
+            if self.too_fast:
+                return self.garble(reply)
+            if self.error_rate and self.random.random() < self.error_rate:
+                error = self.random.choice(self.errors)
+                if error == 'empty':
+                    return ''
+                if error == 'garbled':
+                    return self.garble(reply)
+                if error == 'timeout':
+                    raise TimeoutError('Injected timeout')
+                if error == 'late':
+                    self.late.append(reply)
+                    raise TimeoutError('Injected late reply')
+            return reply
+
+    def clear(self):
+        with self.lock:
+            self.replies.clear()
+            self.late.clear()
+
+    def close(self):
+        pass
+
+    def wait(self):
+        delay = self.latency
+        if self.jitter:
+            delay += abs(self.random.gauss(0, self.jitter))
+        if delay > 0:
+            self.sleep(delay)
+
+    def garble(self, reply):
+        if not reply:
+            return reply
+        chars = list(reply)
+        for _ in range(max(1, len(chars) // 4)):
+            chars[self.random.randrange(len(chars))] = self.random.choice(string.ascii_letters + string.punctuation)
+        return ''.join(chars)
+
+    # ------------------------------------------------------------------
+    # Command dispatch
+    # ------------------------------------------------------------------
+    def execute(self, command):
+        mnemonic, _, parameters = command.partition(' ')
+        handler = self.handlers.get(mnemonic.upper())
+        if handler is None:
+            # Unknown commands are ignored by the instrument, which sets the command error bit
+            self.event_status |= 0x20
+            return None
+        parameters = [parameter.strip() for parameter in parameters.split(',')] if parameters.strip() else []
+        try:
+            return handler(self, *parameters)
+        except (TypeError, ValueError, KeyError, IndexError):
+            self.event_status |= 0x20
+            return None
+
+    def update(self):
+        """Advance the simulated state to the current time."""
+        now = self.clock()
+        dt = now - self.last_update
+        self.last_update = now
+        if dt > 0:
+            self.advance(dt)
+
+    def advance(self, dt):
+        pass
+
+    def reset(self):
+        pass
+
+    def reading(self, value):
+        if self.noise:
+            value += self.random.gauss(0, self.noise)
+        return value
+
+    @staticmethod
+    def real(value, decimals=3):
+        return '{:+.{}f}'.format(value, decimals)
+
+    def summary_bits(self):
+        """Model specific bits of the status byte."""
+        return 0
+
+    def status_byte(self):
+        status = self.summary_bits()
+        if self.event_status & self.event_status_enable:
+            status |= 0x20
+        if status & self.service_request_enable:
+            status |= 0x40
+        return status
+
+    def sensor_units(self, input):
+        curve = self.curves.get(self.input_curves[input])
+        if curve is None:
+            return 0.0
+        return curve.sensor_units(self.temperatures[input])
+
+    # ------------------------------------------------------------------
+    # Common commands
+    # ------------------------------------------------------------------
+    @handles('*IDN?')
+    def cmd_identification(self):
+        return self.idn
+
+    @handles('*TST?')
+    def cmd_self_test(self):
+        return '0'
+
+    @handles('*CLS')
+    def cmd_clear(self):
+        self.event_status = 0
+
+    @handles('*RST')
+    def cmd_reset(self):
+        self.reset()
+
+    @handles('*OPC')
+    def cmd_operation_complete(self):
+        self.event_status |= 0x01
+
+    @handles('*OPC?')
+    def cmd_operation_complete_query(self):
+        return '1'
+
+    @handles('*ESE')
+    def cmd_set_event_status_enable(self, mask):
+        self.event_status_enable = int(mask)
+
+    @handles('*ESE?')
+    def cmd_get_event_status_enable(self):
+        return str(self.event_status_enable)
+
+    @handles('*ESR?')
+    def cmd_event_status(self):
+        status, self.event_status = self.event_status, 0
+        return str(status)
+
+    @handles('*SRE')
+    def cmd_set_service_request_enable(self, mask):
+        self.service_request_enable = int(mask)
+
+    @handles('*SRE?')
+    def cmd_get_service_request_enable(self):
+        return str(self.service_request_enable)
+
+    @handles('*STB?')
+    def cmd_status_byte(self):
+        return str(self.status_byte())
+
+    @handles('CRVHDR')
+    def cmd_set_curve_header(self, curve, name, serial_number, format, limit, coefficient):
+        header = self.curves.setdefault(int(curve), Curve())
+        header.name = name
+        header.serial_number = serial_number
+        header.format = int(format)
+        header.limit = float(limit)
+        header.coefficient = int(coefficient)
+
+    @handles('CRVHDR?')
+    def cmd_get_curve_header(self, curve):
+        header = self.curves.get(int(curve), Curve())
+        return '{:<15},{:<10},{},{},{}'.format(header.name, header.serial_number, header.format,
+                                              self.real(header.limit), header.coefficient)
+
+    @handles('CRVPT')
+    def cmd_set_curve_data_point(self, curve, index, units, temperature):
+        points = self.curves.setdefault(int(curve), Curve()).points
+        index = int(index)
+        while len(points) < index:
+            points.append((0.0, 0.0))
+        # The instrument keeps 6 significant digits of both values
+        points[index - 1] = (float('{:.6g}'.format(float(units))), float('{:.6g}'.format(float(temperature))))
+
+    @handles('CRVPT?')
+    def cmd_get_curve_data_point(self, curve, index):
+        points = self.curves.get(int(curve), Curve()).points
+        index = int(index)
+        units, temperature = points[index - 1] if index <= len(points) else (0.0, 0.0)
+        return '{:+.6g},{:+.6g}'.format(units, temperature)
+
+    @handles('CRVDEL')
+    def cmd_delete_curve(self, curve):
+        self.curves.pop(int(curve), None)
+
+
+class LS350Emulator(LakeShoreEmulator):
+    idn = 'LSCI,MODEL350,EMULATOR,1.0'
+    inputs = ('A', 'B', 'C', 'D')
+    outputs = (1, 2, 3, 4)
+
+    def __init__(self, time_constant=30.0, ambient=295.0, **kwargs):
+        self.time_constant = time_constant  # Time constant (s) with which an input follows its setpoint
+        self.ambient = ambient
+        super().__init__(**kwargs)
+
+    def reset(self):
+        self.brightness = 32
+        self.temperatures = {input: self.ambient for input in self.inputs}
+        # Outputs 1-4 control inputs A-D
+        self.control_inputs = dict(zip(self.outputs, self.inputs))
+        self.setpoints = {output: self.ambient for output in self.outputs}
+        self.ramp_targets = dict(self.setpoints)
+        self.ramps = {output: (0, 0.0) for output in self.outputs}
+        self.pids = {output: (50.0, 20.0, 0.0) for output in self.outputs}
+        self.heater_ranges = {output: 0 for output in self.outputs}
+        self.heater_status = {output: 0 for output in self.outputs}
+        self.curves = {6: Curve('PT-100', 'STANDARD', 3, 800.0, 2, pt100_curve())}
+        self.input_curves = {input: 6 for input in self.inputs}
+        self.alarms = {input: (0, 0.0, 0.0, 0.0, 0, 0, 0) for input in self.inputs}
+        self.latched_alarms = {input: (0, 0) for input in self.inputs}
+        self.operation_event = 0
+        self.operation_event_enable = 0
+
+    def operation_condition(self):
+        # Bit 0: an alarm is active
+        return int(any(any(status) for status in self.latched_alarms.values()))
+
+    def summary_bits(self):
+        return 0x80 if self.operation_event & self.operation_event_enable else 0
+
+    def advance(self, dt):
+        for output in self.outputs:
+            on_off, rate = self.ramps[output]
+            target = self.ramp_targets[output]
+            setpoint = self.setpoints[output]
+            if on_off and rate > 0 and setpoint != target:
+                step = rate / 60 * dt
+                if abs(target - setpoint) <= step:
+                    setpoint = target
+                else:
+                    setpoint += math.copysign(step, target - setpoint)
+                self.setpoints[output] = setpoint
+
+            input = self.control_inputs[output]
+            self.temperatures[input] += (setpoint - self.temperatures[input]) * (1 - math.exp(-dt / self.time_constant))
+
+        for input in self.inputs:
+            self.update_alarm(input)
+
+    def update_alarm(self, input):
+        on_off, high, low, deadband, latch, _, _ = self.alarms[input]
+        if not on_off:
+            self.latched_alarms[input] = (0, 0)
+            return
+        temperature = self.temperatures[input]
+        previous = self.latched_alarms[input]
+        high_status, low_status = previous
+        if temperature >= high:
+            high_status = 1
+        elif not latch and temperature < high - deadband:
+            high_status = 0
+        if temperature <= low:
+            low_status = 1
+        elif not latch and temperature > low + deadband:
+            low_status = 0
+        self.latched_alarms[input] = (high_status, low_status)
+        if (high_status and not previous[0]) or (low_status and not previous[1]):
+            self.operation_event |= 0x01
+
+    def set_heater_fault(self, output, code):
+        """Simulate a heater fault (1 = open load, 2 = short) on output, 0 clears it."""
+        with self.lock:
+            self.heater_status[output] = code
+
+    @handles('BRIGT')
+    def cmd_set_brightness(self, brightness):
+        self.brightness = int(brightness)
+
+    @handles('BRIGT?')
+    def cmd_get_brightness(self):
+        return str(self.brightness)
+
+    @handles('KRDG?')
+    def cmd_kelvin_reading(self, input):
+        return self.real(self.reading(self.temperatures[input.upper()]))
+
+    @handles('CRDG?')
+    def cmd_celsius_reading(self, input):
+        return self.real(self.reading(self.temperatures[input.upper()]) - 273.15)
+
+    @handles('SRDG?')
+    def cmd_sensor_reading(self, input):
+        return self.real(self.reading(self.sensor_units(input.upper())), 4)
+
+    @handles('INCRV')
+    def cmd_set_input_curve_number(self, input, curve):
+        self.input_curves[input.upper()] = int(curve)
+
+    @handles('INCRV?')
+    def cmd_get_input_curve_number(self, input):
+        return str(self.input_curves[input.upper()])
+
+    @handles('HTR?')
+    def cmd_heater_output(self, output):
+        output = int(output)
+        if not self.heater_ranges[output] or self.heater_status[output]:
+            return self.real(0.0, 2)
+        error = self.setpoints[output] - self.temperatures[self.control_inputs[output]]
+        return self.real(min(100.0, max(0.0, 50.0 + self.pids[output][0] * error)), 2)
+
+    @handles('HTRST?')
+    def cmd_heater_status(self, output):
+        return str(self.heater_status[int(output)])
+
+    @handles('PID')
+    def cmd_set_pid(self, output, p, i, d):
+        self.pids[int(output)] = (float(p), float(i), float(d))
+
+    @handles('PID?')
+    def cmd_get_pid(self, output):
+        return ','.join(self.real(value, 1) for value in self.pids[int(output)])
+
+    @handles('RAMP')
+    def cmd_set_ramp(self, output, on_off, rate):
+        self.ramps[int(output)] = (int(on_off), float(rate))
+
+    @handles('RAMP?')
+    def cmd_get_ramp(self, output):
+        on_off, rate = self.ramps[int(output)]
+        return '{},{}'.format(on_off, self.real(rate, 1))
+
+    @handles('RAMPST?')
+    def cmd_ramp_status(self, output):
+        output = int(output)
+        return '1' if self.setpoints[output] != self.ramp_targets[output] else '0'
+
+    @handles('RANGE')
+    def cmd_set_heater_range(self, output, range):
+        self.heater_ranges[int(output)] = int(range)
+
+    @handles('RANGE?')
+    def cmd_get_heater_range(self, output):
+        return str(self.heater_ranges[int(output)])
+
+    @handles('SETP')
+    def cmd_set_setpoint(self, output, value):
+        output = int(output)
+        self.ramp_targets[output] = float(value)
+        on_off, rate = self.ramps[output]
+        if not on_off or rate <= 0:
+            self.setpoints[output] = float(value)
+
+    @handles('SETP?')
+    def cmd_get_setpoint(self, output):
+        return self.real(self.setpoints[int(output)])
+
+    @handles('ALARM')
+    def cmd_set_alarm(self, input, off_on, high, low, deadband, latch, audible=0, visible=0):
+        self.alarms[input.upper()] = (int(off_on), float(high), float(low), float(deadband), int(latch),
+                                      int(audible), int(visible))
+        self.update_alarm(input.upper())
+
+    @handles('ALARM?')
+    def cmd_get_alarm(self, input):
+        off_on, high, low, deadband, latch, audible, visible = self.alarms[input.upper()]
+        return '{},{},{},{},{},{},{}'.format(off_on, self.real(high), self.real(low), self.real(deadband), latch,
+                                             audible, visible)
+
+    @handles('ALARMST?')
+    def cmd_alarm_status(self, input):
+        return '{},{}'.format(*self.latched_alarms[input.upper()])
+
+    @handles('OPST?')
+    def cmd_operation_event(self):
+        event, self.operation_event = self.operation_event, 0
+        return str(event)
+
+    @handles('OPSTR?')
+    def cmd_operation_condition(self):
+        return str(self.operation_condition())
+
+    @handles('OPSTE')
+    def cmd_set_operation_event_enable(self, mask):
+        self.operation_event_enable = int(mask)
+
+    @handles('OPSTE?')
+    def cmd_get_operation_event_enable(self):
+        return str(self.operation_event_enable)
+
+    @handles('ALMRST')
+    def cmd_reset_alarms(self):
+        for input in self.inputs:
+            self.latched_alarms[input] = (0, 0)
+            self.update_alarm(input)
+
+
+class LS218Emulator(LakeShoreEmulator):
+    idn = 'LSCI,MODEL218S,EMULATOR,1.0'
+    inputs = (1, 2, 3, 4, 5, 6, 7, 8)
+
+    def __init__(self, temperatures=None, **kwargs):
+        self.initial_temperatures = temperatures
+        super().__init__(**kwargs)
+
+    def reset(self):
+        if self.initial_temperatures is None:
+            self.temperatures = {input: 295.0 - 10 * (input - 1) for input in self.inputs}
+        else:
+            self.temperatures = dict(zip(self.inputs, self.initial_temperatures))
+        self.baud = 2
+        self.audible_alarm = 1
+        self.curves = {6: Curve('PT-100', 'STANDARD', 3, 800.0, 2, pt100_curve())}
+        self.input_curves = {input: 6 for input in self.inputs}
+        self.alarms = {input: (0, 1, 0.0, 0.0, 0.0, 0) for input in self.inputs}
+        self.latched_alarms = {input: (0, 0) for input in self.inputs}
+        self.analog_outputs = {output: (0, 0, 1, 1, 0.0, 0.0, 0.0) for output in (1, 2)}
+
+    def set_temperature(self, input, temperature):
+        with self.lock:
+            self.temperatures[input] = temperature
+
+    def advance(self, dt):
+        for input in self.inputs:
+            self.update_alarm(input)
+
+    def source_value(self, input, source):
+        if source == 2:
+            return self.temperatures[input] - 273.15
+        if source == 3 or source == 4:
+            return self.sensor_units(input)
+        return self.temperatures[input]
+
+    def update_alarm(self, input):
+        off_on, source, high, low, deadband, latch = self.alarms[input]
+        if not off_on:
+            self.latched_alarms[input] = (0, 0)
+            return
+        value = self.source_value(input, source)
+        high_status, low_status = self.latched_alarms[input]
+        if value >= high:
+            high_status = 1
+        elif not latch and value < high - deadband:
+            high_status = 0
+        if value <= low:
+            low_status = 1
+        elif not latch and value > low + deadband:
+            low_status = 0
+        self.latched_alarms[input] = (high_status, low_status)
+
+    def all_or_one(self, input, convert):
+        input = int(input)
+        inputs = self.inputs if input == 0 else (input,)
+        return ','.join(convert(input) for input in inputs)
+
+    @handles('KRDG?')
+    def cmd_kelvin_reading(self, input):
+        return self.all_or_one(input, lambda input: self.real(self.reading(self.temperatures[input])))
+
+    @handles('CRDG?')
+    def cmd_celsius_reading(self, input):
+        return self.all_or_one(input, lambda input: self.real(self.reading(self.temperatures[input]) - 273.15))
+
+    @handles('SRDG?')
+    def cmd_sensor_reading(self, input):
+        return self.all_or_one(input, lambda input: self.real(self.reading(self.sensor_units(input)), 4))
+
+    @handles('ALARM')
+    def cmd_set_alarm(self, input, off_on, source, high, low, deadband, latch):
+        input = int(input)
+        self.alarms[input] = (int(off_on), int(source), float(high), float(low), float(deadband), int(latch))
+        self.update_alarm(input)
+
+    @handles('ALARM?')
+    def cmd_get_alarm(self, input):
+        off_on, source, high, low, deadband, latch = self.alarms[int(input)]
+        return '{},{},{},{},{},{}'.format(off_on, source, self.real(high), self.real(low), self.real(deadband), latch)
+
+    @handles('ALARMST?')
+    def cmd_alarm_status(self, input):
+        return '{},{}'.format(*self.latched_alarms[int(input)])
+
+    @handles('ALMB')
+    def cmd_set_audible_alarm(self, on_off):
+        self.audible_alarm = int(on_off)
+
+    @handles('ALMB?')
+    def cmd_get_audible_alarm(self):
+        return str(self.audible_alarm)
+
+    @handles('ALMRST')
+    def cmd_reset_alarms(self):
+        for input in self.inputs:
+            self.latched_alarms[input] = (0, 0)
+            self.update_alarm(input)
+
+    @handles('ANALOG')
+    def cmd_set_analog(self, output, bipolar_enable, mode, input, source, high, low, manual):
+        self.analog_outputs[int(output)] = (int(bipolar_enable), int(mode), int(input), int(source), float(high),
+                                            float(low), float(manual))
+
+    @handles('ANALOG?')
+    def cmd_get_analog(self, output):
+        bipolar_enable, mode, input, source, high, low, manual = self.analog_outputs[int(output)]
+        return '{},{},{},{},{},{},{}'.format(bipolar_enable, mode, input, source, self.real(high), self.real(low),
+                                             self.real(manual))
+
+    @handles('AOUT?')
+    def cmd_analog_output(self, output):
+        bipolar_enable, mode, input, source, high, low, manual = self.analog_outputs[int(output)]
+        if mode == 0:
+            return self.real(0.0, 1)
+        if mode == 2:
+            return self.real(manual, 1)
+        value = self.source_value(input, source)
+        span = high - low
+        percent = 100.0 * (value - low) / span if span else 0.0
+        return self.real(min(100.0, max(-100.0 if bipolar_enable else 0.0, percent)), 1)
+
+    @handles('BAUD')
+    def cmd_set_baud(self, bps):
+        self.baud = int(bps)
+
+    @handles('BAUD?')
+    def cmd_get_baud(self):
+        return str(self.baud)
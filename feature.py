@@ -21,20 +21,55 @@ to execute the action.
 
 When the setter is called (e.g. feature_name = 10), the __set__ function is called which uses the fset function to
 execute the action.
+
+An indexed Feature (Feature(indexed=True)) stands for one setting per output/input, its getter and setter take the index
+as first argument and it is used with square brackets:
+    LS350.setpoint[1] = 295
+    print(LS350.setpoint[1])
+
+Features built on a Query/Write pair are declared with command_feature:
+    setpoint = command_feature('get_setpoint', 'set_setpoint', indexed=True)
+
+The driver keeps a shadow copy of the last value of every feature it read or wrote. Inside a transaction setting a
+feature to its shadow value sends nothing, setting it twice only sends the last value, and the remaining writes are
+sent together as compound messages when the block ends:
+    with LS350.transaction():
+        LS350.ramp[2] = (1, 10)
+        LS350.setpoint[2] = 178.15
+Outside a transaction every set is sent, since the value may have been changed on the front panel. Any Write of the
+driver that changes a feature (its setter called directly, set_setpoint_celsius, a write that invalidates the getter, a
+reset) evicts its shadow value, so the next set in a transaction is sent.
 """
+from cache import MISSING
+from driver import as_tuple
 
 
 class Feature(object):
-    def __init__(self):
+    def __init__(self, indexed=False, validators=None, processors=None):
+        """
+        :param indexed: the feature has one value per index (e.g. output), accessed as driver.feature[index]
+        :param validators: validators of the value set
+        :param processors: processors applied to the value the getter returns
+        """
         self.fget = None  # Getter function
         self.fset = None  # Setter function
+        # Names of the driver's Query and Write the feature is built on (see command_feature), a Write to the setter
+        # or invalidating the getter evicts the shadow value
+        self.getter_name = None
+        self.setter_name = None
+        self.indexed = indexed
+        self.name = None
 
-        self.get_validators = []
-        self.set_validators = []
+        self.set_validators = as_tuple(validators)
+        self.get_processors = as_tuple(processors)
+
+    def __set_name__(self, owner, name):
+        self.name = name
 
     def __call__(self, func):
         if self.fget is None:
             return self.getter(func)
+        return self.setter(func)
 
     def getter(self, func):
         self.fget = func
@@ -45,16 +80,81 @@ class Feature(object):
         return self
 
     def __get__(self, instance, owner):
-        for validator in self.set_validators:
-            validator.validate()
+        if instance is None:
+            return self
+        if self.indexed:
+            return IndexedFeature(self, instance)
+        return self.get(instance, ())
 
-        value = self.fget(instance)
+    def __set__(self, instance, value):
+        if self.indexed:
+            raise AttributeError('{} is indexed, set {}[index] instead'.format(self.name, self.name))
+        self.set(instance, (), value)
+
+    def get(self, instance, index):
+        value = self.fget(instance, *index)
         for processor in self.get_processors:
-            value = processor.process(value)
+            value = processor(value)
+        instance.shadow[(self.name,) + index] = value
         return value
 
-    def __set__(self, instance, value):
+    def set(self, instance, index, value):
+        if self.fset is None:
+            raise AttributeError('{} cannot be set'.format(self.name))
         for validator in self.set_validators:
-            validator.validate(value)
+            validator(value)
+
+        key = (self.name,) + index
+        transaction = instance.transaction_in_progress
+        if transaction is None:
+            self.fset(instance, *(index + (value,)))
+        else:
+            transaction.discard(key)
+            if instance.shadow.get(key, MISSING) == value:
+                # The instrument already has this value
+                return
+            with transaction.collect(key, value):
+                self.fset(instance, *(index + (value,)))
+            return
+        instance.shadow[key] = value
+
+
+class IndexedFeature(object):
+    """Feature bound to a driver, indexed with the output/input it applies to."""
+    def __init__(self, feature, instance):
+        self.feature = feature
+        self.instance = instance
+
+    def __getitem__(self, index):
+        return self.feature.get(self.instance, as_tuple(index))
+
+    def __setitem__(self, index, value):
+        self.feature.set(self.instance, as_tuple(index), value)
+
+
+def command_feature(getter_name, setter_name=None, indexed=False, fields=None):
+    """
+    Build a Feature from the driver's Query and Write methods.
+
+    :param fields: for settings with several values, the names of the getter's result fields in the order the setter
+                   takes them, e.g. fields=('P', 'I', 'D') for LS350.pid[1] = (50, 20, 0)
+    """
+    feature = Feature(indexed=indexed)
+    feature.getter_name = getter_name
+    feature.setter_name = setter_name
+
+    @feature.getter
+    def get(self, *index):
+        value = getattr(self, getter_name)(*index)
+        if fields is not None:
+            value = tuple(value[field] for field in fields)
+        return value
+
+    if setter_name is not None:
+        @feature.setter
+        def set(self, *args):
+            index, value = args[:-1], args[-1]
+            values = tuple(value) if fields is not None else (value,)
+            getattr(self, setter_name)(*(index + values))
 
-        return self.fset(instance, value)
\ No newline at end of file
+    return feature
@@ -0,0 +1,242 @@
+"""
+Bounded, multi-resolution history of the sampled records for live plotting.
+
+History is fed the records of Station.measure_temperature (time first, then the values) and keeps:
+    - the most recent records as they are (raw)
+    - min/mean/max buckets of every column at several resolutions, 1 s, 1 min and 10 min by default
+Every level is a preallocated NumPy ring, so the memory used is fixed when the History is created, however long the run
+lasts. The records of a level are ordered by time, so a time range is located by binary search (O(log n)) and returned
+without scanning the level.
+
+query() picks the finest level that still covers the requested range within a number of points, and lttb() reduces a
+series to a given number of points while keeping its shape (Largest-Triangle-Three-Buckets), e.g. for a plot that is
+only a few hundred pixels wide:
+    history = History(COLUMNS)
+    station = Station(..., history=history)
+    ...
+    t, T = history.decimate('Sample Temperature (C)', start, end, 500)
+"""
+import threading
+
+import numpy as np
+
+# (bucket width in seconds, number of buckets kept): 6 hours of 1 s, 1 week of 1 min and 2 months of 10 min buckets
+DEFAULT_RESOLUTIONS = ((1.0, 21600), (60.0, 10080), (600.0, 8640))
+
+
+class TimeRing(object):
+    """Preallocated ring of rows appended in time order, the time is column 0."""
+    def __init__(self, capacity, width):
+        self.data = np.full((capacity, width), np.nan)
+        self.capacity = capacity
+        self.index = 0  # Where the next row goes
+        self.count = 0  # Number of rows held
+
+    def append(self, row):
+        self.data[self.index] = row
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def segments(self):
+        """The rows as at most two views, oldest first."""
+        if self.count < self.capacity:
+            return [self.data[:self.count]]
+        return [self.data[self.index:], self.data[:self.index]]
+
+    def range(self, start=-np.inf, end=np.inf):
+        """Copy of the rows with start <= time <= end."""
+        parts = []
+        for segment in self.segments():
+            times = segment[:, 0]
+            first = np.searchsorted(times, start, side='left')
+            last = np.searchsorted(times, end, side='right')
+            if last > first:
+                parts.append(segment[first:last])
+        if not parts:
+            return np.empty((0, self.data.shape[1]))
+        return np.concatenate(parts)
+
+    def count_range(self, start=-np.inf, end=np.inf):
+        """Number of rows with start <= time <= end, i.e. len(self.range(start, end)) without copying them."""
+        return sum(np.searchsorted(segment[:, 0], end, side='right') -
+                   np.searchsorted(segment[:, 0], start, side='left') for segment in self.segments())
+
+    @property
+    def oldest(self):
+        if not self.count:
+            return np.inf
+        return self.segments()[0][0, 0]
+
+    def __len__(self):
+        return self.count
+
+
+class BucketLevel(object):
+    """Min/mean/max of every value over consecutive buckets of width seconds."""
+    def __init__(self, width, capacity, n_values):
+        self.width = width
+        self.n_values = n_values
+        # Row layout: bucket start, number of records, means, minima, maxima
+        self.ring = TimeRing(capacity, 2 + 3 * n_values)
+        self.start = None  # Start of the bucket being filled
+        self.count = 0
+        self.sum = np.zeros(n_values)
+        self.min = np.zeros(n_values)
+        self.max = np.zeros(n_values)
+
+    def add(self, t, values):
+        start = np.floor(t / self.width) * self.width
+        if start != self.start:
+            self.close_bucket()
+            self.start = start
+            self.count = 0
+            self.sum[:] = 0.0
+            self.min[:] = np.inf
+            self.max[:] = -np.inf
+        self.count += 1
+        self.sum += values
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+    def current(self):
+        """Row of the bucket being filled, or None."""
+        if self.start is None or not self.count:
+            return None
+        return np.concatenate(([self.start, self.count], self.sum / self.count, self.min, self.max))
+
+    @property
+    def oldest(self):
+        """Start of the oldest bucket held, including the one being filled."""
+        if self.ring.count:
+            return self.ring.oldest
+        return self.start if self.start is not None else np.inf
+
+    def close_bucket(self):
+        row = self.current()
+        if row is not None:
+            self.ring.append(row)
+
+    def range(self, start=-np.inf, end=np.inf, include_current=True):
+        rows = self.ring.range(start, end)
+        row = self.current() if include_current else None
+        if row is not None and start <= row[0] <= end:
+            rows = np.vstack((rows, row))
+        return rows
+
+    def count_range(self, start=-np.inf, end=np.inf):
+        """Number of buckets range(start, end) returns, the one being filled included."""
+        row = self.current()
+        return self.ring.count_range(start, end) + int(row is not None and start <= row[0] <= end)
+
+    def split(self, rows):
+        """Split rows into a dict of arrays: time, count, mean, min and max (each n_rows x n_values)."""
+        n = self.n_values
+        return {'time': rows[:, 0], 'count': rows[:, 1], 'mean': rows[:, 2:2 + n], 'min': rows[:, 2 + n:2 + 2 * n],
+                'max': rows[:, 2 + 2 * n:2 + 3 * n]}
+
+
+class History(object):
+    def __init__(self, columns, raw_capacity=36000, resolutions=DEFAULT_RESOLUTIONS):
+        """
+        :param columns: names of the columns of a record, the first one is the time
+        :param raw_capacity: number of the most recent records kept as they are
+        :param resolutions: (bucket width in seconds, number of buckets kept) of every level of min/mean/max buckets
+        """
+        self.columns = tuple(columns)
+        self.raw = TimeRing(raw_capacity, len(self.columns))
+        self.levels = [BucketLevel(width, capacity, len(self.columns) - 1) for width, capacity in sorted(resolutions)]
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        record = np.asarray(record, dtype=float)
+        with self.lock:
+            self.raw.append(record)
+            for level in self.levels:
+                level.add(record[0], record[1:])
+
+    def column(self, name):
+        index = self.columns.index(name)
+        if index == 0:
+            raise ValueError('{} is the time column'.format(name))
+        return index
+
+    def level(self, width):
+        for level in self.levels:
+            if level.width == width:
+                return level
+        raise ValueError('No level with buckets of {} s, the levels are {}'.format(
+            width, [level.width for level in self.levels]))
+
+    def records(self, start=-np.inf, end=np.inf):
+        """Raw records between start and end, as far as they are still kept."""
+        with self.lock:
+            return self.raw.range(start, end)
+
+    def buckets(self, width, start=-np.inf, end=np.inf):
+        """Buckets of width seconds between start and end, as a dict of time, count, mean, min and max arrays."""
+        level = self.level(width)
+        with self.lock:
+            return level.split(level.range(start, end))
+
+    def query(self, start, end, max_points=1000):
+        """
+        Data between start and end at the finest resolution that covers the range in at most max_points.
+
+        :return: (resolution, data), resolution is None for raw records (an array of records) and the bucket width for
+                 buckets (a dict as returned by buckets())
+        """
+        with self.lock:
+            if self.raw.oldest <= start and self.raw.count_range(start, end) <= max_points:
+                return None, self.raw.range(start, end)
+            for level in self.levels:
+                if level.oldest <= start and level.count_range(start, end) <= max_points:
+                    return level.width, level.split(level.range(start, end))
+            # Nothing covers the whole range, the coarsest level goes back the furthest
+            level = self.levels[-1]
+            return level.width, level.split(level.range(start, end))
+
+    def decimate(self, name, start, end, n_points):
+        """Series (time, values) of a column between start and end, reduced to n_points with LTTB."""
+        index = self.column(name)
+        resolution, data = self.query(start, end, max_points=max(n_points * 10, 1000))
+        if resolution is None:
+            t, y = data[:, 0], data[:, index]
+        else:
+            t, y = data['time'], data['mean'][:, index - 1]
+        return lttb(t, y, n_points)
+
+
+def lttb(x, y, n_points):
+    """
+    Reduce the series (x, y) to n_points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, the points between them are split into n_points - 2 buckets and from every
+    bucket the point forming the largest triangle with the point kept from the previous bucket and the mean of the next
+    bucket is kept.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(x)
+    if n_points >= size or size <= 2:
+        return x.copy(), y.copy()
+    if n_points < 3:
+        raise ValueError('LTTB needs at least 3 points, got {}'.format(n_points))
+
+    edges = np.linspace(1, size - 1, n_points - 1).astype(int)
+    selected = np.empty(n_points, dtype=int)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    a = 0
+    for i in range(n_points - 2):
+        first, last = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[last:edges[i + 2]].mean()
+            next_y = y[last:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[first:last] - y[a]) - (x[a] - x[first:last]) * (next_y - y[a]))
+        a = first + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return x[selected], y[selected]
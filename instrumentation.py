@@ -0,0 +1,198 @@
+"""
+Per-command latency and bus utilization metrics for drivers.
+
+Instrumentation is off by default. driver.enable_metrics() attaches a DriverMetrics that records, per command mnemonic
+(e.g. 'KRDG?', 'SETP', or 'KRDG?;SETP?' for a compound message):
+    transport   time the bus was busy with the transaction (write, and read of the reply)
+    pacing      time spent waiting for the instrument's turnaround before the transaction
+    processing  time spent validating the arguments and running the processors on the reply
+as latency histograms, plus call and error counts. From those it derives the bus duty cycle (fraction of the wall time
+the instrument's bus was busy) and the host load (fraction of the wall time the host spent processing), which give how
+many instruments one host can poll at a given rate.
+
+metrics.snapshot() returns everything as plain dicts, prometheus(*metrics) formats any number of drivers' metrics in
+the Prometheus text exposition format.
+"""
+import bisect
+import threading
+import time
+
+# Upper bounds (s) of the latency buckets, 10 us to 10 s in 1-2.5-5 steps
+LATENCY_BOUNDS = tuple(scale * 10.0 ** exponent for exponent in range(-5, 1) for scale in (1, 2.5, 5)) + (10.0,)
+
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket collects everything above the largest bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating linearly within the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                if i == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def cumulative_counts(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+                'buckets': list(self.cumulative_counts())}
+
+
+class CommandMetrics(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.transport = Histogram()
+        self.pacing = Histogram()
+        self.processing = Histogram()
+
+    def snapshot(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'transport': self.transport.snapshot(),
+                'pacing': self.pacing.snapshot(),
+                'processing': self.processing.snapshot()}
+
+
+class DriverMetrics(object):
+    def __init__(self, name, clock=time.perf_counter):
+        """:param name: name of the instrument, used as the instrument label"""
+        self.name = name
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.started = self.clock()
+            self.busy = 0.0
+            self.paced = 0.0
+            self.processed = 0.0
+
+    def command(self, mnemonic):
+        metrics = self.commands.get(mnemonic)
+        if metrics is None:
+            metrics = self.commands[mnemonic] = CommandMetrics()
+        return metrics
+
+    def transaction(self, mnemonic, transport, pacing):
+        with self.lock:
+            metrics = self.command(mnemonic)
+            metrics.count += 1
+            metrics.transport.observe(transport)
+            metrics.pacing.observe(pacing)
+            self.busy += transport
+            self.paced += pacing
+
+    def processing(self, mnemonic, seconds):
+        with self.lock:
+            self.command(mnemonic).processing.observe(seconds)
+            self.processed += seconds
+
+    def error(self, mnemonic):
+        with self.lock:
+            self.command(mnemonic).errors += 1
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def duty_cycle(self):
+        """Fraction of the time since the metrics were (re)started that the bus was busy with this instrument."""
+        elapsed = self.elapsed
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def occupancy(self):
+        """Like duty_cycle, but also counting the turnaround the instrument needed between transactions."""
+        elapsed = self.elapsed
+        return (self.busy + self.paced) / elapsed if elapsed > 0 else 0.0
+
+    def host_load(self):
+        """Fraction of the time the host spent validating and processing for this instrument."""
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {'instrument': self.name,
+                    'elapsed': self.elapsed,
+                    'duty_cycle': self.duty_cycle(),
+                    'occupancy': self.occupancy(),
+                    'host_load': self.host_load(),
+                    'commands': {mnemonic: metrics.snapshot() for mnemonic, metrics in self.commands.items()}}
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(*driver_metrics, prefix='pyinstr'):
+    """Format the metrics of one or more drivers in the Prometheus text exposition format."""
+    lines = []
+
+    def header(name, kind, description):
+        lines.append('# HELP {}_{} {}'.format(prefix, name, description))
+        lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+    snapshots = [(metrics, metrics.snapshot()) for metrics in driver_metrics]
+
+    for name, key, description in (
+            ('commands_total', 'count', 'Transactions per command mnemonic.'),
+            ('command_errors_total', 'errors', 'Failed transactions and unparsable replies per command.')):
+        header(name, 'counter', description)
+        for metrics, snapshot in snapshots:
+            for mnemonic, command in sorted(snapshot['commands'].items()):
+                lines.append('{}_{}{{instrument="{}",command="{}"}} {}'.format(
+                    prefix, name, label(metrics.name), label(mnemonic), command[key]))
+
+    for name, description in (('transport', 'Time the bus was busy with a transaction.'),
+                              ('pacing', 'Time waited for the instrument turnaround before a transaction.'),
+                              ('processing', 'Time spent validating arguments and processing replies.')):
+        header(name + '_seconds', 'histogram', description)
+        for metrics in driver_metrics:
+            with metrics.lock:
+                for mnemonic, command in sorted(metrics.commands.items()):
+                    histogram = getattr(command, name)
+                    labels = 'instrument="{}",command="{}"'.format(label(metrics.name), label(mnemonic))
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append('{}_{}_seconds_bucket{{{},le="{}"}} {}'.format(
+                            prefix, name, labels, '+Inf' if bound == float('inf') else repr(bound), count))
+                    lines.append('{}_{}_seconds_sum{{{}}} {!r}'.format(prefix, name, labels, histogram.sum))
+                    lines.append('{}_{}_seconds_count{{{}}} {}'.format(prefix, name, labels, histogram.count))
+
+    for name, key, description in (
+            ('bus_duty_cycle', 'duty_cycle', 'Fraction of the time the bus was busy with the instrument.'),
+            ('bus_occupancy', 'occupancy', 'Fraction of the time the bus was busy or waiting for the instrument.'),
+            ('host_load', 'host_load', 'Fraction of the time the host spent processing for the instrument.')):
+        header(name, 'gauge', description)
+        for metrics, snapshot in snapshots:
+            lines.append('{}_{}{{instrument="{}"}} {!r}'.format(prefix, name, label(metrics.name), snapshot[key]))
+
+    return '\n'.join(lines) + '\n'
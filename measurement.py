@@ -1,17 +1,23 @@
-from time import time, strftime
-import numpy as np
+from time import sleep, strftime, time
 
+import json
 import logging
-
-import nidaqmx
-import visa
-from nidaqmx import task
-from nidaqmx.constants import AcquisitionType, TerminalConfiguration
+import os
+import sys
 
 from LS350_Driver import LS350_Driver
-
-rm = visa.ResourceManager()
-print(rm.list_resources())
+from cache import QueryCache
+from compression import DEADBAND, SWINGING_DOOR, CompressedLog, RecordCompressor
+from conversion import CurveConverter
+from curves import CurveStore
+from daq import ContinuousPressureSource, NIDAQReader, StaticPressureSource
+from datalog import BinaryLogWriter, export_csv
+from history import DEFAULT_RESOLUTIONS, History
+from pacing import NullPacer
+from protocol import ProtocolError, ProtocolRunner, estimate_runtime, load_steps
+from replay import RecordingResource, ReplayResource
+from station import COLUMNS, Station
+from transport import ResilientResource
 
 # ----------------------------------
 # Configuration. Set parameters here
@@ -23,215 +29,286 @@ T_range = 0.2
 ramp_rate = 10  # 10 K/minute
 settle_time = 30  # seconds
 timeout = 600  # seconds
+settle_slope_limit = 0.1  # C/minute, maximum drift of the sample temperature while settling
+poll_interval = (0.2, 5.0)  # seconds between samples close to the setpoint, and while ramping or far from it
+record_interval = None  # longest time in seconds between recorded samples while settling, None to follow the polling
 
+T_set = -95
+n_cycles = 2
+soak_time = 3600  # seconds
 VTI_T_diff = 0  # K
 
+# Convert the sensor readings to temperatures on the host (one query per input instead of two). Off by default: check a
+# setup first with validate_conversion, which also reads the controller's temperatures and logs where the two disagree,
+# then switch validate_conversion off to save the extra query.
+local_conversion = False
+validate_conversion = True
+curve_directory = 'curves'
+
 LS350_address = 'ASRL9::INSTR'
 VTI_input = 'A'
 sample_input = 'B'
 VTI_output = 1
 sample_output = 2
 
-log_filename = '{}.log'.format(filename.split('.')[0])
-logging.basicConfig(filename=log_filename, format='%(asctime)s.%(msecs)03d:%(levelname)s: %(message)s',
-                    datefmt='%d/%m/%Y %H:%M:%S', level=logging.INFO)
-
-
-res = rm.open_resource(LS350_address)
-res.data_bits = 7
-res.parity = visa.constants.Parity.odd
-res.baud_rate = 56000
-res.read_termination = '\r\n'
-LS350 = LS350_Driver(res)
-
-print(LS350.identification())
-
-
-task = nidaqmx.Task()
-task.ai_channels.add_ai_voltage_chan('Dev1/ai29', terminal_config=TerminalConfiguration.RSE, min_val=-10, max_val=10)
-task.ai_channels.add_ai_voltage_chan('Dev1/ai21', terminal_config=TerminalConfiguration.RSE, min_val=-10, max_val=10)
-task.timing.cfg_samp_clk_timing(rate=1000, sample_mode=AcquisitionType.FINITE, samps_per_chan=100)
-
-file = open(filename, 'w', buffering=1)
-file.write('FILENAME: {}\n'.format(filename))
-file.write('DATETIME: {}\n'.format(strftime("%c")))
-file.write('SETUP: Ramp Rate={} C/minute\n'.format(ramp_rate))
-file.write('SETUP: Temperature settle range=+/-{} C\n'.format(T_range))
-file.write('SETUP: He flow {} mba\n'.format(He_flow))
-file.write('SETTINGS:\n')
-file.write('SAMPLE_INPUT: {}\n'.format(sample_input))
-file.write('SAMPLE_OUTPUT: {}\n'.format(sample_output))
-file.write('VTI_INPUT: {}\n'.format(VTI_input))
-file.write('VTI_OUTPUT: {}\n'.format(VTI_output))
-file.write('VTI_PID: {}\n'.format(LS350.get_pid(VTI_output)))
-file.write('SAMPLE_PID: {}\n'.format(LS350.get_pid(sample_output)))
-file.write('\n')
-file.write('DATA:\n')
-file.write('Time,VTI Setpoint (C),VTI Temperature (C),VTI Sensor (Ohm),Sample Setpoint (C),Sample Temperature (C),Sample Sensor (Ohm),Pressure1 (mbar),Pressure2 (mbar)\n')
-
-
-def measure_temperature(write=False):
-    T_VTI = LS350.get_celsius_reading(VTI_input)
-    S_VTI = LS350.get_sensor_reading(VTI_input)
-
-    setp_VTI = LS350.get_setpoint_celsius(VTI_output)
-
-    T_samp = LS350.get_celsius_reading(sample_input)
-    S_samp = LS350.get_sensor_reading(sample_input)
-
-    setp_samp = LS350.get_setpoint_celsius(sample_output)
-
-    try:
-        p1, p2 = task.read(number_of_samples_per_channel=100)
-        p1 = np.mean(p1) * 1.33322 * 1
-        p2 = np.mean(p2) * 1.33322 * 100
-    except Exception:
-        p1 = p2 = -1
-
-    if write:
-        file.write('{},{},{},{},{},{},{},{},{}\n'.format(time(), setp_VTI, T_VTI, S_VTI, setp_samp, T_samp, S_samp, p1, p2))
-
-    return time(), setp_VTI, T_VTI, S_VTI, setp_samp, T_samp, S_samp, p1, p2
-
-
-def set_temperature_and_settle(T_VTI, T_samp, T_range, settle_time, timeout, record=False):
-    LS350.set_setpoint_celsius(VTI_output, T_VTI)
-    LS350.set_setpoint_celsius(sample_output, T_samp)
-
-    timer = time()
-    settled_timer = time()
-
-    settled = False
+# The files of a run are named after filename:
+#   <name>.log: the log
+#   <name>.bin: samples are logged to a binary file and exported to the text layout (filename) when the run ends
+#   <name>.checkpoint: progress of the protocol. If the run is interrupted, starting it again resumes from here
+#   <name>.traffic.jsonl.gz: every transaction with the LS350, replay the run with: measurement.py --replay <file>
+record_traffic = True
+
+# Size of the in-memory history of the samples for live plots (see make_history and history.py): the last
+# history_raw_capacity samples as they are, and min/mean/max buckets at the history_resolutions, given as (bucket width
+# in seconds, number of buckets kept)
+history_raw_capacity = 36000
+history_resolutions = DEFAULT_RESOLUTIONS
+
+# Only the recorded samples that cannot be rebuilt within these tolerances are written (setpoints hold their value,
+# the other columns are interpolated, see compression.py), plus one sample every compression_heartbeat seconds. Set
+# compression to None to write every sample.
+compression = {'VTI Setpoint (C)': (DEADBAND, 0.001),
+               'VTI Temperature (C)': (SWINGING_DOOR, 0.01),
+               'VTI Sensor (Ohm)': (SWINGING_DOOR, 0.004),
+               'Sample Setpoint (C)': (DEADBAND, 0.001),
+               'Sample Temperature (C)': (SWINGING_DOOR, 0.01),
+               'Sample Sensor (Ohm)': (SWINGING_DOOR, 0.004),
+               'Pressure1 (mbar)': (SWINGING_DOOR, 0.05),
+               'Pressure2 (mbar)': (SWINGING_DOOR, 0.05)}
+compression_heartbeat = 60  # seconds
+
+# Settings that a station of the supervisor (supervisor.py) can override, see configuration()
+SETTINGS = ('filename', 'T_room', 'He_flow', 'T_range', 'ramp_rate', 'settle_time', 'timeout', 'settle_slope_limit',
+            'poll_interval', 'record_interval', 'T_set', 'n_cycles', 'soak_time', 'VTI_T_diff', 'local_conversion',
+            'validate_conversion', 'curve_directory', 'LS350_address', 'VTI_input', 'sample_input', 'VTI_output',
+            'sample_output', 'record_traffic', 'history_raw_capacity', 'history_resolutions', 'compression',
+            'compression_heartbeat')
+
+
+def configuration(**overrides):
+    """
+    Settings of a run: the values set above, with overrides, e.g. for another station:
+        configuration(filename='ASY-1212B_Test1_ThermalCycling_Run1.dat', LS350_address='ASRL10::INSTR')
+    """
+    unknown = set(overrides) - set(SETTINGS)
+    if unknown:
+        raise KeyError('Unknown settings {}'.format(sorted(unknown)))
+    config = {name: globals()[name] for name in SETTINGS}
+    config.update(overrides)
+    return config
+
+
+def run_files(config):
+    base = config['filename'].split('.')[0]
+    return {'log': '{}.log'.format(base),
+            'data': '{}.bin'.format(base),
+            'checkpoint': '{}.checkpoint'.format(base),
+            'traffic': '{}.traffic.jsonl.gz'.format(base)}
 
-    while True:
-        if timeout < time() - timer:
-            logging.warning(
-                'Reached timeout! Possible Causes: timeout may be too small, heater power not set correctly, wrong flow rate.')
-            break
-
-        _, setp_VTI, T_VTI, S_VTI, setp_samp, T_samp, S_samp, p1, p2 = measure_temperature(record)
-
-        ramp_status = LS350.get_ramp_status(2)
-
-        if ramp_status != 0:
-            logging.info('Timer reset because ramp still ongoing.')
-            settled_timer = time()
-        elif abs(setp_samp - T_samp) <= T_range:
-            if settle_time < time() - settled_timer:
-                settled = True
-                break
-        else:
-            # Reset the timer if the temperature is out of range
-            logging.info(
-                'Timer reset because temperature out of range: T_set={}, T_curr={}, T_range={}'.format(setp_samp, T_samp,
-                                                                                                       T_range))
-            settled_timer = time()
-
-    return settled, time() - timer
-
-
-def close():
-    global rm
-
-    LS350.instrument.close()
-    del LS350.instrument
-
-    rm.close()
-    del rm
-
-    task.close()
 
 # ------------------------------------------------
 # Measurement protocol
 # ------------------------------------------------
-
-# Step: Set temperature to room temperature
-# -----------------------------------------
-print("Set temperature to room temperature")
-
-logging.info('Ramp rate set to None for fast ramp')
-LS350.set_setpoint_ramping_off(VTI_output)
-LS350.set_setpoint_ramping_off(sample_output)
-
-logging.info('Set temperature to {} C and wait for settle'.format(T_room))
-file.write("INFO: Settle room temperature BEGIN\n".format(T_room))
-settled, timer = set_temperature_and_settle(T_room, T_room, T_range, settle_time, timeout, record=False)
-if not settled:
-    logging.error('Could not set the temperature to {} C. Check the flow rate and heater power.'.format(T_room))
-    close()
-    file.close()
-    exit(1)
-else:
-    logging.info('Settled at {} C in {} seconds'.format(T_room, timer))
-file.write("INFO: Settle room temperature END\n".format(T_room))
-
-
-T_set = -95
-
-for i in range(2):
-    print("Starting cycle {}".format(i))
-    file.write('INFO: Cycle {} BEGIN\n'.format(i))
-
-    # Step: Ramp to T_set and then settle there
-    # -----------------------------------------
-    print("Ramp to T_set and then settle there")
-    LS350.set_setpoint_ramping_off(VTI_output)
-    logging.info('Sample ramp rate set to {} C/minute'.format(ramp_rate))
-    LS350.set_setpoint_ramp_parameters(sample_output, 1, ramp_rate)
-
-    logging.info('Set temperature to {} C and wait for settle'.format(T_set))
-    file.write('INFO: Ramp BEGIN\n')  # Split the data file
-    settled, timer = set_temperature_and_settle(T_set - VTI_T_diff, T_set, T_range, settle_time, 3600, record=True)
-    if not settled:
-        logging.error('Could not set the temperature to {} C. Check the flow rate and heater power.'.format(T_room))
-        close()
-        file.close()
-        exit(1)
-    else:
-        logging.info('Settled at {} C in {} seconds'.format(T_set, timer))
-    file.write('INFO: Ramp END\n')  # Split the data file
-
-    # Step: Soak for wait_time at T_set
-    # -----------------------------------------
-    print("Soak at T_set for 1 hour")
-    wait_time = 3600
-    file.write('INFO: Soak BEGIN\n')
-
-    t1 = time()
-    while time() - t1 < wait_time:
-        measure_temperature(True)
-    file.write('INFO: Soak END\n')
-
-    # Step: Ramp to room temperature and then settle there
-    # -----------------------------------------
-    print("Ramp to room temperature and then settle there")
-    LS350.set_setpoint_ramping_off(VTI_output)
-    logging.info('Sample ramp rate set to {} C/minute'.format(ramp_rate))
-    LS350.set_setpoint_ramp_parameters(sample_output, 1, ramp_rate)
-
-    logging.info('Set temperature to {} C and wait for settle'.format(T_room))
-    file.write('INFO: Ramp BEGIN\n')  # Split the data file
-    settled, timer = set_temperature_and_settle(T_room, T_room, T_range, settle_time, 3600, record=True)
-    if not settled:
-        logging.error('Could not set the temperature to {} C. Check the flow rate and heater power.'.format(T_room))
-        close()
-        file.close()
-        exit(1)
+def ramp_and_soak(config, T_VTI, T_samp, description):
+    return [
+        # Step: Ramp to T_samp and then settle there
+        {'type': 'log', 'message': 'Ramp to {} and then settle there'.format(description)},
+        {'type': 'ramp', 'output': config['VTI_output'], 'rate': None},
+        {'type': 'ramp', 'output': config['sample_output'], 'rate': config['ramp_rate']},
+        {'type': 'log', 'message': 'Set temperature to {} C and wait for settle'.format(T_samp)},
+        {'type': 'segment', 'text': 'Ramp BEGIN'},  # Split the data file
+        {'type': 'settle', 'VTI': T_VTI, 'sample': T_samp, 'band': config['T_range'],
+         'hold_time': config['settle_time'], 'timeout': 3600, 'record': True},
+        {'type': 'segment', 'text': 'Ramp END'},
+
+        # Step: Soak for soak_time at T_samp
+        {'type': 'log', 'message': 'Soak at {} for {} seconds'.format(description, config['soak_time'])},
+        {'type': 'segment', 'text': 'Soak BEGIN'},
+        {'type': 'soak', 'duration': config['soak_time'], 'record': True},
+        {'type': 'segment', 'text': 'Soak END'},
+    ]
+
+
+def thermal_cycling(config):
+    T_room = config['T_room']
+    T_set = config['T_set']
+
+    # Step: Set temperature to room temperature
+    steps = [
+        {'type': 'log', 'message': 'Set temperature to room temperature'},
+        {'type': 'ramp', 'output': config['VTI_output'], 'rate': None},
+        {'type': 'ramp', 'output': config['sample_output'], 'rate': None},
+        {'type': 'log', 'message': 'Set temperature to {} C and wait for settle'.format(T_room)},
+        {'type': 'segment', 'text': 'Settle room temperature BEGIN'},
+        {'type': 'settle', 'VTI': T_room, 'sample': T_room, 'band': config['T_range'],
+         'hold_time': config['settle_time'], 'timeout': config['timeout'], 'record': False},
+        {'type': 'segment', 'text': 'Settle room temperature END'},
+    ]
+
+    for i in range(config['n_cycles']):
+        steps.append({'type': 'log', 'message': 'Starting cycle {}'.format(i)})
+        steps.append({'type': 'segment', 'text': 'Cycle {} BEGIN'.format(i)})
+        steps += ramp_and_soak(config, T_set - config['VTI_T_diff'], T_set, 'T_set')
+        steps += ramp_and_soak(config, T_room, T_room, 'room temperature')
+        steps.append({'type': 'segment', 'text': 'Cycle {} END'.format(i)})
+
+    return steps
+
+
+def open_LS350(rm, config):
+    import visa
+
+    res = rm.open_resource(config['LS350_address'])
+    res.data_bits = 7
+    res.parity = visa.constants.Parity.odd
+    res.baud_rate = 56000
+    res.read_termination = '\r\n'
+    # Lost or garbled replies are retried after resynchronising the line, instead of ending the run
+    res = ResilientResource(res)
+    if config['record_traffic']:
+        res = RecordingResource(res, run_files(config)['traffic'])
+    return LS350_Driver(res)
+
+
+def make_history(config):
+    """History sized by the settings of the run, to pass to run_station, e.g. from a thread plotting the run."""
+    return History(COLUMNS, raw_capacity=config['history_raw_capacity'], resolutions=config['history_resolutions'])
+
+
+def run_station(config, replay=None, telemetry=None, history=None):
+    """
+    Run the protocol on one station.
+
+    :param config: settings of the run, see configuration()
+    :param replay: traffic log of an earlier run to replay instead of talking to the instruments
+    :param telemetry: supervisor.TelemetrySlot to publish the samples and the LS350 metrics to
+    :param history: history.History to add every sample to (see make_history), None to keep no history
+    :return: exit code, 0 once the protocol is complete
+    """
+    steps = load_steps(thermal_cycling(config))
+
+    files = run_files(config)
+    filename = config['filename']
+    data_path, csv_path, log_path, checkpoint_path = files['data'], filename, files['log'], files['checkpoint']
+    if replay is not None:
+        # The replay writes its own data and log files, leaving those of the recorded run as they were, and cannot be
+        # resumed
+        data_path, csv_path, log_path, checkpoint_path = ('replay_' + files['data'], 'replay_' + filename,
+                                                          'replay_' + files['log'], None)
+
+    # A handler of its own rather than basicConfig, which only takes effect once per process: a replay started after the
+    # run it replays would otherwise log into the run's file
+    log_handler = logging.FileHandler(log_path)
+    log_handler.setFormatter(logging.Formatter('%(asctime)s.%(msecs)03d:%(levelname)s: %(message)s',
+                                               datefmt='%d/%m/%Y %H:%M:%S'))
+    logging.getLogger().addHandler(log_handler)
+    logging.getLogger().setLevel(logging.INFO)
+
+    if replay is None:
+        # Imported here so that dry runs and replays work without the VISA library
+        import visa
+
+        rm = visa.ResourceManager()
+        print(rm.list_resources())
+
+        LS350 = open_LS350(rm, config)
+        clock, delay = time, sleep
+
+        # Both pressure gauges are sampled continuously and averaged over blocks of 100 samples
+        pressure_source = ContinuousPressureSource(NIDAQReader(('Dev1/ai29', 'Dev1/ai21'), rate=1000),
+                                                   block_size=100)
     else:
-        logging.info('Settled at {} C in {} seconds'.format(T_room, timer))
-    file.write('INFO: Ramp END\n')  # Split the data file
+        # Answer from the recorded traffic on a virtual clock, without pacing, so the run replays in seconds. The
+        # pressures were not recorded.
+        rm = None
+        res = ReplayResource(replay)
+        LS350 = LS350_Driver(res)
+        LS350.pacer = NullPacer()
+        # Cached results expire on the virtual clock, so the queries the run sent again are sent again in the replay
+        LS350.cache = QueryCache(clock=res.clock)
+        clock, delay = res.clock, res.sleep
+        pressure_source = StaticPressureSource((0.0, 0.0))
+
+    if telemetry is not None:
+        telemetry.attach_metrics(LS350.enable_metrics(config['LS350_address']))
+
+    print(LS350.identification())
+
+    VTI_output, sample_output = config['VTI_output'], config['sample_output']
+    metadata = []
+    if config['compression'] is not None:
+        # What compression.resample needs to rebuild the samples
+        metadata.append(('COMPRESSION', json.dumps({'tolerances': config['compression'],
+                                                    'heartbeat': config['compression_heartbeat']})))
+    # A resumed run continues the data log of the interrupted one
+    data_log = BinaryLogWriter(data_path, columns=COLUMNS,
+                               metadata=[('FILENAME', filename),
+                                         ('DATETIME', strftime("%c")),
+                                         ('SETUP', 'Ramp Rate={} C/minute'.format(config['ramp_rate'])),
+                                         ('SETUP', 'Temperature settle range=+/-{} C'.format(config['T_range'])),
+                                         ('SETUP', 'He flow {} mba'.format(config['He_flow'])),
+                                         ('SETTINGS', ''),
+                                         ('SAMPLE_INPUT', config['sample_input']),
+                                         ('SAMPLE_OUTPUT', sample_output),
+                                         ('VTI_INPUT', config['VTI_input']),
+                                         ('VTI_OUTPUT', VTI_output),
+                                         ('VTI_PID', str(LS350.get_pid(VTI_output))),
+                                         ('SAMPLE_PID', str(LS350.get_pid(sample_output)))] + metadata,
+                               append=checkpoint_path is not None and os.path.exists(checkpoint_path))
+
+    converter = None
+    if config['local_conversion']:
+        converter = CurveConverter(LS350, store=CurveStore(config['curve_directory']),
+                                   validate=config['validate_conversion'])
+
+    if config['compression'] is not None:
+        data_log = CompressedLog(data_log, RecordCompressor(COLUMNS, config['compression'],
+                                                            heartbeat=config['compression_heartbeat']))
+
+    station = Station(LS350, pressure_source, data_log, VTI_input=config['VTI_input'], VTI_output=VTI_output,
+                      sample_input=config['sample_input'], sample_output=sample_output,
+                      settle_slope_limit=config['settle_slope_limit'], poll_interval=config['poll_interval'],
+                      record_interval=config['record_interval'], converter=converter, clock=clock, sleep=delay,
+                      history=history, telemetry=telemetry)
 
-    # Step: Soak for wait_time at room temperature
-    # -----------------------------------------
-    print("Soak at room temperature for 1 hour")
-    wait_time = 3600
-    file.write('INFO: Soak BEGIN\n')
-
-    t1 = time()
-    while time() - t1 < wait_time:
-        measure_temperature(True)
-    file.write('INFO: Soak END\n')
-
-    file.write('INFO: Cycle {} END\n'.format(i))
-
-close()
\ No newline at end of file
+    try:
+        ProtocolRunner(station, steps, checkpoint_path).run()
+        return 0
+    except ProtocolError as e:
+        # The checkpoint is kept, starting the script again retries the step that failed
+        logging.error(str(e))
+        return 1
+    finally:
+        station.close()
+        LS350.instrument.close()
+        if rm is not None:
+            rm.close()
+        else:
+            print(LS350.instrument.report())
+
+        data_log.close()
+        if config['compression'] is not None:
+            logging.info('Wrote {} of {} recorded samples'.format(data_log.compressor.stored,
+                                                                 data_log.compressor.received))
+        export_csv(data_path, csv_path)
+        logging.getLogger().removeHandler(log_handler)
+        log_handler.close()
+
+
+def main(dry_run=False, replay=None):
+    """
+    :param dry_run: only estimate how long the protocol takes
+    :param replay: traffic log of an earlier run to replay instead of talking to the instruments
+    """
+    config = configuration()
+    if dry_run:
+        steps = load_steps(thermal_cycling(config))
+        print('Estimated runtime: {:.2f} hours'.format(estimate_runtime(steps, initial_temperature=T_room) / 3600))
+        return 0
+    return run_station(config, replay=replay)
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    sys.exit(main(dry_run='--dry-run' in arguments,
+                  replay=arguments[arguments.index('--replay') + 1] if '--replay' in arguments else None))
@@ -0,0 +1,256 @@
+"""
+Share one instrument resource between several drivers and threads.
+
+ResourceMultiplexer owns the resource and a worker thread that runs one transaction at a time from a priority queue,
+so a query's write and read are never interleaved with another thread's command. Every driver talks to the resource
+through its own Channel, which has the pyvisa query()/write() surface:
+    mux = ResourceMultiplexer(res)
+    logger = mux.driver(LS350_Driver, lane=TELEMETRY)   # bulk polling
+    safety = mux.driver(LS350_Driver, lane=CONTROL)     # interlocks
+    gui = mux.driver(LS350_Driver)                      # NORMAL lane, writes on the CONTROL lane
+
+Requests are served by lane (CONTROL before NORMAL before TELEMETRY) and in order within a lane. Writes go on the
+CONTROL lane by default, so set_setpoint() or set_heater_range() overtake a backlog of telemetry queries.
+
+The drivers' pacers are replaced by a ChannelPacer: the worker enforces the turnaround of one shared AdaptivePacer
+between consecutive transactions, whichever driver sent them, and the drivers' success/failure reports tune it.
+
+The drivers of the same class also share one query cache and one Feature shadow, so a write from one of them (e.g.
+set_pid from the safety monitor) evicts what the others cached or shadowed, and none of them serves or coalesces against
+a stale value. Drivers of different classes keep separate ones: the same method name (e.g. identification) can send
+a different command to a different model.
+"""
+import collections
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+
+from cache import QueryCache
+from instrumentation import Histogram
+from pacing import AdaptivePacer, QUERY, WRITE
+
+CONTROL = 0
+NORMAL = 1
+TELEMETRY = 2
+LANES = {CONTROL: 'control', NORMAL: 'normal', TELEMETRY: 'telemetry'}
+
+_STOP = len(LANES)  # Sorts after every lane, so pending requests are served before the worker stops
+
+
+class MultiplexerClosed(Exception):
+    pass
+
+
+class Request(object):
+    def __init__(self, operation, args, command_class, lane):
+        self.operation = operation
+        self.args = args
+        self.command_class = command_class
+        self.lane = lane
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.perf_counter()
+
+
+class LaneStatistics(object):
+    def __init__(self):
+        self.count = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.wait = Histogram()  # Time from submission until the transaction starts
+        self.service = Histogram()  # Time the transaction itself takes, including the turnaround
+
+    def snapshot(self):
+        return {'count': self.count,
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'wait': self.wait.snapshot(),
+                'service': self.service.snapshot()}
+
+
+class ResourceMultiplexer(object):
+    def __init__(self, resource, pacer=None, name=None):
+        """
+        :param resource: pyvisa resource (or emulator) shared by the channels
+        :param pacer: pacer enforcing the turnaround between transactions, an AdaptivePacer by default
+        """
+        self.resource = resource
+        self.pacer = AdaptivePacer() if pacer is None else pacer
+        self.pacer_lock = threading.Lock()  # The worker and the drivers' ChannelPacers both update the pacer
+        self.name = name if name is not None else getattr(resource, 'resource_name', 'resource')
+        self.caches = {}  # Driver class -> QueryCache shared by the drivers of that class
+        self.shadows = {}  # Driver class -> Feature shadow shared by the drivers of that class
+
+        self.requests = queue.PriorityQueue()
+        self.sequence = itertools.count()  # Keeps the requests of a lane in order
+        self.statistics = collections.OrderedDict((lane, LaneStatistics()) for lane in sorted(LANES))
+        self.statistics_lock = threading.Lock()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name='multiplexer {}'.format(self.name), daemon=True)
+        self.thread.start()
+
+    def channel(self, lane=NORMAL, write_lane=CONTROL):
+        return Channel(self, lane, write_lane)
+
+    def driver(self, driver_class, lane=NORMAL, write_lane=CONTROL):
+        """Build a driver_class instance that talks to the resource through a new channel."""
+        channel = self.channel(lane, write_lane)
+        driver = driver_class(channel)
+        channel.command_class = driver.command_class
+        driver.pacer = ChannelPacer(self)
+        driver.cache = self.caches.setdefault(driver_class, QueryCache())
+        driver.shadow = self.shadows.setdefault(driver_class, {})
+        return driver
+
+    def submit(self, lane, operation, args=(), command_class=QUERY):
+        """Queue a transaction and return a concurrent.futures.Future of its result."""
+        if self.closed:
+            raise MultiplexerClosed('The multiplexer of {} is closed'.format(self.name))
+        request = Request(operation, args, command_class, lane)
+        with self.statistics_lock:
+            statistics = self.statistics[lane]
+            statistics.depth += 1
+            statistics.max_depth = max(statistics.max_depth, statistics.depth)
+        self.requests.put((lane, next(self.sequence), request))
+        return request.future
+
+    def call(self, lane, operation, args=(), command_class=QUERY):
+        return self.submit(lane, operation, args, command_class).result()
+
+    def run(self):
+        while True:
+            lane, _, request = self.requests.get()
+            if request is None:
+                return
+            started = time.perf_counter()
+            if not request.future.set_running_or_notify_cancel():
+                self.record(request, started, started)
+                continue
+
+            with self.pacer_lock:
+                remaining = self.pacer.remaining(request.command_class)
+            if remaining > 0:
+                time.sleep(remaining)
+            with self.pacer_lock:
+                self.pacer.start(request.command_class)
+            try:
+                result = getattr(self.resource, request.operation)(*request.args)
+            except Exception as e:
+                request.future.set_exception(e)
+            else:
+                request.future.set_result(result)
+            finally:
+                with self.pacer_lock:
+                    self.pacer.completed()
+                self.record(request, started, time.perf_counter())
+
+    def record(self, request, started, finished):
+        with self.statistics_lock:
+            statistics = self.statistics[request.lane]
+            statistics.depth -= 1
+            statistics.count += 1
+            statistics.wait.observe(started - request.enqueued)
+            statistics.service.observe(finished - started)
+
+    @property
+    def depth(self):
+        """Number of requests waiting or in progress."""
+        with self.statistics_lock:
+            return sum(statistics.depth for statistics in self.statistics.values())
+
+    def stats(self):
+        with self.statistics_lock:
+            return {'resource': self.name,
+                    'depth': sum(statistics.depth for statistics in self.statistics.values()),
+                    'lanes': {LANES[lane]: statistics.snapshot() for lane, statistics in self.statistics.items()}}
+
+    def close(self):
+        """Serve the requests already queued, then stop the worker and close the resource."""
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put((_STOP, next(self.sequence), None))
+        self.thread.join()
+        self.resource.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Channel(object):
+    """A driver's view of a multiplexed resource, with the query()/write() surface of a pyvisa resource."""
+    def __init__(self, multiplexer, lane=NORMAL, write_lane=CONTROL):
+        self.multiplexer = multiplexer
+        self.lane = lane
+        self.write_lane = write_lane
+        self.command_class = lambda message: WRITE  # Replaced by the driver's classification in mux.driver()
+
+    @property
+    def resource_name(self):
+        return self.multiplexer.name
+
+    def query(self, message):
+        return self.multiplexer.call(self.lane, 'query', (message,), QUERY)
+
+    def write(self, message):
+        return self.multiplexer.call(self.write_lane, 'write', (message,), self.command_class(message))
+
+    def read(self):
+        raise NotImplementedError('A reply can only be read together with its request, use query()')
+
+    def clear(self):
+        return self.multiplexer.call(CONTROL, 'clear', (), WRITE)
+
+    def recover(self, attempt):
+        """
+        Resynchronise the shared resource after a reply that could not be processed (see transport.ResilientResource).
+
+        Runs on the worker like any other transaction, so it cannot interleave with another channel's query.
+        """
+        if getattr(self.multiplexer.resource, 'recover', None) is None:
+            return False
+        return self.multiplexer.call(CONTROL, 'recover', (attempt,), WRITE)
+
+    def close(self):
+        """Channels share the resource, it is closed by ResourceMultiplexer.close()."""
+        pass
+
+    def __getattr__(self, name):
+        # Settings such as timeout or read_termination are those of the shared resource
+        return getattr(self.multiplexer.resource, name)
+
+
+class ChannelPacer(object):
+    """
+    Pacer of a driver on a Channel. The worker does the waiting, the driver's reports tune the shared pacer.
+
+    Other drivers may have run transactions between the one reported and the report, so a failure backs off the
+    classes of the last transactions on the resource rather than exactly the reported one.
+    """
+    def __init__(self, multiplexer):
+        self.multiplexer = multiplexer
+
+    def remaining(self, command_class):
+        return 0.0
+
+    def wait(self, command_class):
+        return 0.0
+
+    def start(self, command_class):
+        pass
+
+    def completed(self):
+        pass
+
+    def success(self, command_class):
+        with self.multiplexer.pacer_lock:
+            self.multiplexer.pacer.success(command_class)
+
+    def failure(self, command_class):
+        with self.multiplexer.pacer_lock:
+            self.multiplexer.pacer.failure(command_class)
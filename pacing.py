@@ -0,0 +1,148 @@
+"""
+Adaptive inter-command pacing.
+
+Instead of sleeping a fixed time after every transaction, the pacer remembers when the last transaction finished and
+only sleeps for whatever is left of the current minimum turnaround when the next one starts.
+
+The turnaround is learned per command class:
+    QUERY   commands that return a reply (the reply itself proves the instrument is ready again)
+    WRITE   commands without a reply
+    EEPROM  writes that store settings in non-volatile memory (e.g. PID, RAMP) and need more time
+
+Every clean transaction shrinks the turnaround of its class by a constant factor, every garbled or empty reply grows
+it by a larger factor. The turnaround never shrinks below the driver's minimum_turnaround, nor below a floor one step
+above the turnaround a failure was last seen at: every probe below it would spoil a read, so once the pacer has found
+the failure point it stays just above it. The floor is at most the initial turnaround, which worked as a fixed sleep,
+and since a failure can also be a one-off (noise on the line) the floor shrinks by one step after every relax_after
+clean transactions in a row, so the pacer probes down again towards the minimum.
+"""
+import time
+
+QUERY = 'query'
+WRITE = 'write'
+EEPROM = 'eeprom'
+
+
+class PacingPolicy(object):
+    def __init__(self, initial, minimum=0.0, maximum=1.0, decrease=0.9, increase=2.0, step=0.01, relax_after=100):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease  # Factor applied after a clean transaction
+        self.increase = increase  # Factor applied after a garbled or empty reply
+        self.step = step  # Added on back off so that a delay of 0 can still grow
+        self.relax_after = relax_after  # Clean transactions in a row after which the floor shrinks
+
+    def shrink(self, delay, floor=0.0):
+        """
+        :param floor: learned lower bound, the delay after the last back off
+        """
+        return max(self.minimum, floor, delay * self.decrease)
+
+    def grow(self, delay):
+        return min(self.maximum, delay * self.increase + self.step)
+
+    def floor(self, failed):
+        """Floor after a failure at delay failed: one step above it, at most the initial delay."""
+        return min(max(self.initial, self.minimum), failed / self.decrease)
+
+    def relax(self, floor):
+        """Shrink the floor after a run of clean transactions, 0 once it is down to the minimum."""
+        floor *= self.decrease
+        return floor if floor > self.minimum else 0.0
+
+
+class AdaptivePacer(object):
+    def __init__(self, wait_time=0.06, minimum=0.0, policies=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param wait_time: initial turnaround, and the turnaround of EEPROM writes
+        :param minimum: shortest turnaround to probe for queries and writes (see Driver.minimum_turnaround)
+        """
+        if policies is None:
+            minimum = min(wait_time, minimum)
+            policies = {QUERY: PacingPolicy(wait_time, minimum=minimum),
+                        WRITE: PacingPolicy(wait_time, minimum=minimum),
+                        EEPROM: PacingPolicy(wait_time, minimum=wait_time)}
+        self.policies = policies
+        self.delays = {name: policy.initial for name, policy in policies.items()}
+        self.floors = {name: 0.0 for name in policies}  # Delay after the last back off of each class
+        self.clean = {name: 0 for name in policies}  # Clean transactions of each class since the floor last moved
+        self.clock = clock
+        self.sleep = sleep
+
+        self.last_end = None  # End time of the previous transaction
+        self.last_class = None  # Command class of the previous transaction
+        self.previous_class = None  # Command class of the transaction before that
+        self.current_class = None
+
+    def remaining(self, command_class):
+        """Time left to wait before a transaction of command_class may start."""
+        if self.last_end is None:
+            return 0.0
+        # The instrument must be done with the previous command, and be ready to take this one
+        delay = max(self.delays[self.last_class], self.delays[command_class])
+        return max(0.0, delay - (self.clock() - self.last_end))
+
+    def wait(self, command_class):
+        remaining = self.remaining(command_class)
+        if remaining > 0:
+            self.sleep(remaining)
+        self.start(command_class)
+        return remaining
+
+    def start(self, command_class):
+        """Mark the start of a transaction, for callers that do their own waiting (e.g. asyncio)."""
+        self.current_class = command_class
+
+    def completed(self):
+        self.last_end = self.clock()
+        self.previous_class = self.last_class
+        self.last_class = self.current_class
+
+    def success(self, command_class):
+        policy = self.policies[command_class]
+        if self.floors[command_class]:
+            self.clean[command_class] += 1
+            if self.clean[command_class] >= policy.relax_after:
+                self.floors[command_class] = policy.relax(self.floors[command_class])
+                self.clean[command_class] = 0
+        self.delays[command_class] = policy.shrink(self.delays[command_class], self.floors[command_class])
+
+    def failure(self, command_class):
+        """Back off after a garbled or empty reply.
+
+        The reply is usually spoiled because the instrument was still busy with the previous command, so that command
+        class is penalised as well.
+        """
+        self.back_off(command_class)
+        previous = self.previous_class
+        if previous is not None and previous != command_class:
+            self.back_off(previous)
+
+    def back_off(self, command_class):
+        policy = self.policies[command_class]
+        failed = self.delays[command_class]
+        self.delays[command_class] = policy.grow(failed)
+        self.floors[command_class] = policy.floor(failed)
+        self.clean[command_class] = 0
+
+
+class NullPacer(object):
+    """Pacer that never waits, for simulated or replayed instruments."""
+    def remaining(self, command_class):
+        return 0.0
+
+    def wait(self, command_class):
+        return 0.0
+
+    def start(self, command_class):
+        pass
+
+    def completed(self):
+        pass
+
+    def success(self, command_class):
+        pass
+
+    def failure(self, command_class):
+        pass
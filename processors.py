@@ -1,3 +1,9 @@
+import collections
+import re
+
+import numpy as np
+
+
 class ProcessorError(Exception):
     pass
 
@@ -32,25 +38,70 @@ class ProcessReal(Processor):
 
 
 class ProcessCSV(Processor):
-    def __init__(self, names, processors=None, strip=True):
+    OUTPUTS = ('dict', 'record', 'array')
+
+    def __init__(self, names, processors=None, strip=True, output='dict'):
+        """
+        :param names: name of each field
+        :param processors: one entry per field: None, a processor or a sequence of processors
+        :param output: 'dict' maps names to values, 'record' returns a namedtuple with one field per name (spaces and
+                       other characters that are not allowed become underscores), 'array' returns a NumPy float array
+        """
         super().__init__()
+        if output not in self.OUTPUTS:
+            raise ValueError("output must be one of {}, got {}".format(self.OUTPUTS, output))
         self.strip = strip
         self.param_names = names
         self.processors = processors
+        self.output = output
+
+        # Flatten the processors into one tuple per field once, instead of on every call
+        if processors is None:
+            self.field_processors = ((),) * len(names)
+        else:
+            self.field_processors = tuple(self.as_tuple(field) for field in processors)
+        self.has_processors = any(self.field_processors)
+
+        if output == 'record':
+            self.record = collections.namedtuple('Record', [re.sub(r'\W', '_', name) for name in names], rename=True)
+        # Numeric fields are parsed from the reply in one call, without splitting it into strings first
+        self.vectorized = output == 'array' and all(isinstance(processor, ProcessReal)
+                                                    for field in self.field_processors for processor in field)
+
+    @staticmethod
+    def as_tuple(processors):
+        if processors is None:
+            return ()
+        if isinstance(processors, (list, tuple)):
+            return tuple(processors)
+        return (processors,)
 
     def __call__(self, value):
+        if self.vectorized:
+            try:
+                result = np.fromstring(value, sep=',')
+            except (TypeError, ValueError) as e:
+                raise ProcessorError("Could not convert {} into an array of Reals".format(value)) from e
+            if len(result) != len(self.param_names):
+                raise ProcessorError("Expected {} values but got {}".format(len(self.param_names), value))
+            return result
+
         values = value.split(',')
-        result = {}
-        for i, (name, val) in enumerate(zip(self.param_names, values)):
-            if self.strip:
-                val = val.strip()
-            if self.processors is not None:
-                try:
-                    for processor in self.processors[i]:
-                        val = processor(val)
-                except TypeError:
-                    # Catch if processors[i] is not iterable (i.e. there is a single processor)
-                    if self.processors[i] is not None:
-                        val = self.processors[i](val)
-            result[name] = val
-        return result
\ No newline at end of file
+        if self.strip:
+            values = [val.strip() for val in values]
+        if self.has_processors:
+            for i, (field, val) in enumerate(zip(self.field_processors, values)):
+                for processor in field:
+                    val = processor(val)
+                values[i] = val
+
+        if self.output == 'dict':
+            return dict(zip(self.param_names, values))
+        if len(values) != len(self.param_names):
+            raise ProcessorError("Expected {} values but got {}".format(len(self.param_names), value))
+        if self.output == 'record':
+            return self.record._make(values)
+        try:
+            return np.array(values, dtype=float)
+        except ValueError as e:
+            raise ProcessorError("Could not convert {} into an array of Reals".format(value)) from e
@@ -0,0 +1,226 @@
+"""
+Declarative measurement protocols with checkpoint/resume.
+
+A protocol is a list of steps given as data, e.g.
+    [{'type': 'ramp', 'output': 2, 'rate': 10},
+     {'type': 'settle', 'VTI': -95, 'sample': -95, 'band': 0.2, 'hold_time': 30, 'timeout': 3600, 'record': True},
+     {'type': 'soak', 'duration': 3600}]
+and is run against a station.Station by ProtocolRunner. The runner writes a checkpoint before every step (and
+regularly during soaks), so when a run is restarted it continues with the step that was interrupted instead of starting
+over. Settle steps are repeated from the start, soaks only for the time that was left. The data log is flushed before
+every checkpoint, so the log always holds everything the checkpoint says was done, and a segment marker is written at
+most once.
+
+A dry run executes the protocol against DryRunStation, which simulates the setpoints and ramp rates to estimate how
+long the protocol takes without touching any instrument.
+"""
+import hashlib
+import json
+import logging
+import os
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Step(object):
+    type = None
+
+    def to_dict(self):
+        return dict(vars(self), type=self.type)
+
+    def run(self, station, state, checkpoint):
+        """
+        :param state: dict with the progress saved for this step when the run was interrupted, empty otherwise
+        :param checkpoint: callable saving a new progress dict for this step
+        """
+        raise NotImplementedError
+
+
+class Log(Step):
+    type = 'log'
+
+    def __init__(self, message):
+        self.message = message
+
+    def run(self, station, state, checkpoint):
+        print(self.message)
+        logging.info(self.message)
+
+
+class Segment(Step):
+    type = 'segment'
+
+    def __init__(self, text):
+        self.text = text
+
+    def run(self, station, state, checkpoint):
+        if state.get('written'):
+            return
+        station.segment(self.text)
+        checkpoint({'written': True})
+
+
+class SetRamp(Step):
+    type = 'ramp'
+
+    def __init__(self, output, rate=None):
+        """:param rate: ramp rate in C/minute, None to switch ramping off"""
+        self.output = output
+        self.rate = rate
+
+    def run(self, station, state, checkpoint):
+        station.set_ramp(self.output, self.rate)
+
+
+class Settle(Step):
+    type = 'settle'
+
+    def __init__(self, VTI, sample, band, hold_time, timeout, record=False):
+        self.VTI = VTI
+        self.sample = sample
+        self.band = band
+        self.hold_time = hold_time
+        self.timeout = timeout
+        self.record = record
+
+    def run(self, station, state, checkpoint):
+        settled, timer = station.set_temperature_and_settle(self.VTI, self.sample, self.band, self.hold_time,
+                                                            self.timeout, record=self.record)
+        if not settled:
+            raise ProtocolError('Could not set the temperature to {} C. Check the flow rate and heater power.'.format(
+                self.sample))
+        logging.info('Settled at {} C in {} seconds'.format(self.sample, timer))
+
+
+class Soak(Step):
+    type = 'soak'
+
+    def __init__(self, duration, record=True):
+        self.duration = duration
+        self.record = record
+
+    def run(self, station, state, checkpoint):
+        elapsed = state.get('elapsed', 0)
+        if elapsed:
+            logging.info('Resuming soak with {} of {} seconds left'.format(self.duration - elapsed, self.duration))
+        station.soak(self.duration - elapsed, record=self.record,
+                     progress=lambda progress: checkpoint({'elapsed': elapsed + progress}))
+
+
+STEP_TYPES = {step.type: step for step in (Log, Segment, SetRamp, Settle, Soak)}
+
+
+def load_steps(data):
+    """Build the steps of a protocol from a list of dicts with a 'type' key."""
+    steps = []
+    for item in data:
+        parameters = dict(item)
+        step_type = parameters.pop('type', None)
+        if step_type not in STEP_TYPES:
+            raise ProtocolError('Unknown step type {}, must be one of {}'.format(step_type, sorted(STEP_TYPES)))
+        steps.append(STEP_TYPES[step_type](**parameters))
+    return steps
+
+
+def fingerprint(steps):
+    """Identify a protocol, so that a checkpoint is only resumed by the protocol that wrote it."""
+    return hashlib.sha1(json.dumps([step.to_dict() for step in steps], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ProtocolRunner(object):
+    def __init__(self, station, steps, checkpoint_path=None):
+        self.station = station
+        self.steps = steps
+        self.checkpoint_path = checkpoint_path
+        self.fingerprint = fingerprint(steps)
+
+    def load_checkpoint(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return 0, {}
+        with open(self.checkpoint_path) as file:
+            checkpoint = json.load(file)
+        if checkpoint['protocol'] != self.fingerprint:
+            raise ProtocolError('The checkpoint {} was written by a different protocol, remove it to start over'.format(
+                self.checkpoint_path))
+        return checkpoint['step'], checkpoint['state']
+
+    def save_checkpoint(self, index, state):
+        if self.checkpoint_path is None:
+            return
+        self.station.flush()
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'protocol': self.fingerprint, 'step': index, 'state': state}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def run(self):
+        """Run the protocol from the checkpoint, or from the start if there is none."""
+        start, state = self.load_checkpoint()
+        if start:
+            logging.info('Resuming protocol at step {} of {}'.format(start + 1, len(self.steps)))
+
+        for index in range(start, len(self.steps)):
+            if index != start:
+                state = {}
+            self.save_checkpoint(index, state)
+            self.steps[index].run(self.station, state, lambda state: self.save_checkpoint(index, state))
+
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+class DryRunStation(object):
+    """Stand-in for a Station that only keeps track of the time the protocol would take."""
+    def __init__(self, initial_temperature=25.0, fast_rate=20.0):
+        """
+        :param initial_temperature: sample temperature (C) at the start of the protocol
+        :param fast_rate: rate (C/minute) the temperature is assumed to change at when ramping is off
+        """
+        self.temperature = initial_temperature
+        self.fast_rate = fast_rate
+        self.rates = {}
+        self.elapsed = 0.0
+
+    def set_ramp(self, output, rate):
+        self.rates[output] = rate
+
+    def set_temperature_and_settle(self, T_VTI, T_samp, T_range, settle_time, timeout, record=False):
+        # The slowest output decides when everything has settled
+        rate = min(rate or self.fast_rate for rate in self.rates.values()) if self.rates else self.fast_rate
+        duration = abs(T_samp - self.temperature) / rate * 60 + settle_time
+        self.temperature = T_samp
+        if duration > timeout:
+            self.elapsed += timeout
+            return False, timeout
+        self.elapsed += duration
+        return True, duration
+
+    def soak(self, duration, record=True, progress=None):
+        self.elapsed += duration
+
+    def segment(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def estimate_runtime(steps, initial_temperature=25.0, fast_rate=20.0):
+    """
+    Estimate the runtime (s) of a protocol from its setpoints and ramp rates.
+
+    Steps that would not settle within their timeout are counted with the full timeout.
+    """
+    station = DryRunStation(initial_temperature, fast_rate)
+    for step in steps:
+        if isinstance(step, Log):
+            continue
+        try:
+            step.run(station, {}, lambda state: None)
+        except ProtocolError:
+            pass
+    return station.elapsed
@@ -0,0 +1,227 @@
+"""
+Record the traffic of a driver and replay it without the instrument.
+
+RecordingResource wraps a pyvisa resource and appends every transaction to a log, one JSON array per line:
+    [start time, duration, kind, message, reply]
+where kind is 'q' (query), 'w' (write), 'r' (read), 'c' (clear) or 'v' (recover, see Driver.recover: the message is
+the attempt and the reply whether the query may be sent again), and reply is the raw reply of a query/read, or
+{"error": [exception type, message]} when the transaction failed. An 'x' record marks when the resource was closed.
+Logs ending in .gz are compressed. The log is flushed every flush_interval seconds, so a crashed run, the one most worth
+replaying, loses at most that much of its end; the replay reads a log that was cut short up to its last complete line.
+
+ReplayResource answers from such a log. It keeps a virtual clock that follows the recorded transaction times and
+advances on sleep() without waiting, so together with a NullPacer a whole measurement session replays as fast as the
+processing allows. Once every transaction has been replayed the clock moves on to the time the recorded run closed the
+resource, so a run that ended on a timeout (e.g. a settle that never settled) ends the same way in the replay:
+    replay = ReplayResource('run1.traffic.jsonl.gz')
+    LS350 = LS350_Driver(replay)
+    LS350.pacer = NullPacer()
+    station = Station(LS350, ..., clock=replay.clock, sleep=replay.sleep)
+
+When the code sends a different message than the one recorded, the replay looks ahead for the message (the code may
+have dropped or reordered a command) and reports the records it skipped as a divergence; a message that is not in the
+look-ahead window raises ReplayDivergence. replay.report() summarises what was replayed.
+"""
+import builtins
+import gzip
+import json
+import time
+
+QUERY = 'q'
+WRITE = 'w'
+READ = 'r'
+CLEAR = 'c'
+RECOVER = 'v'
+CLOSE = 'x'
+
+
+def open_log(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class ReplayDivergence(Exception):
+    pass
+
+
+class ReplayedError(Exception):
+    """Stands in for an error of a type that cannot be rebuilt, e.g. pyvisa.errors.VisaIOError."""
+    def __init__(self, error_type, message):
+        super().__init__('{}: {}'.format(error_type, message))
+        self.error_type = error_type
+
+
+def read_records(path):
+    """Read the records of a log, up to the last complete line of a log that was cut short."""
+    records = []
+    try:
+        with open_log(path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    records.append(json.loads(line))
+    except EOFError:
+        # A compressed log that was not closed, what was flushed is complete
+        pass
+    except ValueError:
+        # The last line was only partly written
+        pass
+    return records
+
+
+class RecordingResource(object):
+    def __init__(self, resource, path, clock=time.time, flush_interval=5.0):
+        """
+        :param resource: pyvisa resource (or emulator) to record
+        :param path: log to append the transactions to
+        :param flush_interval: longest time in seconds a record waits in memory before it is written to the log
+        """
+        self.resource = resource
+        self.path = path
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.log = open_log(path, 'a')
+        self.last_flush = clock()
+
+    def record(self, kind, message, start, reply):
+        now = self.clock()
+        entry = [start, round(now - start, 6), kind, message, reply]
+        self.log.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        if now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def transaction(self, kind, operation, message, *args):
+        start = self.clock()
+        try:
+            reply = operation(*args)
+        except Exception as e:
+            self.record(kind, message, start, {'error': [type(e).__name__, str(e)]})
+            raise
+        self.record(kind, message, start, reply if kind in (QUERY, READ) else None)
+        return reply
+
+    def query(self, message):
+        return self.transaction(QUERY, self.resource.query, message, message)
+
+    def write(self, message):
+        return self.transaction(WRITE, self.resource.write, message, message)
+
+    def read(self):
+        return self.transaction(READ, self.resource.read, None)
+
+    def clear(self):
+        return self.transaction(CLEAR, self.resource.clear, None)
+
+    def recover(self, attempt):
+        """Let the wrapped resource recover (see transport.ResilientResource), recording whether it did."""
+        start = self.clock()
+        recover = getattr(self.resource, 'recover', None)
+        recovered = recover is not None and bool(recover(attempt))
+        self.record(RECOVER, attempt, start, recovered)
+        return recovered
+
+    def flush(self):
+        self.log.flush()
+        self.last_flush = self.clock()
+
+    def close(self):
+        self.record(CLOSE, None, self.clock(), None)
+        self.log.close()
+        self.resource.close()
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+
+class ReplayResource(object):
+    def __init__(self, path, look_ahead=500):
+        """:param look_ahead: number of records searched for a message that is not the next one recorded"""
+        records = read_records(path)
+        # A log continued by a resumed run has a close record for every session, the replay ends with the last one
+        self.closed = records[-1][0] if records and records[-1][2] == CLOSE else None
+        self.records = [record for record in records if record[2] != CLOSE]
+        self.path = path
+        self.look_ahead = look_ahead
+        self.position = 0
+        self.now = self.records[0][0] if self.records else 0.0
+        self.divergences = []  # (position, expected (kind, message), sent (kind, message), skipped records)
+        self.replayed = 0
+
+        # pyvisa resource attributes, set by the code that configures the port
+        self.timeout = 2000
+        self.read_termination = '\r\n'
+        self.write_termination = '\r\n'
+
+    def clock(self):
+        """Virtual time: the end of the last replayed transaction, plus the time slept since."""
+        if self.closed is not None and self.position == len(self.records):
+            # Whatever the recorded run did after its last transaction took until it closed the resource
+            return max(self.now, self.closed)
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def next_record(self, kind, message):
+        end = min(len(self.records), self.position + self.look_ahead + 1)
+        for position in range(self.position, end):
+            _, _, recorded_kind, recorded_message, _ = self.records[position]
+            if recorded_kind == kind and recorded_message == message:
+                break
+        else:
+            expected = tuple(self.records[self.position][2:4]) if self.position < len(self.records) else None
+            raise ReplayDivergence('Record {} of {}: sent {} {!r}, expected {}'.format(
+                self.position, self.path, kind, message, expected))
+
+        if position != self.position:
+            self.divergences.append((self.position, tuple(self.records[self.position][2:4]), (kind, message),
+                                     position - self.position))
+        record = self.records[position]
+        self.position = position + 1
+        self.replayed += 1
+
+        start, duration, _, _, reply = record
+        self.now = max(self.now, start) + duration
+        if isinstance(reply, dict):
+            error_type, error_message = reply['error']
+            error_class = getattr(builtins, error_type, None)
+            if isinstance(error_class, type) and issubclass(error_class, Exception):
+                raise error_class(error_message)
+            raise ReplayedError(error_type, error_message)
+        return reply
+
+    def query(self, message):
+        return self.next_record(QUERY, message)
+
+    def write(self, message):
+        self.next_record(WRITE, message)
+
+    def read(self):
+        return self.next_record(READ, None)
+
+    def clear(self):
+        self.next_record(CLEAR, None)
+
+    def recover(self, attempt):
+        """Recover like the recorded run did after a reply that could not be processed."""
+        try:
+            return bool(self.next_record(RECOVER, attempt))
+        except ReplayDivergence:
+            # Logs recorded before recover() was recorded: give up on the query like a plain resource
+            return False
+
+    def close(self):
+        pass
+
+    @property
+    def remaining(self):
+        return len(self.records) - self.position
+
+    def report(self):
+        return {'records': len(self.records),
+                'replayed': self.replayed,
+                'skipped': sum(divergence[3] for divergence in self.divergences),
+                'remaining': self.remaining,
+                'divergences': list(self.divergences),
+                'duration': self.now - self.records[0][0] if self.records else 0.0}
@@ -0,0 +1,174 @@
+"""
+Settle detection for temperature control loops.
+
+RollingStatistics keeps the mean, variance and least-squares slope of the readings over a time window, updated in O(1)
+per reading from running sums. SettleDetector decides from them when a reading has settled on its setpoint:
+    - the ramp is finished
+    - the reading is within band of the setpoint
+    - the reading drifts by less than slope_limit per minute over the window
+    - all of the above has held for hold_time seconds
+
+AdaptivePoller spaces the readings by how far the loop is from settling: sparse while ramping (nothing can settle
+before the ramp ends) and far from the band, dense close to the band, where the hold time starts.
+"""
+import collections
+import math
+
+
+class RollingStatistics(object):
+    def __init__(self, window):
+        """:param window: length of the window in seconds"""
+        self.window = window
+        self.samples = collections.deque()
+        self.reset_sums(0.0)
+
+    def reset_sums(self, origin):
+        # Times are taken relative to origin to keep the sums of squares small
+        self.origin = origin
+        self.n = 0
+        self.sum_t = 0.0
+        self.sum_y = 0.0
+        self.sum_tt = 0.0
+        self.sum_ty = 0.0
+        self.sum_yy = 0.0
+
+    def accumulate(self, t, y, sign):
+        t -= self.origin
+        self.n += sign
+        self.sum_t += sign * t
+        self.sum_y += sign * y
+        self.sum_tt += sign * t * t
+        self.sum_ty += sign * t * y
+        self.sum_yy += sign * y * y
+
+    def add(self, t, y):
+        if not self.samples or t - self.origin > 10 * self.window:
+            # Move the origin along (and get rid of accumulated rounding errors) every few windows
+            self.rebase(t)
+        self.samples.append((t, y))
+        self.accumulate(t, y, 1)
+        while t - self.samples[0][0] > self.window:
+            old_t, old_y = self.samples.popleft()
+            self.accumulate(old_t, old_y, -1)
+
+    def rebase(self, origin):
+        self.reset_sums(origin)
+        for t, y in self.samples:
+            self.accumulate(t, y, 1)
+
+    def clear(self):
+        self.samples.clear()
+        self.reset_sums(0.0)
+
+    @property
+    def span(self):
+        """Time covered by the samples in the window."""
+        if not self.samples:
+            return 0.0
+        return self.samples[-1][0] - self.samples[0][0]
+
+    @property
+    def mean(self):
+        return self.sum_y / self.n if self.n else math.nan
+
+    @property
+    def variance(self):
+        if self.n < 2:
+            return math.nan
+        return max(0.0, (self.sum_yy - self.sum_y * self.sum_y / self.n) / (self.n - 1))
+
+    @property
+    def slope(self):
+        """Least-squares slope of the readings, per second."""
+        denominator = self.n * self.sum_tt - self.sum_t * self.sum_t
+        if self.n < 2 or denominator <= 0:
+            return math.nan
+        return (self.n * self.sum_ty - self.sum_t * self.sum_y) / denominator
+
+
+class SettleCriteria(object):
+    def __init__(self, band, slope_limit=None, hold_time=30.0, window=None):
+        """
+        :param band: maximum distance between the reading and the setpoint
+        :param slope_limit: maximum drift of the reading per minute, None to not check the drift
+        :param hold_time: seconds the criteria have to hold before the reading counts as settled
+        :param window: length (s) of the window the drift is fitted over, the hold time by default
+        """
+        self.band = band
+        self.slope_limit = slope_limit
+        self.hold_time = hold_time
+        self.window = hold_time if window is None else window
+
+
+class SettleDetector(object):
+    RAMPING = 'ramping'
+    OUT_OF_BAND = 'out of band'
+    DRIFTING = 'drifting'
+    HOLDING = 'holding'
+    SETTLED = 'settled'
+
+    def __init__(self, criteria):
+        self.criteria = criteria
+        self.statistics = RollingStatistics(criteria.window)
+        self.in_band_since = None
+        self.state = None
+        self.distance = math.inf  # Distance from the setpoint in units of the band
+
+    def reset(self):
+        self.statistics.clear()
+        self.in_band_since = None
+        self.state = None
+        self.distance = math.inf
+
+    def update(self, t, setpoint, value, ramping=False):
+        """Add a reading taken at time t and return True once it has settled."""
+        criteria = self.criteria
+        self.statistics.add(t, value)
+        self.distance = abs(value - setpoint) / criteria.band
+
+        if ramping:
+            state = self.RAMPING
+        elif self.distance > 1:
+            state = self.OUT_OF_BAND
+        elif criteria.slope_limit is not None and self.statistics.span >= criteria.window / 2 and \
+                abs(self.statistics.slope) * 60 > criteria.slope_limit:
+            state = self.DRIFTING
+        else:
+            state = self.HOLDING
+
+        if state != self.HOLDING:
+            self.in_band_since = None
+        else:
+            if self.in_band_since is None:
+                self.in_band_since = t
+            if t - self.in_band_since >= criteria.hold_time:
+                state = self.SETTLED
+
+        self.state = state
+        return state == self.SETTLED
+
+
+class AdaptivePoller(object):
+    def __init__(self, min_interval=0.2, max_interval=5.0, near=2.0, far=20.0, ramp_interval=None):
+        """
+        :param min_interval: seconds between readings within near bands of the setpoint
+        :param max_interval: seconds between readings beyond far bands of the setpoint
+        :param ramp_interval: seconds between readings while ramping, max_interval by default
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near = near
+        self.far = far
+        self.ramp_interval = max_interval if ramp_interval is None else ramp_interval
+
+    def interval(self, distance, ramping=False):
+        """Time until the next reading, given the distance from the setpoint in units of the band."""
+        if ramping:
+            return self.ramp_interval
+        if distance <= self.near:
+            return self.min_interval
+        if distance >= self.far:
+            return self.max_interval
+        # Geometric interpolation between the two intervals
+        fraction = (distance - self.near) / (self.far - self.near)
+        return self.min_interval * (self.max_interval / self.min_interval) ** fraction
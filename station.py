@@ -0,0 +1,161 @@
+"""
+A cryostat test station: one LS350 controlling a VTI and a sample stage, plus the pressure gauges on the DAQ.
+
+Station bundles the operations the measurement protocol is made of (sample, set ramps, settle, soak, mark segments in
+the data log) so that they can be scheduled by protocol.ProtocolRunner.
+"""
+import logging
+from time import sleep, time
+
+from acquisition import ConcurrentSampler
+from settle import AdaptivePoller, SettleCriteria, SettleDetector
+
+COLUMNS = ('Time', 'VTI Setpoint (C)', 'VTI Temperature (C)', 'VTI Sensor (Ohm)', 'Sample Setpoint (C)',
+           'Sample Temperature (C)', 'Sample Sensor (Ohm)', 'Pressure1 (mbar)', 'Pressure2 (mbar)')
+
+
+class Station(object):
+    def __init__(self, LS350, pressure_source, data_log, VTI_input='A', VTI_output=1, sample_input='B',
+                 sample_output=2, settle_slope_limit=None, poll_interval=(0.2, 5.0), record_interval=None,
+                 converter=None, clock=time, sleep=sleep, history=None, telemetry=None):
+        """
+        :param LS350: LS350_Driver
+        :param pressure_source: daq.PressureSource
+        :param data_log: datalog.BinaryLogWriter with the columns in COLUMNS
+        :param converter: conversion.CurveConverter to compute the temperatures from the sensor readings instead of
+                          asking the LS350 for them
+        :param clock: returns the current time, with sleep replaceable by a virtual clock (see replay.py)
+        :param history: history.History fed with every sample, recorded or not, e.g. for live plots
+        :param telemetry: supervisor.TelemetrySlot the latest sample is published to
+        :param settle_slope_limit: maximum drift (C/minute) of the sample temperature while settling
+        :param poll_interval: (seconds between samples close to the setpoint, seconds between samples while ramping or
+                              far from the setpoint)
+        :param record_interval: longest time in seconds between recorded samples while settling, None to record at the
+                                rate the samples are polled
+        """
+        self.LS350 = LS350
+        self.data_log = data_log
+        self.VTI_input = VTI_input
+        self.VTI_output = VTI_output
+        self.sample_input = sample_input
+        self.sample_output = sample_output
+        self.settle_slope_limit = settle_slope_limit
+        self.poll_interval = poll_interval
+        self.record_interval = record_interval
+        self.converter = converter
+        self.clock = clock
+        self.sleep = sleep
+        self.history = history
+        self.telemetry = telemetry
+
+        # The LS350 poll and the pressure acquisition run concurrently
+        self.sampler = ConcurrentSampler(self.poll_LS350, pressure_source, clock=clock)
+
+    def poll_LS350(self):
+        if self.converter is not None:
+            return self.poll_sensors()
+
+        # Read everything in one compound message instead of six round trips
+        with self.LS350.batch() as batch:
+            T_VTI = batch.get_celsius_reading(self.VTI_input)
+            S_VTI = batch.get_sensor_reading(self.VTI_input)
+            setp_VTI = batch.get_setpoint(self.VTI_output)
+            T_samp = batch.get_celsius_reading(self.sample_input)
+            S_samp = batch.get_sensor_reading(self.sample_input)
+            setp_samp = batch.get_setpoint(self.sample_output)
+
+        return (setp_VTI.value - 273.15, T_VTI.value, S_VTI.value,
+                setp_samp.value - 273.15, T_samp.value, S_samp.value)
+
+    def poll_sensors(self):
+        # Only the sensor readings and setpoints are queried, the temperatures are converted locally
+        with self.LS350.batch() as batch:
+            VTI = self.converter.add(batch, self.VTI_input)
+            setp_VTI = batch.get_setpoint(self.VTI_output)
+            sample = self.converter.add(batch, self.sample_input)
+            setp_samp = batch.get_setpoint(self.sample_output)
+
+        return (setp_VTI.value - 273.15, VTI.celsius, VTI.sensor,
+                setp_samp.value - 273.15, sample.celsius, sample.sensor)
+
+    def measure_temperature(self, write=False):
+        record = self.sampler.sample()
+
+        if self.history is not None:
+            self.history.add(record)
+        if self.telemetry is not None:
+            self.telemetry.publish(record)
+
+        if write:
+            self.data_log.write(record)
+
+        return record
+
+    def set_ramp(self, output, rate):
+        """Ramp output at rate C/minute, or switch ramping off if rate is None."""
+        # The protocol sets the same ramps every cycle, the transaction only sends the ones that change
+        with self.LS350.transaction():
+            self.LS350.ramp[output] = (0, 0) if rate is None else (1, rate)
+
+    def set_temperature_and_settle(self, T_VTI, T_samp, T_range, settle_time, timeout, record=False):
+        # Both setpoints in one message, a setpoint that did not change is not sent again
+        with self.LS350.transaction():
+            self.LS350.setpoint[self.VTI_output] = T_VTI + 273.15
+            self.LS350.setpoint[self.sample_output] = T_samp + 273.15
+
+        detector = SettleDetector(SettleCriteria(band=T_range, slope_limit=self.settle_slope_limit,
+                                                 hold_time=settle_time))
+        poller = AdaptivePoller(min_interval=self.poll_interval[0], max_interval=self.poll_interval[1])
+
+        timer = self.clock()
+        state = None
+
+        while True:
+            if timeout < self.clock() - timer:
+                logging.warning(
+                    'Reached timeout! Possible Causes: timeout may be too small, heater power not set correctly, wrong flow rate.')
+                return False, self.clock() - timer
+
+            sample_time = self.clock()
+            _, setp_VTI, T_VTI, S_VTI, setp_samp, T_samp, S_samp, p1, p2 = self.measure_temperature(record)
+            ramping = self.LS350.get_ramp_status(self.sample_output) != 0
+
+            if detector.update(sample_time, setp_samp, T_samp, ramping):
+                return True, self.clock() - timer
+
+            if detector.state != state:
+                # Only log when the reason for not being settled changes
+                state = detector.state
+                logging.info('Settle state {}: T_set={}, T_curr={}, T_range={}'.format(state, setp_samp, T_samp,
+                                                                                      T_range))
+
+            interval = poller.interval(detector.distance, ramping)
+            if record and self.record_interval is not None:
+                interval = min(interval, self.record_interval)
+            delay = interval - (self.clock() - sample_time)
+            if delay > 0:
+                self.sleep(delay)
+
+    def soak(self, duration, record=True, progress=None, progress_interval=60):
+        """
+        Keep sampling for duration seconds.
+
+        :param progress: called with the elapsed time every progress_interval seconds
+        """
+        start = self.clock()
+        last_progress = start
+        while self.clock() - start < duration:
+            self.measure_temperature(record)
+            if progress is not None and self.clock() - last_progress >= progress_interval:
+                last_progress = self.clock()
+                progress(last_progress - start)
+
+    def segment(self, text):
+        self.data_log.segment(text)
+
+    def flush(self):
+        """Write everything recorded so far to disk."""
+        self.data_log.flush()
+
+    def close(self):
+        self.sampler.close()
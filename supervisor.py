@@ -0,0 +1,374 @@
+"""
+Run several stations from one host, one worker process per station.
+
+Every station (one LS350 on its own port) runs measurement.run_station in a process of its own, so the stations do not
+share a GIL and a station that crashes or hangs does not hold up the others. The supervisor restarts a worker that
+exits with an error or stops publishing samples, with a growing delay; a restarted run resumes from its checkpoint.
+
+The workers publish their latest sample into a table in shared memory (TelemetryTable), one row per station, which any
+process on the host can read without asking the workers:
+    stations = {'A': measurement.configuration(filename='ASY-1212A_Run1.dat', LS350_address='ASRL9::INSTR'),
+                'B': measurement.configuration(filename='ASY-1212B_Run1.dat', LS350_address='ASRL10::INSTR')}
+    with Supervisor(stations) as supervisor:
+        supervisor.run()
+
+    # In a dashboard process
+    table = TelemetryTable.attach(supervisor.table.name, n_slots=2)
+    print(table.read(0)['Sample Temperature (C)'])
+
+The LS350 metrics of the workers (instrumentation.DriverMetrics snapshots) are sent to the supervisor every
+metrics_interval seconds and aggregated by Supervisor.metrics().
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from station import COLUMNS
+
+# Fields of a row of the telemetry table in front of the sample columns
+SLOT_FIELDS = ('sequence', 'pid', 'state', 'heartbeat', 'samples', 'restarts', 'exit_code')
+SEQUENCE, PID, STATE, HEARTBEAT, SAMPLES, RESTARTS, EXIT_CODE = range(len(SLOT_FIELDS))
+
+# States of a station
+IDLE = 0
+STARTING = 1
+RUNNING = 2
+WAITING = 3  # For a restart
+FINISHED = 4
+FAILED = 5
+STATE_NAMES = ('idle', 'starting', 'running', 'waiting', 'finished', 'failed')
+
+
+class TelemetryTable(object):
+    def __init__(self, n_slots, columns=COLUMNS, name=None, create=True):
+        """
+        :param n_slots: number of rows, one per station
+        :param columns: names of the sample columns
+        :param name: name of the shared memory block, a unique name is chosen when it is created
+        :param create: create the block, otherwise attach to the existing block name
+        """
+        self.n_slots = n_slots
+        self.columns = tuple(columns)
+        self.width = len(SLOT_FIELDS) + len(self.columns)
+        size = n_slots * self.width * 8
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.owner = create
+        self.data = np.ndarray((n_slots, self.width), dtype=np.float64, buffer=self.memory.buf)
+        if create:
+            self.data[:] = np.nan
+            self.data[:, SEQUENCE] = 0
+            self.data[:, STATE] = IDLE
+            self.data[:, RESTARTS] = 0
+            self.data[:, SAMPLES] = 0
+
+    @classmethod
+    def attach(cls, name, n_slots, columns=COLUMNS):
+        return cls(n_slots, columns, name=name, create=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def slot(self, index):
+        return TelemetrySlot(self, index)
+
+    def update(self, index, **fields):
+        """Set fields of a row, named as in SLOT_FIELDS and the columns."""
+        row = self.data[index]
+        row[SEQUENCE] += 1  # Odd while the row is being written
+        for field, value in fields.items():
+            row[self.field(field)] = value
+        row[SEQUENCE] += 1
+
+    def field(self, name):
+        if name in SLOT_FIELDS:
+            return SLOT_FIELDS.index(name)
+        return len(SLOT_FIELDS) + self.columns.index(name)
+
+    def read_row(self, index, retries=1000):
+        """Consistent copy of a row: every row has a single writer, the reader retries while it is being written."""
+        row = self.data[index]
+        for _ in range(retries):
+            sequence = row[SEQUENCE]
+            if sequence % 2 == 0:
+                copy = row.copy()
+                if copy[SEQUENCE] == sequence == row[SEQUENCE]:
+                    return copy
+            time.sleep(0)
+        raise TimeoutError('Row {} of the telemetry table is not released'.format(index))
+
+    def read(self, index):
+        """Row as a dict of the slot fields and the latest sample."""
+        row = self.read_row(index)
+        values = dict(zip(SLOT_FIELDS + self.columns, row.tolist()))
+        values['state'] = STATE_NAMES[int(values['state'])]
+        return values
+
+    def snapshot(self):
+        """Consistent copy of every row as an array (n_slots x width)."""
+        return np.array([self.read_row(index) for index in range(self.n_slots)])
+
+    def close(self):
+        # The array must go before the buffer it points into can be released
+        self.data = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class TelemetrySlot(object):
+    """Row of the telemetry table a worker writes to, fed by its Station with every sample."""
+    def __init__(self, table, index, metrics_queue=None, metrics_interval=10.0, clock=time.time):
+        self.table = table
+        self.index = index
+        self.metrics_queue = metrics_queue
+        self.metrics_interval = metrics_interval
+        self.clock = clock
+        self.metrics = None
+        self.samples = 0
+        self.last_metrics = None
+
+    def attach_metrics(self, metrics):
+        """Send the snapshots of an instrumentation.DriverMetrics to the supervisor."""
+        self.metrics = metrics
+        self.last_metrics = self.clock()
+
+    def start(self):
+        self.table.update(self.index, pid=os.getpid(), state=RUNNING, heartbeat=self.clock(), exit_code=np.nan)
+
+    def publish(self, record):
+        now = self.clock()
+        self.samples += 1
+        row = self.table.data[self.index]
+        row[SEQUENCE] += 1
+        row[HEARTBEAT] = now
+        row[SAMPLES] = self.samples
+        row[len(SLOT_FIELDS):] = record
+        row[SEQUENCE] += 1
+
+        if self.metrics is not None and self.metrics_queue is not None and \
+                now - self.last_metrics >= self.metrics_interval:
+            self.last_metrics = now
+            self.send_metrics()
+
+    def send_metrics(self):
+        try:
+            self.metrics_queue.put_nowait((self.index, self.metrics.snapshot()))
+        except queue.Full:
+            pass
+
+
+def run_worker(index, config, table_name, n_slots, columns, metrics_queue, metrics_interval):
+    """Entry point of a worker process."""
+    # Imported here, so that the supervisor runs without pyvisa
+    import measurement
+
+    table = TelemetryTable.attach(table_name, n_slots, columns)
+    slot = TelemetrySlot(table, index, metrics_queue, metrics_interval)
+    slot.start()
+    try:
+        code = measurement.run_station(config, telemetry=slot)
+    finally:
+        if slot.metrics is not None:
+            slot.send_metrics()
+        table.close()
+    return code
+
+
+def run_process(worker, args):
+    # The exit code of the process is the one the worker returns
+    raise SystemExit(worker(*args))
+
+
+class StationProcess(object):
+    """Worker of one station as seen by the supervisor."""
+    def __init__(self, index, name, config):
+        self.index = index
+        self.name = name
+        self.config = config
+        self.process = None
+        self.restarts = 0
+        self.started = None
+        self.restart_at = None
+        self.exit_codes = []
+        self.metrics = None  # Latest DriverMetrics snapshot
+
+
+class Supervisor(object):
+    def __init__(self, stations, worker=run_worker, max_restarts=5, restart_delay=(1.0, 300.0), stall_timeout=600.0,
+                 metrics_interval=10.0, columns=COLUMNS, clock=time.time):
+        """
+        :param stations: dict of station name -> configuration passed to the worker (see measurement.configuration)
+        :param worker: function run in a worker process as worker(index, config, table name, number of stations,
+                       columns, metrics queue, metrics interval), returns the exit code
+        :param max_restarts: restarts of a station before it is given up
+        :param restart_delay: (first, longest) delay in seconds before a restart, doubled after every restart
+        :param stall_timeout: seconds without a sample after which a running worker is killed and restarted, None to
+                              never kill a worker
+        """
+        self.stations = [StationProcess(index, name, config) for index, (name, config) in enumerate(stations.items())]
+        self.worker = worker
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.stall_timeout = stall_timeout
+        self.metrics_interval = metrics_interval
+        self.columns = tuple(columns)
+        self.clock = clock
+
+        # Spawned workers do not inherit the supervisor's threads, locks and open ports
+        self.context = multiprocessing.get_context('spawn')
+        self.metrics_queue = self.context.Queue(maxsize=100 * max(len(self.stations), 1))
+        self.table = TelemetryTable(len(self.stations), self.columns)
+
+    def station(self, name):
+        for station in self.stations:
+            if station.name == name:
+                return station
+        raise KeyError('No station {}'.format(name))
+
+    def start(self):
+        for station in self.stations:
+            self.start_station(station)
+
+    def start_station(self, station):
+        self.table.update(station.index, state=STARTING, pid=np.nan, heartbeat=np.nan, exit_code=np.nan,
+                          restarts=station.restarts)
+        station.process = self.context.Process(
+            target=run_process, name='station-{}'.format(station.name),
+            args=(self.worker, (station.index, station.config, self.table.name, len(self.stations), self.columns,
+                                self.metrics_queue, self.metrics_interval)))
+        station.process.start()
+        station.started = self.clock()
+        station.restart_at = None
+        logging.info('Started station {} (pid {})'.format(station.name, station.process.pid))
+
+    def state(self, station):
+        return int(self.table.data[station.index, STATE])
+
+    def poll(self):
+        """Collect the metrics and handle the workers that exited or stalled. Returns the number of active stations."""
+        self.collect_metrics()
+        now = self.clock()
+        active = 0
+        for station in self.stations:
+            state = self.state(station)
+            if state in (FINISHED, FAILED):
+                continue
+            active += 1
+
+            if state == WAITING:
+                if now >= station.restart_at:
+                    self.start_station(station)
+                continue
+
+            process = station.process
+            if process.is_alive():
+                if self.stalled(station, now):
+                    logging.error('Station {} published no sample for {} s, restarting it'.format(
+                        station.name, self.stall_timeout))
+                    process.kill()
+                    process.join()
+                else:
+                    continue
+
+            process.join()
+            self.exited(station, process.exitcode, now)
+        return active
+
+    def stalled(self, station, now):
+        if self.stall_timeout is None:
+            return False
+        heartbeat = self.table.data[station.index, HEARTBEAT]
+        last = station.started if np.isnan(heartbeat) else max(heartbeat, station.started)
+        return now - last > self.stall_timeout
+
+    def exited(self, station, code, now):
+        station.exit_codes.append(code)
+        if code == 0:
+            logging.info('Station {} finished'.format(station.name))
+            self.table.update(station.index, state=FINISHED, exit_code=code)
+            return
+
+        if station.restarts >= self.max_restarts:
+            logging.error('Station {} exited with {}, giving up after {} restarts'.format(station.name, code,
+                                                                                        station.restarts))
+            self.table.update(station.index, state=FAILED, exit_code=code)
+            return
+
+        delay = min(self.restart_delay[0] * 2 ** station.restarts, self.restart_delay[1])
+        station.restarts += 1
+        station.restart_at = now + delay
+        logging.warning('Station {} exited with {}, restarting it in {} s'.format(station.name, code, delay))
+        self.table.update(station.index, state=WAITING, exit_code=code, restarts=station.restarts)
+
+    def collect_metrics(self):
+        while True:
+            try:
+                index, snapshot = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.stations[index].metrics = snapshot
+
+    def run(self, interval=1.0):
+        """Start the stations and supervise them until every one has finished or failed."""
+        if any(station.process is None for station in self.stations):
+            self.start()
+        while self.poll():
+            time.sleep(interval)
+        self.collect_metrics()
+        return {station.name: STATE_NAMES[self.state(station)] for station in self.stations}
+
+    def telemetry(self):
+        """Latest row of every station, as dicts keyed by the station name."""
+        return {station.name: self.table.read(station.index) for station in self.stations}
+
+    def metrics(self):
+        """Restarts and LS350 metrics of every station, and their totals."""
+        stations = {}
+        transactions = errors = 0
+        for station in self.stations:
+            commands = station.metrics['commands'] if station.metrics is not None else {}
+            station_transactions = sum(command['count'] for command in commands.values())
+            station_errors = sum(command['errors'] for command in commands.values())
+            transactions += station_transactions
+            errors += station_errors
+            stations[station.name] = {'state': STATE_NAMES[self.state(station)],
+                                      'restarts': station.restarts,
+                                      'exit_codes': list(station.exit_codes),
+                                      'transactions': station_transactions,
+                                      'errors': station_errors,
+                                      'driver': station.metrics}
+        return {'stations': stations,
+                'transactions': transactions,
+                'errors': errors,
+                'restarts': sum(station.restarts for station in self.stations),
+                'running': sum(self.state(station) == RUNNING for station in self.stations)}
+
+    def stop(self, timeout=10.0):
+        """Terminate the workers that are still running."""
+        for station in self.stations:
+            if station.process is not None and station.process.is_alive():
+                station.process.terminate()
+        for station in self.stations:
+            if station.process is not None:
+                station.process.join(timeout)
+                if station.process.is_alive():
+                    station.process.kill()
+                    station.process.join()
+
+    def close(self):
+        self.stop()
+        self.collect_metrics()
+        self.metrics_queue.close()
+        self.table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
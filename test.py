@@ -1,5 +1,6 @@
 from LS218_Driver import LS218_Driver
 from LS350_Driver import LS350_Driver
+from multiplexer import ResourceMultiplexer
 
 import visa
 
@@ -14,13 +15,16 @@ res.parity = visa.constants.Parity.odd
 res.baud_rate = 9600
 res.read_termination = '\r\n'
 
-LS218 = LS218_Driver(res)
+# Drivers share the resource through the multiplexer so their transactions are never interleaved
+mux = ResourceMultiplexer(res)
+
+LS218 = mux.driver(LS218_Driver)
 print(LS218.identification())
 print(LS218.get_baud_rate())
 print(LS218.get_celsius_reading_all())
 print(LS218.get_sensor_reading_all())
 print(LS218.get_sensor_reading(1))
-"""LS350 = LS350_Driver(res)
+"""LS350 = mux.driver(LS350_Driver)
 #print(LS350.identification())
 
 LS350.set_brightness(20)
@@ -0,0 +1,83 @@
+"""
+Concurrent sampling of the instrument poll and the pressure read.
+
+    python -m unittest discover -s tests -t .
+"""
+import threading
+import time
+import unittest
+
+from acquisition import ConcurrentSampler
+from daq import PressureSource, StaticPressureSource
+
+
+class FailingPressureSource(PressureSource):
+    def __init__(self, fail_after=0):
+        self.reads = 0
+        self.fail_after = fail_after
+        self.closed = False
+
+    def read(self):
+        self.reads += 1
+        if self.reads > self.fail_after:
+            raise OSError('DAQ disconnected')
+        return (1.0, 2.0, 3.0)
+
+    def close(self):
+        self.closed = True
+
+
+class ConcurrentSamplerTest(unittest.TestCase):
+    def test_record_layout(self):
+        sampler = ConcurrentSampler(lambda: (295.0, 21.85), StaticPressureSource((1.0, 2.0)), clock=lambda: 10.0)
+        self.assertEqual(sampler.sample(), (10.0, 295.0, 21.85, 1.0, 2.0))
+        sampler.close()
+
+    def test_poll_and_pressure_read_overlap(self):
+        both_running = threading.Barrier(2, timeout=5)
+
+        def poll():
+            both_running.wait()
+            return (295.0,)
+
+        class Source(PressureSource):
+            def read(self):
+                both_running.wait()
+                return (1.0, 2.0)
+
+        sampler = ConcurrentSampler(poll, Source())
+        self.assertEqual(sampler.sample()[1:], (295.0, 1.0, 2.0))
+        sampler.close()
+
+    def test_cycle_takes_the_slower_of_the_two(self):
+        def poll():
+            time.sleep(0.2)
+            return (295.0,)
+
+        sampler = ConcurrentSampler(poll, StaticPressureSource((1.0, 2.0), acquisition_time=0.2))
+        start = time.monotonic()
+        sampler.sample()
+        self.assertLess(time.monotonic() - start, 0.35)
+        sampler.close()
+
+    def test_failed_pressure_read_keeps_the_channel_count(self):
+        source = FailingPressureSource(fail_after=1)
+        sampler = ConcurrentSampler(lambda: (295.0,), source, failed_pressure=-1)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(sampler.sample()[1:], (295.0, 1.0, 2.0, 3.0))
+            self.assertEqual(sampler.sample()[1:], (295.0, -1, -1, -1))
+        sampler.close()
+        self.assertTrue(source.closed)
+
+    def test_poll_errors_are_raised(self):
+        def poll():
+            raise TimeoutError('No reply')
+
+        sampler = ConcurrentSampler(poll, StaticPressureSource())
+        with self.assertRaises(TimeoutError):
+            sampler.sample()
+        sampler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Alarm monitoring against the emulators.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from emulator import LS218Emulator, LS350Emulator
+from pacing import NullPacer
+
+
+def driver(driver_class, emulator):
+    instrument = driver_class(emulator)
+    instrument.pacer = NullPacer()
+    return instrument
+
+
+class LS218AlarmTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS218Emulator()
+        self.LS218 = driver(LS218_Driver, self.emulator)
+        self.events = []
+        self.LS218.on_alarm(lambda input, status: self.events.append((input, tuple(status.values()))))
+
+    def test_alarms_are_polled(self):
+        self.LS218.alarm_monitor.scan()
+        self.assertEqual(self.events, [])
+        self.assertTrue(all(message.startswith('ALARMST?') for message in self.emulator.received))
+
+        self.LS218.set_input_alarm_parameters(3, 1, 1, 280.0, 200.0, 1.0, 0)
+        self.emulator.set_temperature(3, 285.0)
+        self.LS218.alarm_monitor.scan()
+        self.assertEqual(self.events, [(3, (1, 0))])
+
+        self.emulator.set_temperature(3, 270.0)
+        self.LS218.alarm_monitor.scan()
+        self.LS218.alarm_monitor.scan()
+        self.assertEqual(self.events, [(3, (1, 0)), (3, (0, 0))])
+
+    def test_does_not_wait_for_service_requests(self):
+        waits = []
+        self.emulator.wait_for_srq = waits.append
+        self.LS218.alarm_monitor.sleep = lambda seconds: None
+        self.LS218.alarm_monitor.wait()
+        self.assertEqual(waits, [])
+
+
+class LS350AlarmTest(unittest.TestCase):
+    def test_summary_and_heater_faults(self):
+        emulator = LS350Emulator()
+        LS350 = driver(LS350_Driver, emulator)
+        events = []
+        LS350.on_alarm(lambda input, status: events.append(('alarm', input)))
+        LS350.on_heater_fault(lambda output, code: events.append(('heater', output, code)))
+        LS350.alarm_monitor.scan()
+        self.assertEqual(events, [])
+
+        emulator.write('ALARM B,1,300.0,100.0,1.0,1,0,0')
+        emulator.temperatures['B'] = 310.0
+        emulator.set_heater_fault(2, 1)
+        LS350.alarm_monitor.scan()
+        self.assertEqual(events, [('alarm', 'B'), ('heater', 2, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
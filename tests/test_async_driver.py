@@ -0,0 +1,136 @@
+"""
+AsyncDriver against the emulator through a MemoryTransport.
+
+    python -m unittest discover -s tests -t .
+"""
+import asyncio
+import unittest
+
+from LS350_Driver import AsyncLS350_Driver
+from async_driver import AsyncDriver, AsyncQuery, AsyncWrite
+from async_transport import MemoryTransport
+from emulator import LS350Emulator
+from pacing import NullPacer
+from processors import ProcessInteger, ProcessorError, ProcessReal
+from transport import ResilientResource
+from validators import ValidateInArray, ValidationError
+
+
+def no_sleep(seconds):
+    pass
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class HeaterDriver(AsyncDriver):
+    """Native coroutine commands on the heater range of the emulated Model 350."""
+    @AsyncQuery(validators={'output': ValidateInArray((1, 2))}, processors=ProcessInteger(), cache=60)
+    async def get_heater_range(self, output):
+        return await self.query('RANGE? {}'.format(output))
+
+    @AsyncWrite(validators={'output': ValidateInArray((1, 2))}, invalidates=('get_heater_range',))
+    async def set_heater_range(self, output, range):
+        await self.send('RANGE {},{}'.format(output, range))
+
+    @AsyncQuery(processors=ProcessReal())
+    async def get_kelvin_reading(self, input):
+        return await self.query('KRDG? {}'.format(input))
+
+
+def garble_first(emulator, mnemonic, reply='x#!'):
+    handler = emulator.handlers[mnemonic]
+    calls = []
+
+    def garbled(self, *args):
+        calls.append(args)
+        return reply if len(calls) == 1 else handler(self, *args)
+    emulator.handlers[mnemonic] = garbled
+
+
+class AsyncDriverTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.LS350 = AsyncLS350_Driver(MemoryTransport(self.emulator))
+        self.LS350.pacer = NullPacer()
+
+    def test_replies_are_processed(self):
+        self.assertEqual(run(self.LS350.get_kelvin_reading('A')), 295.0)
+        pid = run(self.LS350.get_pid(1))
+        self.assertEqual(sorted(pid), ['D', 'I', 'P'])
+
+    def test_invalid_arguments_are_not_sent(self):
+        with self.assertRaises(ValidationError):
+            run(self.LS350.get_setpoint(7))
+        with self.assertRaises(ValidationError):
+            run(self.LS350.set_heater_range(1, 9))
+        self.assertEqual(self.emulator.received, [])
+
+    def test_concurrent_calls_are_not_interleaved(self):
+        async def poll():
+            return await asyncio.gather(*[self.LS350.get_kelvin_reading(input) for input in 'ABCD' * 5],
+                                        *[self.LS350.get_setpoint(output) for output in (1, 2) * 5])
+        self.assertEqual(run(poll()), [295.0] * 30)
+        self.assertEqual(len(self.emulator.received), 30)
+
+    def test_cache_and_invalidation(self):
+        async def calls():
+            await self.LS350.get_pid(1)
+            await self.LS350.get_pid(1)
+            await self.LS350.set_pid(1, 80, 30, 0)
+            return await self.LS350.get_pid(1)
+        self.assertEqual(run(calls())['P'], 80)
+        self.assertEqual(self.emulator.received.count('PID? 1'), 2)
+
+    def test_garbled_reply_is_sent_again(self):
+        garble_first(self.emulator, 'KRDG?')
+        LS350 = AsyncLS350_Driver(MemoryTransport(ResilientResource(self.emulator, sleep=no_sleep)))
+        LS350.pacer = NullPacer()
+        self.assertEqual(run(LS350.get_kelvin_reading('A')), 295.0)
+
+    def test_garbled_reply_without_recovery_raises(self):
+        garble_first(self.emulator, 'KRDG?')
+        with self.assertRaises(ProcessorError):
+            run(self.LS350.get_kelvin_reading('A'))
+
+    def test_garbled_reply_in_a_batch_is_sent_again(self):
+        garble_first(self.emulator, 'KRDG?', reply='x#!;+295.000')
+        LS350 = AsyncLS350_Driver(MemoryTransport(ResilientResource(self.emulator, sleep=no_sleep)))
+        LS350.pacer = NullPacer()
+
+        async def batch():
+            async with LS350.batch() as batch:
+                reading = batch.get_kelvin_reading('A')
+                setpoint = batch.get_setpoint(1)
+            return reading.value, setpoint.value
+        self.assertEqual(run(batch()), (295.0, 295.0))
+
+
+class AsyncCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.driver = HeaterDriver(MemoryTransport(ResilientResource(self.emulator, sleep=no_sleep)))
+        self.driver.pacer = NullPacer()
+
+    def test_cache_and_invalidation(self):
+        async def calls():
+            first = await self.driver.get_heater_range(1)
+            await self.driver.get_heater_range(1)
+            await self.driver.set_heater_range(1, first % 3 + 1)
+            return first, await self.driver.get_heater_range(1)
+        first, second = run(calls())
+        self.assertEqual(second, first % 3 + 1)
+        self.assertEqual(self.emulator.received.count('RANGE? 1'), 2)
+
+    def test_validation(self):
+        with self.assertRaises(ValidationError):
+            run(self.driver.get_heater_range(3))
+
+    def test_garbled_reply_is_sent_again(self):
+        garble_first(self.emulator, 'KRDG?')
+        self.assertEqual(run(self.driver.get_kelvin_reading('A')), 295.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
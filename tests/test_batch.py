@@ -0,0 +1,59 @@
+"""
+Batched compound queries of the drivers, against the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from pacing import NullPacer
+
+
+class DriverTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.LS350 = LS350_Driver(self.emulator)
+        self.LS350.pacer = NullPacer()
+
+    def sent(self):
+        """Messages received by the emulator since the last call."""
+        sent = list(self.emulator.received)
+        del self.emulator.received[:]
+        return sent
+
+
+class BatchTest(DriverTest):
+    def test_batch_is_split_to_fit_the_input_buffer(self):
+        with self.LS350.batch() as batch:
+            results = [batch.get_setpoint(output) for output in (1, 2)] + \
+                      [batch.get_kelvin_reading(input) for input in ('A', 'B', 'C', 'D')] + \
+                      [batch.get_heater_range(output) for output in (1, 2)]
+        sent = self.sent()
+        self.assertGreater(len(sent), 1)
+        self.assertTrue(all(len(message) <= self.LS350.input_buffer_size for message in sent))
+        self.assertEqual(sum(message.count(';') + 1 for message in sent), len(results))
+        self.assertEqual([result.value for result in results[:6]], [295.0] * 6)
+
+    def test_cached_results_are_not_sent(self):
+        self.LS350.get_pid(1)
+        self.sent()
+        with self.LS350.batch() as batch:
+            pid = batch.get_pid(1)
+            setpoint = batch.get_setpoint(1)
+        self.assertEqual(self.sent(), ['SETP? 1'])
+        self.assertEqual(pid.value, self.LS350.get_pid(1))
+        self.assertEqual(setpoint.value, 295.0)
+
+    def test_incomplete_compound_reply_falls_back_to_single_queries(self):
+        query = self.emulator.query
+        self.emulator.query = lambda message: query(message).split(';')[0]
+        with self.LS350.batch() as batch:
+            first = batch.get_setpoint(1)
+            second = batch.get_heater_range(1)
+        self.assertEqual(self.sent(), ['SETP? 1;RANGE? 1', 'SETP? 1', 'RANGE? 1'])
+        self.assertEqual((first.value, second.value), (295.0, self.LS350.get_heater_range(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
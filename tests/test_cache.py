@@ -0,0 +1,83 @@
+"""
+Query cache of the drivers, against the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from cache import QueryCache
+from emulator import LS218Emulator, LS350Emulator
+from pacing import NullPacer
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DriverTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.LS350 = LS350_Driver(self.emulator)
+        self.LS350.pacer = NullPacer()
+
+    def sent(self):
+        """Messages received by the emulator since the last call."""
+        sent = list(self.emulator.received)
+        del self.emulator.received[:]
+        return sent
+
+
+class CacheTest(DriverTest):
+    def test_cached_query_is_sent_once(self):
+        self.assertEqual(self.LS350.get_pid(1), self.LS350.get_pid(1))
+        self.assertEqual(self.sent(), ['PID? 1'])
+
+    def test_write_only_evicts_matching_arguments(self):
+        self.LS350.get_pid(1)
+        self.LS350.get_pid(2)
+        self.LS350.set_pid(1, 80, 30, 0)
+        self.sent()
+        self.assertEqual(self.LS350.get_pid(1)['P'], 80)
+        self.LS350.get_pid(2)
+        self.assertEqual(self.sent(), ['PID? 1'])
+
+    def test_reset_evicts_everything(self):
+        emulator = LS218Emulator()
+        LS218 = LS218_Driver(emulator)
+        LS218.pacer = NullPacer()
+        LS218.get_audible_alarm_state()
+        LS218.get_input_alarm_parameters(1)
+        LS218.reset_instrument()
+        LS218.get_audible_alarm_state()
+        LS218.get_input_alarm_parameters(1)
+        self.assertEqual(emulator.received.count('ALMB?'), 2)
+        self.assertEqual(emulator.received.count('ALARM? 1'), 2)
+
+    def test_results_expire(self):
+        clock = Clock()
+        self.LS350.cache = QueryCache(clock=clock)
+        self.LS350.get_pid(1)
+        clock.now += 59
+        self.LS350.get_pid(1)
+        clock.now += 2
+        self.LS350.get_pid(1)
+        self.assertEqual(self.sent(), ['PID? 1', 'PID? 1'])
+
+    def test_callers_get_a_copy(self):
+        self.LS350.get_pid(1)['P'] = -1
+        self.assertNotEqual(self.LS350.get_pid(1)['P'], -1)
+
+    def test_uncached_queries_are_always_sent(self):
+        self.LS350.get_setpoint(1)
+        self.LS350.get_setpoint(1)
+        self.assertEqual(self.sent(), ['SETP? 1', 'SETP? 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Compression of the recorded samples and their rebuild with resample().
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+import numpy as np
+
+from compression import DEADBAND, SWINGING_DOOR, RecordCompressor, resample
+
+COLUMNS = ('Time', 'Sample Setpoint (C)', 'Sample Temperature (C)')
+TOLERANCES = {'Sample Setpoint (C)': (DEADBAND, 0.001), 'Sample Temperature (C)': (SWINGING_DOOR, 0.01)}
+
+
+def profile(interval=1.0):
+    """Ramp from 20 to 80 C, soak, with a setpoint step and a little noise."""
+    random = np.random.RandomState(4)
+    time = np.arange(0, 3600, interval)
+    setpoint = np.where(time < 600, 20.0, 80.0)
+    temperature = np.clip(20 + (time - 600) * 0.05, 20, 80) + random.normal(0, 0.002, len(time))
+    return np.column_stack((time, setpoint, temperature))
+
+
+def compress(records, compressor):
+    stored = []
+    for record in records:
+        stored.extend(compressor.add(record))
+    stored.extend(compressor.flush())
+    return np.array(stored)
+
+
+class CompressionTest(unittest.TestCase):
+    def test_round_trip_within_tolerance(self):
+        records = profile()
+        compressor = RecordCompressor(COLUMNS, TOLERANCES)
+        stored = compress(records, compressor)
+        self.assertGreater(compressor.ratio, 10)
+
+        rebuilt = resample(stored, COLUMNS, TOLERANCES, interval=1.0)
+        np.testing.assert_array_equal(rebuilt[:, 0], records[:, 0])
+        np.testing.assert_array_equal(rebuilt[:, 1], records[:, 1])
+        self.assertLessEqual(np.abs(rebuilt[:, 2] - records[:, 2]).max(), 0.01 + 1e-9)
+
+    def test_first_and_last_records_are_stored(self):
+        records = profile()
+        stored = compress(records, RecordCompressor(COLUMNS, TOLERANCES))
+        np.testing.assert_array_equal(stored[0], records[0])
+        np.testing.assert_array_equal(stored[-1], records[-1])
+
+    def test_heartbeat(self):
+        records = np.column_stack((np.arange(0, 600.0), np.full(600, 20.0), np.full(600, 21.0)))
+        stored = compress(records, RecordCompressor(COLUMNS, TOLERANCES, heartbeat=60))
+        self.assertLessEqual(np.diff(stored[:, 0]).max(), 60)
+
+    def test_nan_records_are_stored(self):
+        records = profile()[:100]
+        records[50, 2] = np.nan
+        stored = compress(records, RecordCompressor(COLUMNS, TOLERANCES))
+        self.assertIn(50.0, stored[:, 0])
+        self.assertTrue(np.isnan(stored[stored[:, 0] == 50.0, 2]).all())
+
+    def test_resample_marks_gaps(self):
+        stored = np.array([[0.0, 20.0, 20.0], [10.0, 20.0, 21.0], [100.0, 20.0, 22.0], [110.0, 20.0, 22.0]])
+        rebuilt = resample(stored, COLUMNS, TOLERANCES, interval=5.0, max_gap=30)
+        self.assertEqual(rebuilt[1, 2], 20.5)
+        self.assertTrue(np.isnan(rebuilt[(rebuilt[:, 0] > 10) & (rebuilt[:, 0] < 100), 1:]).all())
+        self.assertFalse(np.isnan(rebuilt[rebuilt[:, 0] >= 100, 1:]).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Local conversion of sensor readings with the curves of the emulated Model 350.
+
+    python -m unittest discover -s tests -t .
+"""
+import math
+import unittest
+
+import numpy as np
+
+import measurement
+from LS350_Driver import LS350_Driver
+from conversion import ConversionError, CurveConverter, CurveTable
+from emulator import LS350Emulator
+from pacing import NullPacer
+
+
+class CurveTableTest(unittest.TestCase):
+    def test_linear_interpolation(self):
+        table = CurveTable(21, {'format': 3}, [100.0, 110.0, 120.0], [273.15, 298.79, 324.39])
+        self.assertAlmostEqual(float(table.kelvin(105.0)), (273.15 + 298.79) / 2)
+        np.testing.assert_allclose(table.kelvin([100.0, 120.0]), [273.15, 324.39])
+
+    def test_decreasing_units(self):
+        # Negative temperature coefficient, e.g. a Cernox: the points are sorted for the interpolation
+        table = CurveTable(22, {'format': 3}, [3000.0, 1000.0, 100.0], [4.0, 20.0, 300.0])
+        self.assertAlmostEqual(float(table.kelvin(2000.0)), 12.0)
+        self.assertAlmostEqual(float(table.kelvin(550.0)), 160.0)
+
+    def test_log_ohm(self):
+        table = CurveTable(23, {'format': 4}, [1.0, 2.0, 3.0], [300.0, 30.0, 3.0])
+        self.assertAlmostEqual(float(table.kelvin(10 ** 2.5)), 16.5)
+
+    def test_outside_the_curve(self):
+        table = CurveTable(21, {'format': 3}, [100.0, 120.0], [273.15, 324.39])
+        self.assertTrue(np.all(np.isnan(table.kelvin([99.0, 121.0]))))
+        log_table = CurveTable(23, {'format': 4}, [1.0, 2.0], [300.0, 30.0])
+        self.assertTrue(math.isnan(float(log_table.kelvin(0.0))))
+
+
+class CurveConverterTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.emulator.temperatures['A'] = 250.0
+        self.emulator.temperatures['B'] = 320.0
+        self.LS350 = LS350_Driver(self.emulator)
+        self.LS350.pacer = NullPacer()
+        self.converter = CurveConverter(self.LS350)
+
+    def sent(self):
+        sent = list(self.emulator.received)
+        del self.emulator.received[:]
+        return sent
+
+    def test_conversion_matches_the_controller(self):
+        (_, A), (_, B) = self.converter.read('A', 'B')
+        self.assertAlmostEqual(A, 250.0, delta=0.05)
+        self.assertAlmostEqual(B, 320.0, delta=0.05)
+
+    def test_one_query_per_input(self):
+        self.converter.read('A', 'B')
+        self.sent()
+        self.converter.read('A', 'B')
+        self.assertEqual(self.sent(), ['SRDG? A;SRDG? B'])
+
+    def test_table_resolved_when_the_reading_is_added(self):
+        lookups = []
+        table = self.converter.table
+        self.converter.table = lambda input: lookups.append(input) or table(input)
+        with self.LS350.batch() as batch:
+            reading = self.converter.add(batch, 'A')
+        kelvin = reading.kelvin
+        self.assertAlmostEqual(kelvin, 250.0, delta=0.05)
+        self.assertEqual(reading.kelvin, kelvin)
+        self.assertAlmostEqual(reading.celsius, kelvin - 273.15)
+        self.assertEqual(lookups, ['A'])
+
+    def test_outside_the_curve_falls_back_to_the_controller(self):
+        self.converter.read('A')
+        self.sent()
+        self.emulator.handlers['SRDG?'] = lambda emulator, input: '+9999.00'
+
+        with self.assertLogs(level='WARNING') as logs:
+            (sensor, kelvin), = self.converter.read('A')
+            self.converter.read('A')
+        self.assertEqual(sensor, 9999.0)
+        self.assertAlmostEqual(kelvin, 250.0, delta=0.05)
+        self.assertEqual(self.sent(), ['SRDG? A', 'KRDG? A'] * 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(self.converter.outside, {'A'})
+        self.assertEqual(self.converter.outside_readings, 2)
+
+        self.emulator.handlers['SRDG?'] = LS350Emulator().handlers['SRDG?']
+        self.converter.read('A')
+        self.assertEqual(self.converter.outside, set())
+
+    def test_validation(self):
+        converter = CurveConverter(self.LS350, validate=True, tolerance=0.05)
+        converter.read('A')
+        self.sent()
+        converter.read('A')
+        self.assertEqual(self.sent(), ['KRDG? A;SRDG? A'])
+        self.assertEqual((converter.checked, converter.mismatches), (2, 0))
+
+        self.emulator.handlers['KRDG?'] = lambda emulator, input: '+251.000'
+        with self.assertLogs(level='WARNING'):
+            converter.read('A')
+        self.assertEqual(converter.mismatches, 1)
+        self.assertAlmostEqual(converter.max_error, 1.0, delta=0.05)
+
+    def test_no_curve_assigned(self):
+        self.LS350.set_input_curve_number('C', 0)
+        with self.assertRaises(ConversionError):
+            self.converter.read('C')
+
+    def test_off_by_default(self):
+        self.assertFalse(measurement.configuration()['local_conversion'])
+
+
+if __name__ == '__main__':
+    unittest.main()
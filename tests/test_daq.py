@@ -0,0 +1,133 @@
+"""
+Continuous pressure acquisition from a SyntheticReader.
+
+    python -m unittest discover -s tests -t .
+"""
+import threading
+import unittest
+
+import numpy as np
+
+from daq import ContinuousPressureSource, PRESSURE_GAINS, RingBuffer, SampleReader, StaticPressureSource, \
+    SyntheticReader
+
+
+def ramp(times):
+    """Channel 0 counts the samples, channel 1 is its negative."""
+    return np.vstack((times * 1000.0, -times * 1000.0))
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_wraparound(self):
+        ring = RingBuffer(2, 10)
+        samples = np.vstack((np.arange(37.0), -np.arange(37.0)))
+        for start in range(0, 37, 3):
+            ring.append(samples[:, start:start + 3])
+        self.assertEqual(ring.count, 37)
+        for n in (0, 1, 4, 7, 10, 20):
+            expected = samples[:, 37 - min(n, 10):]
+            np.testing.assert_array_equal(ring.latest(n), expected, err_msg='n={}'.format(n))
+
+    def test_before_the_buffer_is_full(self):
+        ring = RingBuffer(1, 10)
+        ring.append(np.array([[1.0, 2.0, 3.0]]))
+        np.testing.assert_array_equal(ring.latest(5), [[1.0, 2.0, 3.0]])
+
+    def test_block_larger_than_the_buffer(self):
+        ring = RingBuffer(1, 4)
+        ring.append(np.array([[1.0]]))
+        ring.append(np.arange(10.0).reshape(1, 10))
+        np.testing.assert_array_equal(ring.latest(4), [[6.0, 7.0, 8.0, 9.0]])
+        ring.append(np.array([[10.0]]))
+        np.testing.assert_array_equal(ring.latest(4), [[7.0, 8.0, 9.0, 10.0]])
+
+    def test_latest_is_a_copy(self):
+        ring = RingBuffer(1, 4)
+        ring.append(np.array([[1.0, 2.0]]))
+        latest = ring.latest(2)
+        ring.append(np.array([[3.0, 4.0, 5.0]]))
+        np.testing.assert_array_equal(latest, [[1.0, 2.0]])
+
+
+class BlockingReader(SyntheticReader):
+    """SyntheticReader that delivers a block each time the test releases one."""
+    def __init__(self, **kwargs):
+        super().__init__(realtime=False, **kwargs)
+        self.release = threading.Semaphore(0)
+        self.closed = False
+
+    def read_into(self, buffer):
+        self.release.acquire()
+        return super().read_into(buffer)
+
+    def step(self, source):
+        blocks = source.n_blocks
+        self.release.release()
+        while source.n_blocks == blocks:
+            pass
+
+    def stop(self, source):
+        source.running = False
+        self.release.release()
+        source.close()
+
+    def close(self):
+        self.closed = True
+
+
+class FailingReader(SampleReader):
+    channels = 2
+
+    def read_into(self, buffer):
+        raise OSError('DAQ device disconnected')
+
+
+class ContinuousPressureSourceTest(unittest.TestCase):
+    def test_statistics_of_the_latest_block(self):
+        reader = BlockingReader(signal=ramp)
+        source = ContinuousPressureSource(reader, block_size=100, capacity=250)
+        for _ in range(3):
+            reader.step(source)
+        stats = source.statistics()
+        gains = np.array(PRESSURE_GAINS)
+        np.testing.assert_allclose(stats[source.MEAN], np.array([249.5, -249.5]) * gains)
+        np.testing.assert_allclose(stats[source.MIN], np.array([200.0, -299.0]) * gains)
+        np.testing.assert_allclose(stats[source.MAX], np.array([299.0, -200.0]) * gains)
+        self.assertEqual(source.read(), tuple(stats[source.MEAN]))
+        np.testing.assert_array_equal(source.ring.latest(250)[0], np.arange(50.0, 300.0))
+        reader.stop(source)
+        self.assertTrue(reader.closed)
+
+    def test_statistics_are_a_copy(self):
+        reader = BlockingReader(signal=ramp)
+        source = ContinuousPressureSource(reader, block_size=10)
+        reader.step(source)
+        stats = source.statistics()
+        first = stats.copy()
+        reader.step(source)
+        reader.step(source)
+        np.testing.assert_array_equal(stats, first)
+        self.assertGreater(source.statistics()[source.MEAN][0], first[source.MEAN][0])
+        reader.stop(source)
+
+    def test_statistics_are_consistent_while_streaming(self):
+        source = ContinuousPressureSource(SyntheticReader(signal=ramp, rate=1e6, realtime=False), block_size=50)
+        for _ in range(2000):
+            stats = source.statistics()
+            # In every block channel 1 is the negative of channel 0
+            np.testing.assert_allclose(stats[source.MEAN][1] / PRESSURE_GAINS[1],
+                                       -stats[source.MEAN][0] / PRESSURE_GAINS[0])
+        source.close()
+
+    def test_reader_errors_are_raised(self):
+        source = ContinuousPressureSource(FailingReader())
+        with self.assertRaises(OSError):
+            source.read()
+        source.close()
+
+    def test_static_source(self):
+        self.assertEqual(StaticPressureSource((1.0, 2.0)).read(), (1.0, 2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Binary data log: round trip, damaged ends of file and the flush interval.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from datalog import BinaryLogWriter, LogFormatError, export_csv, read_log
+
+COLUMNS = ('Time', 'Sample Temperature (C)', 'Pressure 1 (mbar)')
+METADATA = [('SAMPLE', 'S1'), ('SETUP', 'Ramp Rate=10 C/minute'), ('NOTES', '')]
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def data_rows(blocks):
+    return np.concatenate([block for kind, block in blocks if kind == 'data'])
+
+
+class BinaryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'S1_Run.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_run(self, **kwargs):
+        with BinaryLogWriter(self.path, COLUMNS, METADATA, chunk_size=4, **kwargs) as log:
+            log.write((0.0, 21.5, 1.0))
+            log.segment('Cycle 0 BEGIN')
+            for i in range(1, 10):
+                log.write((float(i), 21.5 + i, 1.0 + 0.125 * i))
+            log.segment('Cycle 0 END')
+            log.write((10.0, 31.5, 2.25))
+
+    def test_round_trip(self):
+        self.write_run()
+        columns, metadata, blocks = read_log(self.path)
+        self.assertEqual(columns, COLUMNS)
+        self.assertEqual(metadata, METADATA)
+        self.assertEqual([block for kind, block in blocks if kind == 'segment'], ['Cycle 0 BEGIN', 'Cycle 0 END'])
+        rows = data_rows(blocks)
+        self.assertEqual(rows.shape, (11, 3))
+        np.testing.assert_array_equal(rows[:, 0], np.arange(11.0))
+        self.assertEqual(rows[5, 2], 1.625)
+
+    def test_segments_keep_their_place(self):
+        self.write_run()
+        kinds = [(kind, len(block) if kind == 'data' else block) for kind, block in read_log(self.path)[2]]
+        self.assertEqual(kinds, [('data', 1), ('segment', 'Cycle 0 BEGIN'), ('data', 4), ('data', 4), ('data', 1),
+                                 ('segment', 'Cycle 0 END'), ('data', 1)])
+
+    def test_export_csv_matches_the_text_layout(self):
+        with BinaryLogWriter(self.path, COLUMNS, METADATA) as log:
+            log.write((0.0, 21.5, 1.0))
+            log.segment('Cycle 0 BEGIN')
+            log.write((1.0, 22.25, 1.5))
+        output = os.path.join(self.directory, 'S1_Run.dat')
+        export_csv(self.path, output)
+        with open(output) as file:
+            self.assertEqual(file.read(), 'SAMPLE: S1\nSETUP: Ramp Rate=10 C/minute\nNOTES:\n\nDATA:\n'
+                                          'Time,Sample Temperature (C),Pressure 1 (mbar)\n'
+                                          '0.0,21.5,1.0\nINFO: Cycle 0 BEGIN\n1.0,22.25,1.5\n')
+
+    def test_truncated_last_block_ends_the_file(self):
+        self.write_run()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as file:
+            file.truncate(size - 5)
+        rows = data_rows(read_log(self.path)[2])
+        self.assertEqual(rows.shape, (10, 3))
+
+    def test_corrupted_last_block_ends_the_file(self):
+        self.write_run()
+        with open(self.path, 'r+b') as file:
+            file.seek(-8, os.SEEK_END)
+            byte = file.read(1)
+            file.seek(-8, os.SEEK_END)
+            file.write(bytes([byte[0] ^ 0xFF]))
+        rows = data_rows(read_log(self.path)[2])
+        self.assertEqual(rows[-1, 0], 9.0)
+
+    def test_append_drops_the_damaged_block(self):
+        self.write_run()
+        with open(self.path, 'ab') as file:
+            file.write(b'D\x10\x00')
+        with BinaryLogWriter(self.path, COLUMNS, append=True) as log:
+            log.write((11.0, 32.5, 2.375))
+        columns, metadata, blocks = read_log(self.path)
+        self.assertEqual(metadata, METADATA)
+        np.testing.assert_array_equal(data_rows(blocks)[:, 0], np.arange(12.0))
+
+    def test_append_checks_the_columns(self):
+        self.write_run()
+        with self.assertRaises(LogFormatError):
+            BinaryLogWriter(self.path, COLUMNS[:2], append=True)
+
+    def test_not_a_log(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'Time,Temperature\n')
+        with self.assertRaises(LogFormatError):
+            read_log(self.path)
+
+    def test_records_wait_at_most_the_flush_interval(self):
+        clock = Clock()
+        log = BinaryLogWriter(self.path, COLUMNS, chunk_size=1000, flush_interval=10.0, clock=clock)
+        log.write((0.0, 21.5, 1.0))
+        clock.now = 5.0
+        log.write((5.0, 21.5, 1.0))
+        log.pending.join()
+        self.assertEqual(read_log(self.path)[2], [])
+
+        clock.now = 10.0
+        log.write((10.0, 21.5, 1.0))
+        log.pending.join()
+        self.assertEqual(len(data_rows(read_log(self.path)[2])), 3)
+        log.close()
+
+    def test_write_errors_are_raised(self):
+        log = BinaryLogWriter(self.path, COLUMNS, chunk_size=1)
+        self.addCleanup(log.file.close)
+
+        def fail(kind, payload):
+            raise OSError('No space left on device')
+        log.write_block = fail
+        log.write((0.0, 21.5, 1.0))
+        log.pending.join()
+        with self.assertRaises(OSError):
+            log.write((1.0, 21.5, 1.0))
+        with self.assertRaises(OSError):
+            log.flush()
+        self.assertEqual(log.free.qsize() + 1, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
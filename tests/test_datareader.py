@@ -0,0 +1,53 @@
+"""
+Parsing of .dat segments, including records that were cut short or garbled.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from datareader import DataFile
+
+HEADER = 'SAMPLE: S1\n\nDATA:\nTime,Pressure,Sample Temperature (C)\n'
+
+
+class DataFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'S1_Run.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def data_file(self, records):
+        with open(self.path, 'w') as file:
+            file.write(HEADER + records)
+        return DataFile(self.path, use_index_file=False)
+
+    def test_segments_and_columns(self):
+        with self.data_file('INFO: Cycle BEGIN\n0,1.5,20\nINFO: Soak BEGIN\n1,1.6,21\n2,1.7,22\nINFO: Soak END\n'
+                            'INFO: Cycle END\n3,1.8,23\n') as data:
+            np.testing.assert_array_equal(data.read('Cycle'), [[0, 1.5, 20], [1, 1.6, 21], [2, 1.7, 22]])
+            np.testing.assert_array_equal(data.read('Cycle/Soak', columns=('Sample Temperature (C)', 'Time')),
+                                          [[21, 1], [22, 2]])
+            self.assertEqual(data.read(columns=('Time',)).shape, (4, 1))
+
+    def test_malformed_records_do_not_shift_the_rows(self):
+        with self.data_file('0,1.5,20\n1,1.6\n2,1.7,22,9\n3,x,23\n4,1.9,24\n5,2.0') as data:
+            values = data.read()
+            self.assertEqual(data.rejected, 3)
+        np.testing.assert_array_equal(values[:, 0], [0, 3, 4])
+        np.testing.assert_array_equal(values[:, 2], [20, 23, 24])
+        self.assertTrue(np.isnan(values[1, 1]))
+
+    def test_empty_segment(self):
+        with self.data_file('INFO: Ramp BEGIN\nINFO: Ramp END\n') as data:
+            self.assertEqual(data.read('Ramp', columns=('Time', 'Pressure')).shape, (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
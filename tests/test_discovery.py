@@ -0,0 +1,229 @@
+"""
+Instrument discovery against emulated instruments on a fake resource manager.
+
+    python -m unittest discover -s tests -t .
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from discovery import Discovery, DiscoveryError, SerialProfile
+from emulator import LS218Emulator, LS350Emulator
+
+try:
+    import visa
+except ImportError:
+    visa = None
+
+
+def emulator(emulator_class, serial_number):
+    instrument = emulator_class()
+    instrument.idn = 'LSCI,{},{},1.0'.format(instrument.idn.split(',')[1], serial_number)
+    return instrument
+
+
+class Port(object):
+    """An open resource, answering only when it is configured with the baud rate of the instrument (if any)."""
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+        self.timeout = 2000
+        self.baud_rate = None
+
+    def query(self, message):
+        if self.address not in self.bus.instruments:
+            raise TimeoutError('Nothing connected to {}'.format(self.address))
+        instrument, baud_rate = self.bus.instruments[self.address]
+        if baud_rate is not None and self.baud_rate != baud_rate:
+            raise TimeoutError('Wrong serial settings')
+        if self.bus.barrier is not None:
+            self.bus.barrier.wait()
+        return instrument.query(message)
+
+    def close(self):
+        pass
+
+
+class Bus(object):
+    """The instruments connected to the host, by address."""
+    def __init__(self, instruments, barrier=None):
+        """:param instruments: address -> (emulator, baud rate or None)"""
+        self.instruments = instruments
+        self.addresses = list(instruments)
+        self.barrier = barrier
+        self.opened = []
+        self.lock = threading.Lock()
+
+
+class ResourceManager(object):
+    def __init__(self, bus):
+        self.bus = bus
+        self.threads = set()
+        self.closed = False
+
+    def list_resources(self):
+        return tuple(self.bus.addresses)
+
+    def open_resource(self, address):
+        with self.bus.lock:
+            self.bus.opened.append(address)
+            self.threads.add(threading.current_thread().name)
+        return Port(self.bus, address)
+
+    def close(self):
+        self.closed = True
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, 'instruments.json')
+        self.clock = Clock()
+        self.bus = Bus({'GPIB0::12::INSTR': (emulator(LS350Emulator, 'LSA0350'), None),
+                        'GPIB0::13::INSTR': (emulator(LS218Emulator, 'LSA0218'), None),
+                        'GPIB0::14::INSTR': (LS350Emulator(), None)})
+        self.bus.instruments['GPIB0::14::INSTR'][0].idn = 'LSCI,MODEL336,LSA0336,1.0'
+        self.bus.addresses.append('GPIB0::15::INSTR')  # Nothing connected
+        self.managers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def discovery(self, **kwargs):
+        def rm_factory():
+            manager = ResourceManager(self.bus)
+            self.managers.append(manager)
+            return manager
+        self.rm = ResourceManager(self.bus)
+        kwargs.setdefault('profiles', ())
+        return Discovery(self.rm, cache_path=self.cache_path, rm_factory=rm_factory, clock=self.clock, **kwargs)
+
+    def opened(self):
+        opened = list(self.bus.opened)
+        del self.bus.opened[:]
+        return opened
+
+    def test_driver_selected_from_the_model(self):
+        instruments = {instrument.address: instrument for instrument in self.discovery().scan()}
+
+        self.assertEqual(sorted(instruments), ['GPIB0::12::INSTR', 'GPIB0::13::INSTR', 'GPIB0::14::INSTR'])
+        self.assertIs(instruments['GPIB0::12::INSTR'].driver_class, LS350_Driver)
+        self.assertEqual(instruments['GPIB0::12::INSTR'].serial_number, 'LSA0350')
+        self.assertIs(instruments['GPIB0::13::INSTR'].driver_class, LS218_Driver)
+        self.assertIsNone(instruments['GPIB0::14::INSTR'].driver_class)
+
+    def test_connect(self):
+        discovery = self.discovery()
+        LS218 = discovery.connect(model='MODEL218S')
+        self.assertIsInstance(LS218, LS218_Driver)
+        self.assertEqual(LS218.instrument.address, 'GPIB0::13::INSTR')
+
+        with self.assertRaises(DiscoveryError):
+            discovery.connect(model='MODEL336')
+        with self.assertRaises(DiscoveryError):
+            discovery.connect(model='MODEL372')
+
+    def test_probes_run_in_parallel_on_their_own_managers(self):
+        # Every probe waits at the barrier for the others, probes one after the other would never get through it
+        self.bus.barrier = threading.Barrier(3, timeout=5)
+        self.assertEqual(len(self.discovery(max_workers=4).scan()), 3)
+
+        self.assertEqual(self.rm.threads, set())
+        self.assertTrue(self.managers)
+        for manager in self.managers:
+            self.assertEqual(len(manager.threads), 1)
+            self.assertTrue(manager.closed)
+
+    def test_cache_reused(self):
+        self.discovery().scan()
+        with open(self.cache_path) as file:
+            cache = json.load(file)
+        self.assertIn('GPIB0::12::INSTR#LSA0350', cache['instruments'])
+        self.assertEqual(list(cache['silent']), ['GPIB0::15::INSTR'])
+        self.opened()
+
+        instruments = self.discovery().scan()
+        self.assertEqual(self.opened(), [])
+        self.assertEqual(sorted(instrument.serial_number for instrument in instruments),
+                         ['LSA0218', 'LSA0336', 'LSA0350'])
+
+    def test_mismatched_cache_entry_probed_again(self):
+        self.discovery().scan()
+        with open(self.cache_path) as file:
+            cache = json.load(file)
+        cache['instruments']['GPIB0::12::INSTR#LSA9999'] = cache['instruments'].pop('GPIB0::12::INSTR#LSA0350')
+        with open(self.cache_path, 'w') as file:
+            json.dump(cache, file)
+        self.opened()
+
+        with self.assertLogs(level='WARNING'):
+            self.discovery().scan()
+        self.assertEqual(self.opened(), ['GPIB0::12::INSTR'])
+
+    def test_silent_port_probed_again_after_ttl(self):
+        self.discovery(silent_ttl=600).scan()
+        self.opened()
+        self.bus.instruments['GPIB0::15::INSTR'] = (emulator(LS350Emulator, 'LSA0351'), None)
+
+        self.clock.now += 300
+        self.assertEqual(len(self.discovery(silent_ttl=600).scan()), 3)
+        self.assertEqual(self.opened(), [])
+
+        self.clock.now += 301
+        instruments = self.discovery(silent_ttl=600).scan()
+        self.assertEqual(self.opened(), ['GPIB0::15::INSTR'])
+        self.assertIn('LSA0351', [instrument.serial_number for instrument in instruments])
+
+    def test_moved_instrument_found_again(self):
+        self.discovery().scan()
+        self.bus.instruments['GPIB0::15::INSTR'] = self.bus.instruments.pop('GPIB0::12::INSTR')
+
+        discovery = self.discovery()
+        discovery.scan()
+        self.opened()
+        LS350 = discovery.connect(model='MODEL350', serial_number='LSA0350')
+
+        self.assertEqual(LS350.instrument.address, 'GPIB0::15::INSTR')
+        self.assertIn('GPIB0::12::INSTR', self.opened())
+        self.assertEqual(discovery.find(serial_number='LSA0350').address, 'GPIB0::15::INSTR')
+        with open(self.cache_path) as file:
+            self.assertIn('GPIB0::15::INSTR#LSA0350', json.load(file)['instruments'])
+
+
+@unittest.skipIf(visa is None, 'pyvisa is needed to apply serial settings')
+class SerialProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = Bus({'ASRL3::INSTR': (emulator(LS350Emulator, 'LSA0350'), 9600)})
+        self.profiles = (SerialProfile(56000), SerialProfile(9600), SerialProfile(57600))
+
+    def test_profiles_tried_in_turn(self):
+        rm = ResourceManager(self.bus)
+        discovery = Discovery(rm, self.profiles, cache_path=None, rm_factory=lambda: rm)
+        (instrument,) = discovery.scan()
+        self.assertEqual(instrument.profile, SerialProfile(9600))
+        self.assertEqual(self.bus.opened, ['ASRL3::INSTR'] * 2)
+
+    def test_known_profile_tried_first(self):
+        rm = ResourceManager(self.bus)
+        discovery = Discovery(rm, self.profiles, cache_path=None, rm_factory=lambda: rm)
+        discovery.scan()
+        del self.bus.opened[:]
+        discovery.scan(refresh=True)
+        self.assertEqual(self.bus.opened, ['ASRL3::INSTR'])
+
+
+if __name__ == '__main__':
+    unittest.main()
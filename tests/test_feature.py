@@ -0,0 +1,69 @@
+"""
+Feature shadow values and transactions of the drivers, against the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from emulator import LS218Emulator, LS350Emulator
+from pacing import NullPacer
+
+
+class DriverTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.LS350 = LS350_Driver(self.emulator)
+        self.LS350.pacer = NullPacer()
+
+    def sent(self):
+        """Messages received by the emulator since the last call."""
+        sent = list(self.emulator.received)
+        del self.emulator.received[:]
+        return sent
+
+
+class ShadowTest(DriverTest):
+    def test_transaction_sends_only_changes(self):
+        self.LS350.setpoint[1] = 300.0
+        self.sent()
+        with self.LS350.transaction():
+            self.LS350.setpoint[1] = 300.0
+            self.LS350.heater_range[1] = 2
+            self.LS350.heater_range[1] = 3
+        self.assertEqual(self.sent(), ['RANGE 1,3'])
+        self.assertEqual(self.LS350.get_heater_range(1), 3)
+
+    def test_direct_write_evicts_the_shadow_value(self):
+        self.LS350.setpoint[1] = 300.0
+        self.LS350.set_setpoint_celsius(1, 30.0)
+        self.sent()
+        with self.LS350.transaction():
+            self.LS350.setpoint[1] = 300.0
+        self.assertEqual(self.sent(), ['SETP 1,300.0'])
+        self.assertEqual(self.LS350.get_setpoint(1), 300.0)
+
+    def test_failed_transaction_sends_nothing(self):
+        self.LS350.setpoint[1] = 300.0
+        self.sent()
+        with self.assertRaises(ValueError):
+            with self.LS350.transaction():
+                self.LS350.setpoint[1] = 310.0
+                raise ValueError()
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(self.LS350.get_setpoint(1), 300.0)
+
+    def test_reset_evicts_the_shadow_values(self):
+        emulator = LS218Emulator()
+        LS218 = LS218_Driver(emulator)
+        LS218.pacer = NullPacer()
+        LS218.audible_alarm = 0
+        LS218.reset_instrument()
+        with LS218.transaction():
+            LS218.audible_alarm = 0
+        self.assertEqual(emulator.received.count('ALMB 0'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+"""
+Multi-resolution sample history: rings, buckets, level selection and LTTB decimation.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+import numpy as np
+
+import measurement
+from history import BucketLevel, History, TimeRing, lttb
+from station import COLUMNS
+
+
+class TimeRingTest(unittest.TestCase):
+    def ring(self, times):
+        ring = TimeRing(4, 2)
+        for t in times:
+            ring.append((t, 10 * t))
+        return ring
+
+    def test_before_wraparound(self):
+        ring = self.ring([1, 2, 3])
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.oldest, 1)
+        np.testing.assert_array_equal(ring.range(2, 3)[:, 0], [2, 3])
+
+    def test_wraparound(self):
+        ring = self.ring(range(1, 8))
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.oldest, 4)
+        np.testing.assert_array_equal(ring.range()[:, 0], [4, 5, 6, 7])
+        np.testing.assert_array_equal(ring.range()[:, 1], [40, 50, 60, 70])
+        # The range spans the end of the storage and its start
+        np.testing.assert_array_equal(ring.range(4.5, 6)[:, 0], [5, 6])
+
+    def test_count_range_matches_range(self):
+        ring = self.ring(range(1, 7))
+        for start, end in ((-np.inf, np.inf), (3, 5), (3.5, 4.5), (5, 6), (7, 9), (0, 2)):
+            self.assertEqual(ring.count_range(start, end), len(ring.range(start, end)), (start, end))
+
+    def test_empty(self):
+        ring = TimeRing(4, 2)
+        self.assertEqual(ring.oldest, np.inf)
+        self.assertEqual(ring.range().shape, (0, 2))
+        self.assertEqual(ring.count_range(), 0)
+
+
+class BucketLevelTest(unittest.TestCase):
+    def test_aggregation(self):
+        level = BucketLevel(10.0, 8, 2)
+        for t, values in ((0, (1.0, 5.0)), (4, (3.0, 1.0)), (9.5, (2.0, 3.0)), (10, (7.0, 7.0)), (25, (4.0, 4.0))):
+            level.add(t, np.array(values))
+
+        buckets = level.split(level.range())
+        np.testing.assert_array_equal(buckets['time'], [0, 10, 20])
+        np.testing.assert_array_equal(buckets['count'], [3, 1, 1])
+        np.testing.assert_array_equal(buckets['mean'][0], [2.0, 3.0])
+        np.testing.assert_array_equal(buckets['min'][0], [1.0, 1.0])
+        np.testing.assert_array_equal(buckets['max'][0], [3.0, 5.0])
+        np.testing.assert_array_equal(buckets['mean'][2], [4.0, 4.0])
+
+    def test_current_bucket(self):
+        level = BucketLevel(10.0, 8, 1)
+        level.add(3, np.array([1.0]))
+        self.assertEqual(len(level.ring), 0)
+        self.assertEqual(level.oldest, 0)
+        self.assertEqual(len(level.range()), 1)
+        self.assertEqual(len(level.range(include_current=False)), 0)
+        self.assertEqual(level.count_range(), 1)
+        self.assertEqual(level.count_range(5, 20), 0)
+
+    def test_count_range_matches_range(self):
+        level = BucketLevel(1.0, 4, 1)
+        for t in np.arange(0, 6.5, 0.5):
+            level.add(t, np.array([t]))
+        for start, end in ((-np.inf, np.inf), (1, 3), (5, 6), (6, 7), (0, 1)):
+            self.assertEqual(level.count_range(start, end), len(level.range(start, end)), (start, end))
+
+
+class HistoryTest(unittest.TestCase):
+    def history(self, n, raw_capacity=100):
+        history = History(('Time', 'T'), raw_capacity=raw_capacity, resolutions=((10.0, 100), (100.0, 100)))
+        for t in range(n):
+            history.add((t, np.sin(t / 10.0)))
+        return history
+
+    def test_raw_when_it_fits(self):
+        resolution, data = self.history(50).query(0, 49, max_points=50)
+        self.assertIsNone(resolution)
+        self.assertEqual(len(data), 50)
+
+    def test_same_limit_for_every_level(self):
+        # 50 raw records are too many for 49 points, the 5 buckets of 10 s fit exactly, the one being filled included
+        history = self.history(50)
+        self.assertEqual(history.query(0, 49, max_points=49)[0], 10.0)
+        resolution, data = history.query(0, 49, max_points=5)
+        self.assertEqual(resolution, 10.0)
+        self.assertEqual(len(data['time']), 5)
+        self.assertEqual(history.query(0, 49, max_points=4)[0], 100.0)
+        # Before the bucket being filled: the 4 buckets of (0, 39) fit in 4 points like 4 raw records would
+        self.assertEqual(history.query(0, 39, max_points=4)[0], 10.0)
+        self.assertIsNone(history.query(0, 3, max_points=4)[0])
+
+    def test_raw_records_dropped_fall_back_to_buckets(self):
+        history = self.history(300, raw_capacity=100)
+        self.assertEqual(history.records()[0, 0], 200)
+        resolution, data = history.query(0, 299, max_points=1000)
+        self.assertEqual(resolution, 10.0)
+        self.assertEqual(data['count'].sum(), 300)
+
+    def test_decimate(self):
+        t, y = self.history(1000, raw_capacity=1000).decimate('T', 0, 999, 100)
+        self.assertEqual(len(t), 100)
+        self.assertEqual((t[0], t[-1]), (0, 999))
+        with self.assertRaises(ValueError):
+            self.history(10).decimate('Time', 0, 9, 5)
+
+    def test_measurement_settings(self):
+        config = measurement.configuration(history_raw_capacity=10, history_resolutions=((1.0, 5),))
+        history = measurement.make_history(config)
+        self.assertEqual(history.columns, COLUMNS)
+        self.assertEqual(history.raw.capacity, 10)
+        self.assertEqual([(level.width, level.ring.capacity) for level in history.levels], [(1.0, 5)])
+
+
+class LTTBTest(unittest.TestCase):
+    def test_endpoints_and_size(self):
+        x = np.arange(1000.0)
+        y = np.random.RandomState(1).normal(size=1000)
+        for n_points in (3, 10, 257, 999):
+            xs, ys = lttb(x, y, n_points)
+            self.assertEqual(len(xs), n_points)
+            self.assertEqual((xs[0], xs[-1]), (0, 999))
+            self.assertTrue(np.all(np.diff(xs) > 0))
+            np.testing.assert_array_equal(ys, y[xs.astype(int)])
+
+    def test_peaks_kept(self):
+        x = np.arange(1000.0)
+        y = np.zeros(1000)
+        y[[123, 456, 789]] = (5.0, -4.0, 3.0)
+        xs, ys = lttb(x, y, 20)
+        for peak in (123, 456, 789):
+            self.assertIn(peak, xs)
+
+    def test_short_series_returned_as_is(self):
+        xs, ys = lttb([0, 1, 2], [5, 6, 7], 10)
+        np.testing.assert_array_equal(xs, [0, 1, 2])
+        with self.assertRaises(ValueError):
+            lttb(np.arange(10), np.arange(10), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Per-command metrics: histogram bucketing, error attribution, utilization and the Prometheus text format.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from instrumentation import DriverMetrics, Histogram, prometheus
+from pacing import NullPacer
+from processors import ProcessorError
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class HistogramTest(unittest.TestCase):
+    def test_bucketing(self):
+        histogram = Histogram(bounds=(0.001, 0.01, 0.1))
+        for value in (0.0005, 0.001, 0.002, 0.01, 0.05, 0.5):
+            histogram.observe(value)
+
+        # A value equal to a bound counts into that bound's bucket (le), the last bucket takes the rest
+        self.assertEqual(histogram.counts, [2, 2, 1, 1])
+        self.assertEqual(list(histogram.cumulative_counts()),
+                         [(0.001, 2), (0.01, 4), (0.1, 5), (float('inf'), 6)])
+        self.assertEqual(histogram.count, 6)
+        self.assertAlmostEqual(histogram.sum, 0.5635)
+
+    def test_quantile(self):
+        histogram = Histogram(bounds=(1.0, 2.0, 4.0))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+        # Two of the four values are in (1, 2], the median is interpolated to the middle of that bucket
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.5)
+        self.assertAlmostEqual(histogram.quantile(1.0), 4.0)
+
+        histogram.observe(10.0)
+        self.assertEqual(histogram.quantile(1.0), 4.0)
+
+    def test_snapshot(self):
+        histogram = Histogram(bounds=(1.0,))
+        histogram.observe(0.5)
+        histogram.observe(1.5)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 2)
+        self.assertEqual(snapshot['mean'], 1.0)
+        self.assertEqual(snapshot['buckets'], [(1.0, 1), (float('inf'), 2)])
+
+
+class DriverMetricsTest(unittest.TestCase):
+    def test_utilization(self):
+        clock = Clock()
+        metrics = DriverMetrics('LS350', clock=clock)
+        metrics.transaction('KRDG?', 0.02, 0.05)
+        metrics.transaction('SETP', 0.03, 0.05)
+        metrics.processing('KRDG?', 0.001)
+        clock.now = 1.0
+
+        self.assertAlmostEqual(metrics.duty_cycle(), 0.05)
+        self.assertAlmostEqual(metrics.occupancy(), 0.15)
+        self.assertAlmostEqual(metrics.host_load(), 0.001)
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()['commands'], {})
+        self.assertEqual(metrics.duty_cycle(), 0.0)
+
+
+class DriverInstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.LS350 = LS350_Driver(self.emulator)
+        self.LS350.pacer = NullPacer()
+        self.metrics = self.LS350.enable_metrics('LS350')
+
+    def test_off_by_default(self):
+        LS350 = LS350_Driver(LS350Emulator())
+        LS350.pacer = NullPacer()
+        LS350.get_kelvin_reading('A')
+        self.assertIsNone(LS350.metrics)
+
+    def test_counts_per_command(self):
+        for _ in range(3):
+            self.LS350.get_kelvin_reading('A')
+        self.LS350.get_setpoint(1)
+
+        commands = self.metrics.snapshot()['commands']
+        self.assertEqual(commands['KRDG?']['count'], 3)
+        self.assertEqual(commands['KRDG?']['transport']['count'], 3)
+        self.assertEqual(commands['KRDG?']['processing']['count'], 3)
+        self.assertEqual(commands['SETP?']['count'], 1)
+        self.assertEqual(commands['KRDG?']['errors'], 0)
+
+    def test_batch_counted_as_compound_command(self):
+        with self.LS350.batch() as batch:
+            batch.get_setpoint(1)
+            batch.get_setpoint(2)
+        self.assertEqual(self.metrics.snapshot()['commands']['SETP?;SETP?']['count'], 1)
+
+    def test_unparsable_reply_counted_against_its_command(self):
+        self.emulator.handlers['KRDG?'] = lambda emulator, *parameters: 'not a number'
+        with self.assertRaises(ProcessorError):
+            self.LS350.get_kelvin_reading('A')
+        self.LS350.get_setpoint(1)
+
+        commands = self.metrics.snapshot()['commands']
+        self.assertEqual(commands['KRDG?']['errors'], 1)
+        self.assertEqual(commands['SETP?']['errors'], 0)
+
+    def test_transport_error_counted(self):
+        def fail(message):
+            raise TimeoutError('No reply')
+        self.emulator.query = fail
+        with self.assertRaises(TimeoutError):
+            self.LS350.get_setpoint(1)
+        commands = self.metrics.snapshot()['commands']
+        self.assertEqual(commands['SETP?']['errors'], 1)
+        self.assertEqual(commands['SETP?']['transport']['count'], 1)
+
+
+class PrometheusTest(unittest.TestCase):
+    def test_text_format(self):
+        clock = Clock()
+        metrics = DriverMetrics('LS350 "A"', clock=clock)
+        metrics.transaction('KRDG?', 0.02, 0.0)
+        metrics.processing('KRDG?', 0.0001)
+        metrics.error('KRDG?')
+        clock.now = 2.0
+
+        lines = prometheus(metrics).splitlines()
+        labels = 'instrument="LS350 \\"A\\"",command="KRDG?"'
+
+        self.assertIn('# TYPE pyinstr_commands_total counter', lines)
+        self.assertIn('pyinstr_commands_total{{{}}} 1'.format(labels), lines)
+        self.assertIn('pyinstr_command_errors_total{{{}}} 1'.format(labels), lines)
+        self.assertIn('# TYPE pyinstr_transport_seconds histogram', lines)
+        self.assertIn('pyinstr_transport_seconds_bucket{{{},le="0.01"}} 0'.format(labels), lines)
+        self.assertIn('pyinstr_transport_seconds_bucket{{{},le="0.025"}} 1'.format(labels), lines)
+        self.assertIn('pyinstr_transport_seconds_bucket{{{},le="+Inf"}} 1'.format(labels), lines)
+        self.assertIn('pyinstr_transport_seconds_sum{{{}}} 0.02'.format(labels), lines)
+        self.assertIn('pyinstr_transport_seconds_count{{{}}} 1'.format(labels), lines)
+        self.assertIn('# TYPE pyinstr_bus_duty_cycle gauge', lines)
+        self.assertIn('pyinstr_bus_duty_cycle{instrument="LS350 \\"A\\""} 0.01', lines)
+
+        # Every sample line is a metric name with labels and a value, each metric announced before its samples
+        announced = set()
+        for line in lines:
+            if line.startswith('# TYPE'):
+                announced.add(line.split()[2])
+            elif not line.startswith('#'):
+                name = line.split('{', 1)[0]
+                self.assertTrue(any(name == metric or name.startswith(metric + '_') for metric in announced), line)
+                float(line.rsplit(' ', 1)[1].replace('+Inf', 'inf'))
+
+    def test_several_drivers_and_prefix(self):
+        text = prometheus(DriverMetrics('LS350'), DriverMetrics('LS218'), prefix='lab')
+        self.assertIn('lab_host_load{instrument="LS350"}', text)
+        self.assertIn('lab_host_load{instrument="LS218"}', text)
+        self.assertEqual(text.count('# TYPE lab_host_load gauge'), 1)
+        self.assertTrue(text.endswith('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
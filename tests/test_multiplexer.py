@@ -0,0 +1,91 @@
+"""
+Drivers sharing one resource through a ResourceMultiplexer, against the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import threading
+import unittest
+
+from LS218_Driver import LS218_Driver
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from multiplexer import ResourceMultiplexer
+from pacing import NullPacer
+
+
+class RecoveringResource(object):
+    """Resource with a recover() that records the thread it runs on."""
+    def __init__(self, resource):
+        self.resource = resource
+        self.recovered = []
+
+    def recover(self, attempt):
+        self.recovered.append((attempt, threading.current_thread().name))
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+
+class MultiplexerTest(unittest.TestCase):
+    def setUp(self):
+        self.emulator = LS350Emulator()
+        self.multiplexer = ResourceMultiplexer(self.emulator, pacer=NullPacer())
+        self.first = self.multiplexer.driver(LS350_Driver)
+        self.second = self.multiplexer.driver(LS350_Driver)
+
+    def tearDown(self):
+        self.multiplexer.close()
+
+    def test_drivers_share_the_cache(self):
+        self.first.get_pid(1)
+        self.second.get_pid(1)
+        self.assertEqual(self.emulator.received.count('PID? 1'), 1)
+
+    def test_write_on_one_driver_evicts_for_the_other(self):
+        self.first.get_pid(1)
+        self.second.set_pid(1, 80, 30, 0)
+        self.assertEqual(self.first.get_pid(1)['P'], 80)
+
+    def test_write_on_one_driver_evicts_the_shadow_of_the_other(self):
+        self.first.setpoint[1] = 300.0
+        self.second.set_setpoint(1, 310.0)
+        with self.first.transaction():
+            self.first.setpoint[1] = 300.0
+        self.assertEqual(self.first.get_setpoint(1), 300.0)
+
+    def test_driver_classes_keep_separate_caches(self):
+        # Both classes have a cached identification(), one must not be served the other's result
+        LS218 = self.multiplexer.driver(LS218_Driver)
+        self.first.identification()
+        LS218.identification()
+        self.second.identification()
+        self.assertEqual(self.emulator.received.count('*IDN?'), 2)
+        self.assertIsNot(LS218.cache, self.first.cache)
+        self.assertIsNot(LS218.shadow, self.first.shadow)
+
+
+class MultiplexerRecoverTest(unittest.TestCase):
+    def test_recover_runs_on_the_worker(self):
+        emulator = LS350Emulator()
+        resource = RecoveringResource(emulator)
+        multiplexer = ResourceMultiplexer(resource, pacer=NullPacer())
+        LS350 = multiplexer.driver(LS350_Driver)
+        replies = iter(['garbled', '+295.000'])
+        emulator.handlers['KRDG?'] = lambda emulator, *parameters: next(replies)
+        try:
+            self.assertEqual(LS350.get_kelvin_reading('A'), 295.0)
+        finally:
+            multiplexer.close()
+        self.assertEqual(resource.recovered, [(1, multiplexer.thread.name)])
+
+    def test_recover_without_resilient_resource(self):
+        multiplexer = ResourceMultiplexer(LS350Emulator(), pacer=NullPacer())
+        try:
+            self.assertFalse(multiplexer.channel().recover(1))
+        finally:
+            multiplexer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Adaptive pacing, on its own with a simulated clock and on a driver talking to the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from pacing import AdaptivePacer, EEPROM, NullPacer, QUERY, WRITE
+
+
+class Clock(object):
+    """Simulated time, advanced by the pacer's sleep."""
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class AdaptivePacerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.pacer = AdaptivePacer(wait_time=0.06, minimum=0.01, clock=self.clock, sleep=self.clock.sleep)
+
+    def transaction(self, command_class, failed=False):
+        self.pacer.wait(command_class)
+        self.pacer.completed()
+        if failed:
+            self.pacer.failure(command_class)
+        else:
+            self.pacer.success(command_class)
+
+    def test_never_shrinks_below_the_minimum(self):
+        for _ in range(100):
+            self.transaction(QUERY)
+        self.assertEqual(self.pacer.delays[QUERY], 0.01)
+        self.assertEqual(self.pacer.delays[EEPROM], 0.06)
+
+    def test_stays_one_step_above_the_last_failure(self):
+        for _ in range(8):
+            self.transaction(QUERY)
+        failed_at = self.pacer.delays[QUERY]
+        self.transaction(QUERY, failed=True)
+        for _ in range(50):
+            self.transaction(QUERY)
+        self.assertAlmostEqual(self.pacer.delays[QUERY], failed_at / 0.9)
+
+    def test_floor_is_at_most_the_initial_turnaround(self):
+        for _ in range(8):
+            self.transaction(QUERY, failed=True)
+        self.assertEqual(self.pacer.delays[QUERY], 1.0)
+        for _ in range(50):
+            self.transaction(QUERY)
+        self.assertEqual(self.pacer.delays[QUERY], 0.06)
+
+    def test_floor_relaxes_after_clean_transactions(self):
+        self.transaction(QUERY, failed=True)
+        for _ in range(5000):
+            self.transaction(QUERY)
+        self.assertEqual(self.pacer.floors[QUERY], 0.0)
+        self.assertEqual(self.pacer.delays[QUERY], 0.01)
+
+    def test_failure_restarts_the_clean_run(self):
+        relax_after = self.pacer.policies[QUERY].relax_after
+        self.transaction(QUERY, failed=True)
+        floor = self.pacer.floors[QUERY]
+        for _ in range(relax_after - 1):
+            self.transaction(QUERY)
+        self.transaction(QUERY, failed=True)
+        for _ in range(relax_after - 1):
+            self.transaction(QUERY)
+        self.assertEqual(self.pacer.floors[QUERY], floor)
+        self.assertEqual(self.pacer.delays[QUERY], floor)
+
+    def test_failure_penalises_the_previous_command_class(self):
+        self.transaction(WRITE)
+        write_delay = self.pacer.delays[WRITE]
+        self.transaction(QUERY, failed=True)
+        self.assertGreater(self.pacer.delays[WRITE], write_delay)
+
+    def test_waits_for_the_slower_of_two_command_classes(self):
+        self.pacer.delays[EEPROM] = 0.5
+        self.transaction(EEPROM)
+        self.clock.now += 0.1
+        remaining = self.pacer.delays[EEPROM] - 0.1
+        self.assertGreater(remaining, self.pacer.delays[QUERY])
+        self.assertAlmostEqual(self.pacer.remaining(QUERY), remaining)
+        self.transaction(QUERY)
+        self.assertAlmostEqual(self.clock.slept[-1], remaining)
+
+    def test_only_sleeps_what_is_left_of_the_turnaround(self):
+        self.transaction(QUERY)
+        self.clock.now += 0.02
+        delay = self.pacer.delays[QUERY]
+        self.transaction(QUERY)
+        self.assertAlmostEqual(self.clock.slept[-1], delay - 0.02)
+        self.clock.now += 1.0
+        self.transaction(QUERY)
+        self.assertEqual(len(self.clock.slept), 1)
+
+
+class DriverPacingTest(unittest.TestCase):
+    def test_garbled_replies_slow_the_driver_down(self):
+        clock = Clock()
+        LS350 = LS350_Driver(LS350Emulator(error_rate=1.0, errors=('garbled',)))
+        LS350.pacer = AdaptivePacer(wait_time=0.06, clock=clock, sleep=clock.sleep)
+        with self.assertRaises(Exception):
+            LS350.get_setpoint(1)
+        self.assertGreater(LS350.pacer.delays[QUERY], 0.06)
+
+    def test_minimum_turnaround_is_set_per_driver(self):
+        class SlowLS350(LS350_Driver):
+            minimum_turnaround = 0.04
+        self.assertEqual(SlowLS350(LS350Emulator()).pacer.policies[QUERY].minimum, 0.04)
+        self.assertEqual(LS350_Driver(LS350Emulator()).pacer.policies[QUERY].minimum,
+                         LS350_Driver.minimum_turnaround)
+
+    def test_null_pacer_never_waits(self):
+        pacer = NullPacer()
+        pacer.completed()
+        self.assertEqual(pacer.wait(QUERY), 0.0)
+        self.assertEqual(pacer.remaining(EEPROM), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Reply processors, on their own and on the *_reading_all queries of the emulated Model 218.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+
+import numpy as np
+
+from LS218_Driver import LS218_Driver
+from emulator import LS218Emulator
+from pacing import NullPacer
+from processors import ProcessCSV, ProcessInteger, ProcessorError, ProcessReal
+
+NAMES = ('high status', 'low status')
+
+
+class ScalarTest(unittest.TestCase):
+    def test_integer(self):
+        self.assertEqual(ProcessInteger()(' 3'), 3)
+        with self.assertRaises(ProcessorError):
+            ProcessInteger()('3.5')
+
+    def test_real(self):
+        self.assertEqual(ProcessReal()('+295.000'), 295.0)
+        with self.assertRaises(ProcessorError):
+            ProcessReal()('x#!')
+
+
+class ProcessCSVTest(unittest.TestCase):
+    def test_dict(self):
+        process = ProcessCSV(names=NAMES, processors=(ProcessInteger(), ProcessInteger()))
+        self.assertEqual(process('1, 0'), {'high status': 1, 'low status': 0})
+
+    def test_record(self):
+        record = ProcessCSV(names=NAMES, processors=(ProcessInteger(), ProcessInteger()), output='record')('1,0')
+        self.assertEqual((record.high_status, record.low_status), (1, 0))
+        self.assertEqual(tuple(record), (1, 0))
+
+    def test_array(self):
+        process = ProcessCSV(names=('A', 'B', 'C'), output='array')
+        self.assertTrue(process.vectorized)
+        np.testing.assert_array_equal(process('+295.000, -1.5E+01,+0.000'), [295.0, -15.0, 0.0])
+
+    def test_array_rejects_malformed_replies(self):
+        process = ProcessCSV(names=('A', 'B', 'C'), output='array')
+        for reply in ('+295.0,x#!,3', '1,,2', '1,2', '1,2,3,4', '1,2,', ''):
+            with self.assertRaises(ProcessorError, msg=reply):
+                process(reply)
+
+    def test_array_with_processors(self):
+        process = ProcessCSV(names=NAMES, processors=(ProcessInteger(), ProcessInteger()), output='array')
+        self.assertFalse(process.vectorized)
+        np.testing.assert_array_equal(process('1,0'), [1.0, 0.0])
+        with self.assertRaises(ProcessorError):
+            process('1')
+
+    def test_unknown_output(self):
+        with self.assertRaises(ValueError):
+            ProcessCSV(names=NAMES, output='list')
+
+
+class ReadingAllTest(unittest.TestCase):
+    def test_reading_all(self):
+        emulator = LS218Emulator()
+        LS218 = LS218_Driver(emulator)
+        LS218.pacer = NullPacer()
+        for input in range(1, 9):
+            emulator.set_temperature(input, 290.0 + input)
+        readings = LS218.get_kelvin_reading_all()
+        self.assertEqual(readings.shape, (8,))
+        np.testing.assert_allclose(readings, 290.0 + np.arange(1, 9))
+        np.testing.assert_allclose(LS218.get_celsius_reading_all(), readings - 273.15, atol=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
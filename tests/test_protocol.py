@@ -0,0 +1,144 @@
+"""
+Protocol runner: checkpoint/resume after an interrupted run, and the runtime estimate of a dry run.
+
+    python -m unittest discover -s tests -t .
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from protocol import DryRunStation, ProtocolError, ProtocolRunner, estimate_runtime, load_steps
+
+STEPS = [
+    {'type': 'segment', 'text': 'Cycle 0 BEGIN'},
+    {'type': 'ramp', 'output': 2, 'rate': 10},
+    {'type': 'settle', 'VTI': -95, 'sample': -95, 'band': 0.2, 'hold_time': 30, 'timeout': 3600},
+    {'type': 'soak', 'duration': 300},
+    {'type': 'segment', 'text': 'Cycle 0 END'},
+]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeStation(object):
+    """Records the operations of the protocol, optionally stopping the run partway through a soak."""
+    def __init__(self, interrupt_after=None):
+        """:param interrupt_after: seconds into a soak to raise Interrupted at, None to not interrupt"""
+        self.interrupt_after = interrupt_after
+        self.calls = []
+        self.flushes = 0
+
+    def segment(self, text):
+        self.calls.append(('segment', text))
+
+    def set_ramp(self, output, rate):
+        self.calls.append(('ramp', output, rate))
+
+    def set_temperature_and_settle(self, T_VTI, T_samp, T_range, settle_time, timeout, record=False):
+        self.calls.append(('settle', T_VTI, T_samp))
+        return True, 1.0
+
+    def soak(self, duration, record=True, progress=None, progress_interval=60):
+        self.calls.append(('soak', duration))
+        elapsed = 0
+        while elapsed + progress_interval <= duration:
+            elapsed += progress_interval
+            progress(elapsed)
+            if self.interrupt_after is not None and elapsed >= self.interrupt_after:
+                raise Interrupted()
+
+    def flush(self):
+        self.flushes += 1
+
+
+class ProtocolRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.directory, 'run.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_complete_run(self):
+        station = FakeStation()
+        ProtocolRunner(station, load_steps(STEPS), self.checkpoint_path).run()
+
+        self.assertEqual(station.calls, [('segment', 'Cycle 0 BEGIN'), ('ramp', 2, 10), ('settle', -95, -95),
+                                         ('soak', 300), ('segment', 'Cycle 0 END')])
+        self.assertGreater(station.flushes, 0)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_resume_skips_completed_steps(self):
+        station = FakeStation(interrupt_after=120)
+        with self.assertRaises(Interrupted):
+            ProtocolRunner(station, load_steps(STEPS), self.checkpoint_path).run()
+        with open(self.checkpoint_path) as file:
+            checkpoint = json.load(file)
+        self.assertEqual(checkpoint['step'], 3)
+        self.assertEqual(checkpoint['state'], {'elapsed': 120})
+
+        station = FakeStation()
+        ProtocolRunner(station, load_steps(STEPS), self.checkpoint_path).run()
+
+        # The segment, ramp and settle steps are not repeated and the soak only runs for the time that was left
+        self.assertEqual(station.calls, [('soak', 180), ('segment', 'Cycle 0 END')])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_segment_written_once(self):
+        runner = ProtocolRunner(FakeStation(), load_steps(STEPS), self.checkpoint_path)
+        runner.save_checkpoint(0, {'written': True})
+
+        station = FakeStation()
+        ProtocolRunner(station, load_steps(STEPS), self.checkpoint_path).run()
+        self.assertNotIn(('segment', 'Cycle 0 BEGIN'), station.calls)
+        self.assertEqual(station.calls[0], ('ramp', 2, 10))
+
+    def test_changed_protocol_refused(self):
+        with self.assertRaises(Interrupted):
+            ProtocolRunner(FakeStation(interrupt_after=60), load_steps(STEPS), self.checkpoint_path).run()
+
+        changed = [dict(step) for step in STEPS]
+        changed[3]['duration'] = 600
+        station = FakeStation()
+        with self.assertRaises(ProtocolError):
+            ProtocolRunner(station, load_steps(changed), self.checkpoint_path).run()
+        self.assertEqual(station.calls, [])
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+
+    def test_unknown_step_type(self):
+        with self.assertRaises(ProtocolError):
+            load_steps([{'type': 'warp', 'speed': 9}])
+
+
+class DryRunTest(unittest.TestCase):
+    def test_estimate_runtime(self):
+        # 120 C at 10 C/minute, 30 s hold time and a 300 s soak
+        self.assertAlmostEqual(estimate_runtime(load_steps(STEPS), initial_temperature=25.0), 720 + 30 + 300)
+
+    def test_fast_rate_without_ramp(self):
+        steps = load_steps([{'type': 'ramp', 'output': 2, 'rate': None},
+                            {'type': 'settle', 'VTI': 65, 'sample': 65, 'band': 0.2, 'hold_time': 0,
+                             'timeout': 3600}])
+        self.assertAlmostEqual(estimate_runtime(steps, initial_temperature=25.0, fast_rate=20.0), 120)
+
+    def test_timeout_counted_in_full(self):
+        steps = load_steps([{'type': 'ramp', 'output': 2, 'rate': 1},
+                            {'type': 'settle', 'VTI': -95, 'sample': -95, 'band': 0.2, 'hold_time': 30,
+                             'timeout': 600},
+                            {'type': 'log', 'message': 'done'}])
+        self.assertAlmostEqual(estimate_runtime(steps, initial_temperature=25.0), 600)
+
+    def test_slowest_output_decides(self):
+        station = DryRunStation(initial_temperature=0.0)
+        station.set_ramp(1, 20)
+        station.set_ramp(2, 5)
+        self.assertEqual(station.set_temperature_and_settle(10, 10, 0.2, 0, 3600), (True, 120))
+        self.assertEqual(station.temperature, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Recording the traffic of a driver and replaying it, against the emulator.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from pacing import NullPacer
+from replay import RecordingResource, ReplayDivergence, ReplayResource
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 0.01
+        return self.now
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'run.traffic.jsonl.gz')
+        self.clock = Clock()
+        self.emulator = LS350Emulator()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def driver(self, resource):
+        driver = LS350_Driver(resource)
+        driver.pacer = NullPacer()
+        return driver
+
+    def record(self):
+        LS350 = self.driver(RecordingResource(self.emulator, self.path, clock=self.clock))
+        readings = [LS350.get_kelvin_reading('A'), LS350.get_setpoint(1)]
+        LS350.set_setpoint(1, 300.0)
+        readings.append(LS350.get_setpoint(1))
+        return LS350, readings
+
+    def test_round_trip(self):
+        LS350, readings = self.record()
+        LS350.instrument.close()
+
+        replay = ReplayResource(self.path)
+        LS350 = self.driver(replay)
+        self.assertEqual([LS350.get_kelvin_reading('A'), LS350.get_setpoint(1)], readings[:2])
+        LS350.set_setpoint(1, 300.0)
+        self.assertEqual(LS350.get_setpoint(1), 300.0)
+        report = replay.report()
+        self.assertEqual((report['replayed'], report['remaining'], report['divergences']), (4, 0, []))
+
+    def test_clock_follows_the_recording_until_closed(self):
+        LS350, _ = self.record()
+        last = self.clock.now
+        self.clock.now += 60  # The run went on without the instrument, e.g. until a timeout
+        LS350.instrument.close()
+
+        replay = ReplayResource(self.path)
+        LS350 = self.driver(replay)
+        LS350.get_kelvin_reading('A')
+        LS350.get_setpoint(1)
+        LS350.set_setpoint(1, 300.0)
+        self.assertLess(replay.clock(), last + 1)
+        LS350.get_setpoint(1)
+        self.assertGreater(replay.clock(), last + 60)
+
+    def test_errors_replayed(self):
+        def fail(message):
+            raise TimeoutError('No reply')
+        resource = RecordingResource(self.emulator, self.path, clock=self.clock)
+        self.emulator.query = fail
+        with self.assertRaises(TimeoutError):
+            resource.query('KRDG? A')
+        resource.close()
+
+        with self.assertRaises(TimeoutError):
+            ReplayResource(self.path).query('KRDG? A')
+
+    def test_divergence(self):
+        LS350, _ = self.record()
+        LS350.instrument.close()
+
+        replay = ReplayResource(self.path)
+        # A dropped command is skipped and reported, a command that was never sent raises
+        self.assertEqual(float(replay.query('SETP? 1')), 295.0)
+        self.assertEqual(replay.report()['divergences'], [(0, ('q', 'KRDG? A'), ('q', 'SETP? 1'), 1)])
+        with self.assertRaises(ReplayDivergence):
+            replay.query('PID? 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
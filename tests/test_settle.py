@@ -0,0 +1,168 @@
+"""
+Settle detection and adaptive polling, on their own and on a station with the emulated Model 350.
+
+    python -m unittest discover -s tests -t .
+"""
+import math
+import unittest
+
+import numpy as np
+
+from LS350_Driver import LS350_Driver
+from daq import StaticPressureSource
+from emulator import LS350Emulator
+from pacing import NullPacer
+from settle import AdaptivePoller, RollingStatistics, SettleCriteria, SettleDetector
+from station import Station
+
+
+class Clock(object):
+    """Simulated time shared by the station and the emulator."""
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RecordLog(object):
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def segment(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class RollingStatisticsTest(unittest.TestCase):
+    def test_matches_numpy_over_the_window(self):
+        random = np.random.RandomState(1)
+        times = 1e6 + np.cumsum(random.uniform(0.1, 1.0, 2000))
+        values = 20 + 0.01 * (times - times[0]) + random.normal(0, 0.05, len(times))
+        statistics = RollingStatistics(window=30.0)
+        for i, (t, y) in enumerate(zip(times, values)):
+            statistics.add(t, y)
+            if i % 97 == 0 and i > 10:
+                inside = (times <= t) & (times >= t - 30.0)
+                self.assertEqual(statistics.n, inside.sum())
+                self.assertAlmostEqual(statistics.mean, values[inside].mean(), places=9)
+                self.assertAlmostEqual(statistics.variance, values[inside].var(ddof=1), places=9)
+                self.assertAlmostEqual(statistics.slope, np.polyfit(times[inside], values[inside], 1)[0], places=9)
+
+    def test_too_few_samples(self):
+        statistics = RollingStatistics(window=10.0)
+        self.assertTrue(math.isnan(statistics.mean))
+        statistics.add(0.0, 1.0)
+        self.assertEqual(statistics.mean, 1.0)
+        self.assertTrue(math.isnan(statistics.variance))
+        self.assertTrue(math.isnan(statistics.slope))
+        self.assertEqual(statistics.span, 0.0)
+
+    def test_clear(self):
+        statistics = RollingStatistics(window=10.0)
+        for t in range(5):
+            statistics.add(float(t), 2.0 * t)
+        self.assertAlmostEqual(statistics.slope, 2.0)
+        statistics.clear()
+        self.assertEqual(statistics.n, 0)
+        statistics.add(100.0, 1.0)
+        self.assertEqual(statistics.mean, 1.0)
+
+
+class SettleDetectorTest(unittest.TestCase):
+    def feed(self, detector, times, values, setpoint=30.0, ramping=False):
+        return [(detector.update(t, setpoint, y, ramping), detector.state) for t, y in zip(times, values)]
+
+    def test_settles_after_the_hold_time(self):
+        detector = SettleDetector(SettleCriteria(band=0.2, hold_time=10.0))
+        states = self.feed(detector, np.arange(0.0, 10.0), np.full(10, 30.1))
+        self.assertEqual(states[-1], (False, SettleDetector.HOLDING))
+        self.assertEqual(self.feed(detector, [10.0], [30.1]), [(True, SettleDetector.SETTLED)])
+
+    def test_leaving_the_band_restarts_the_hold_time(self):
+        detector = SettleDetector(SettleCriteria(band=0.2, hold_time=10.0))
+        self.feed(detector, np.arange(0.0, 8.0), np.full(8, 30.0))
+        self.assertEqual(self.feed(detector, [8.0], [30.5]), [(False, SettleDetector.OUT_OF_BAND)])
+        self.assertAlmostEqual(detector.distance, 2.5)
+        states = self.feed(detector, np.arange(9.0, 19.0), np.full(10, 30.0))
+        self.assertFalse(any(settled for settled, _ in states))
+        self.assertTrue(self.feed(detector, [19.0], [30.0])[0][0])
+
+    def test_ramping_is_never_settled(self):
+        detector = SettleDetector(SettleCriteria(band=0.2, hold_time=1.0))
+        states = self.feed(detector, np.arange(0.0, 10.0), np.full(10, 30.0), ramping=True)
+        self.assertEqual(set(states), {(False, SettleDetector.RAMPING)})
+
+    def test_drift_within_the_band(self):
+        detector = SettleDetector(SettleCriteria(band=0.2, slope_limit=0.1, hold_time=20.0))
+        times = np.arange(0.0, 60.0)
+        # 0.3 C/minute, inside the band all the time
+        states = self.feed(detector, times, 29.85 + 0.005 * times)
+        self.assertEqual(states[5][1], SettleDetector.HOLDING)
+        self.assertEqual(states[-1], (False, SettleDetector.DRIFTING))
+
+        detector.reset()
+        self.assertEqual(detector.state, None)
+        states = self.feed(detector, times, np.full(60, 30.05))
+        self.assertTrue(states[-1][0])
+
+
+class AdaptivePollerTest(unittest.TestCase):
+    def test_intervals(self):
+        poller = AdaptivePoller(min_interval=0.2, max_interval=5.0, near=2.0, far=20.0)
+        self.assertEqual(poller.interval(0.5), 0.2)
+        self.assertEqual(poller.interval(2.0), 0.2)
+        self.assertEqual(poller.interval(50.0), 5.0)
+        self.assertAlmostEqual(poller.interval(11.0), 1.0)
+        self.assertEqual(poller.interval(0.5, ramping=True), 5.0)
+
+    def test_sparser_with_distance(self):
+        poller = AdaptivePoller()
+        intervals = [poller.interval(distance) for distance in np.linspace(0, 30, 61)]
+        self.assertEqual(intervals, sorted(intervals))
+
+    def test_ramp_interval(self):
+        self.assertEqual(AdaptivePoller(ramp_interval=2.0).interval(0.0, ramping=True), 2.0)
+
+
+class StationSettleTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        LS350 = LS350_Driver(LS350Emulator(clock=self.clock, sleep=self.clock.sleep))
+        LS350.pacer = NullPacer()
+        self.log = RecordLog()
+        self.LS350 = LS350
+
+    def settle(self, **kwargs):
+        station = Station(self.LS350, StaticPressureSource((1.0, 2.0)), self.log, clock=self.clock,
+                          sleep=self.clock.sleep, **kwargs)
+        station.set_ramp(2, 10)
+        settled, _ = station.set_temperature_and_settle(30, 30, 0.2, 30, 3600, record=True)
+        station.close()
+        self.assertTrue(settled)
+        records = np.array(self.log.records)
+        return records[:-1, 0] - records[0, 0], np.diff(records[:, 0]), records[:-1, 5]
+
+    def test_ramp_is_polled_sparsely_and_the_band_densely(self):
+        times, intervals, temperatures = self.settle(poll_interval=(0.2, 5.0))
+        # The setpoint ramps from 21.85 C to 30 C at 10 C/minute, for 49 s
+        ramping = times < 45.0
+        self.assertEqual(ramping.sum(), 9)
+        self.assertTrue(np.allclose(intervals[ramping], 5.0, atol=0.01))
+        self.assertTrue(np.allclose(intervals[np.abs(temperatures - 30) < 0.2], 0.2, atol=0.01))
+
+    def test_record_interval_bounds_the_time_between_recorded_samples(self):
+        _, intervals, _ = self.settle(poll_interval=(0.2, 5.0), record_interval=1.0)
+        self.assertLessEqual(intervals.max(), 1.0 + 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
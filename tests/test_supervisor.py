@@ -0,0 +1,173 @@
+"""
+Supervisor: the shared telemetry table, and restarting, backing off and giving up on workers.
+
+The workers are small functions of this module instead of measurement.run_station, run in real worker processes.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from supervisor import FAILED, FINISHED, RUNNING, SEQUENCE, WAITING, Supervisor, TelemetrySlot, TelemetryTable
+
+COLUMNS = ('Time', 'a', 'b', 'c', 'd')
+
+
+def failing_worker(index, config, table_name, n_slots, columns, metrics_queue, metrics_interval):
+    """Publish a sample and exit with an error for the first config['failures'] starts, then finish."""
+    path = os.path.join(config['directory'], 'starts')
+    with open(path, 'a') as file:
+        file.write('x')
+    with open(path) as file:
+        starts = len(file.read())
+
+    table = TelemetryTable.attach(table_name, n_slots, columns)
+    slot = TelemetrySlot(table, index)
+    slot.start()
+    slot.publish([time.time(), starts, 0, 0, 0])
+    table.close()
+    return 1 if starts <= config['failures'] else 0
+
+
+def hanging_worker(index, config, table_name, n_slots, columns, metrics_queue, metrics_interval):
+    """Start and never publish a sample."""
+    time.sleep(60)
+    return 0
+
+
+class TelemetryTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = TelemetryTable(2, COLUMNS)
+
+    def tearDown(self):
+        self.table.close()
+
+    def test_update_and_read(self):
+        self.table.update(1, state=RUNNING, a=1.5, b=2.5)
+        row = self.table.read(1)
+        self.assertEqual(row['state'], 'running')
+        self.assertEqual((row['a'], row['b']), (1.5, 2.5))
+        self.assertEqual(row['sequence'] % 2, 0)
+        self.assertEqual(self.table.read(0)['state'], 'idle')
+
+    def test_attached_table_sees_the_rows(self):
+        other = TelemetryTable.attach(self.table.name, 2, COLUMNS)
+        try:
+            TelemetrySlot(self.table, 0).publish([1.0, 2.0, 3.0, 4.0, 5.0])
+            np.testing.assert_array_equal(other.read_row(0)[-5:], [1.0, 2.0, 3.0, 4.0, 5.0])
+            self.assertEqual(other.read(0)['samples'], 1)
+        finally:
+            other.close()
+
+    def test_row_being_written_is_not_read(self):
+        self.table.data[0, SEQUENCE] += 1
+        with self.assertRaises(TimeoutError):
+            self.table.read_row(0, retries=10)
+        self.table.data[0, SEQUENCE] += 1
+        self.table.read_row(0, retries=10)
+
+    def test_reads_are_consistent_while_written(self):
+        # Every sample the writer publishes has the same value in all columns, a torn read would mix two samples
+        slot = TelemetrySlot(self.table, 0)
+        stop = threading.Event()
+
+        def write():
+            value = 0.0
+            while not stop.is_set():
+                value += 1
+                slot.publish([value] * len(COLUMNS))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(2000):
+                row = self.table.read_row(0)
+                values = row[-len(COLUMNS):]
+                self.assertTrue(np.all(values == values[0]) or np.all(np.isnan(values)), values)
+                self.assertEqual(row[SEQUENCE] % 2, 0)
+        finally:
+            stop.set()
+            writer.join()
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def supervisor(self, worker, failures=0, **kwargs):
+        return Supervisor({'A': {'directory': self.directory, 'failures': failures}}, worker=worker,
+                          columns=COLUMNS, clock=self.clock, **kwargs)
+
+    def supervise(self, supervisor, timeout=60):
+        """Poll until the station finished or failed, recording the restart delays on the fake clock."""
+        station = supervisor.stations[0]
+        delays = []
+        deadline = time.time() + timeout
+        supervisor.start()
+        while supervisor.poll():
+            self.assertLess(time.time(), deadline)
+            if supervisor.state(station) == WAITING:
+                delays.append(station.restart_at - self.clock.now)
+                self.clock.now = station.restart_at
+            else:
+                time.sleep(0.01)
+        return delays
+
+    def test_restart_with_backoff(self):
+        with self.supervisor(failing_worker, failures=3, restart_delay=(1.0, 3.0), stall_timeout=None) as supervisor:
+            delays = self.supervise(supervisor)
+            station = supervisor.stations[0]
+
+            self.assertEqual(delays, [1.0, 2.0, 3.0])
+            self.assertEqual(station.exit_codes, [1, 1, 1, 0])
+            self.assertEqual(supervisor.state(station), FINISHED)
+            telemetry = supervisor.telemetry()['A']
+            self.assertEqual((telemetry['restarts'], telemetry['exit_code'], telemetry['a']), (3, 0, 4))
+            self.assertEqual(supervisor.metrics()['restarts'], 3)
+
+    def test_give_up(self):
+        with self.supervisor(failing_worker, failures=10, max_restarts=2, restart_delay=(1.0, 300.0),
+                             stall_timeout=None) as supervisor:
+            delays = self.supervise(supervisor)
+            station = supervisor.stations[0]
+
+            self.assertEqual(delays, [1.0, 2.0])
+            self.assertEqual(station.exit_codes, [1, 1, 1])
+            self.assertEqual(supervisor.state(station), FAILED)
+            self.assertEqual(supervisor.telemetry()['A']['state'], 'failed')
+
+    def test_stalled_worker_killed(self):
+        with self.supervisor(hanging_worker, max_restarts=0, stall_timeout=30.0) as supervisor:
+            supervisor.start()
+            station = supervisor.stations[0]
+            self.assertEqual(supervisor.poll(), 1)
+            self.assertTrue(station.process.is_alive())
+
+            self.clock.now += 31
+            supervisor.poll()
+            self.assertFalse(station.process.is_alive())
+            self.assertEqual(supervisor.state(station), FAILED)
+            self.assertNotEqual(station.exit_codes, [0])
+            self.assertEqual(supervisor.poll(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
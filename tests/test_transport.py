@@ -0,0 +1,113 @@
+"""
+Transport recovery against the emulator with injected faults, live and replayed.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from LS350_Driver import LS350_Driver
+from emulator import LS350Emulator
+from pacing import NullPacer
+from processors import ProcessorError
+from replay import RecordingResource, ReplayResource
+from transport import ResilientResource, RetriesExhausted, TransportError, TransportTimeout
+
+
+def no_sleep(seconds):
+    pass
+
+
+def driver(resource):
+    LS350 = LS350_Driver(resource)
+    LS350.pacer = NullPacer()
+    return LS350
+
+
+def count_failures(resource, n=1000):
+    LS350 = driver(resource)
+    failures = 0
+    for i in range(n):
+        try:
+            if i % 2:
+                LS350.get_setpoint(1)
+            else:
+                with LS350.batch() as batch:
+                    setpoint = batch.get_setpoint(1)
+                    heater_range = batch.get_heater_range(1)
+                setpoint.value, heater_range.value
+        except (ProcessorError, TimeoutError, TransportError):
+            failures += 1
+    return failures
+
+
+def garble_first(emulator, mnemonic, reply='x#!'):
+    """Make the first reply to mnemonic come back garbled."""
+    handler = emulator.handlers[mnemonic]
+    calls = []
+
+    def garbled(self, *args):
+        calls.append(args)
+        return reply if len(calls) == 1 else handler(self, *args)
+    emulator.handlers[mnemonic] = garbled
+
+
+class ResilientResourceTest(unittest.TestCase):
+    def test_injected_faults_are_retried(self):
+        errors = ('empty', 'garbled', 'timeout', 'late')
+        raw = count_failures(LS350Emulator(seed=3, error_rate=0.05, errors=errors))
+        resilient = count_failures(ResilientResource(LS350Emulator(seed=3, error_rate=0.05, errors=errors),
+                                                     sleep=no_sleep))
+        self.assertGreater(raw, 20)
+        self.assertLessEqual(resilient, 5)
+
+    def test_timeouts_raise_typed_errors(self):
+        resource = ResilientResource(LS350Emulator(error_rate=1.0, errors=('timeout',)), sleep=no_sleep)
+        with self.assertRaises(RetriesExhausted) as context:
+            resource.query('SETP? 1')
+        self.assertIsInstance(context.exception.errors[0], TransportTimeout)
+        self.assertIsInstance(context.exception.errors[0], TimeoutError)
+
+    def test_garbled_reply_is_sent_again(self):
+        emulator = LS350Emulator()
+        garble_first(emulator, 'KRDG?')
+        LS350 = driver(ResilientResource(emulator, sleep=no_sleep))
+        self.assertEqual(LS350.get_kelvin_reading('A'), 295.0)
+        self.assertEqual(LS350.instrument.statistics['resyncs'], 1)
+
+    def test_garbled_reply_without_recovery_raises(self):
+        emulator = LS350Emulator()
+        garble_first(emulator, 'KRDG?')
+        with self.assertRaises(ProcessorError):
+            driver(emulator).get_kelvin_reading('A')
+
+
+class ReplayRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'traffic.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay_recovers_like_the_recorded_run(self):
+        emulator = LS350Emulator()
+        garble_first(emulator, 'KRDG?')
+        recording = RecordingResource(ResilientResource(emulator, sleep=no_sleep), self.path)
+        LS350 = driver(recording)
+        live = [LS350.get_kelvin_reading('A') for _ in range(3)]
+        recording.close()
+
+        replay = ReplayResource(self.path)
+        LS350 = driver(replay)
+        replayed = [LS350.get_kelvin_reading('A') for _ in range(3)]
+        self.assertEqual(live, [295.0] * 3)
+        self.assertEqual(replayed, live)
+        self.assertEqual(replay.report()['divergences'], [])
+        self.assertEqual(replay.remaining, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
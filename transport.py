@@ -0,0 +1,200 @@
+"""
+Resilient transport under a driver: timeout budgets, retries and resynchronisation of the reply stream.
+
+A reply that is dropped or garbled on the serial line used to cost the run, or a reopen of the port: after a timeout
+the reply may still arrive and then answers the next query, shifting every reply after it. ResilientResource wraps a
+pyvisa resource with the same query/write/read/clear surface and:
+    - sets the timeout of every transaction from a budget per command mnemonic, so a lost reply fails fast
+    - retries queries (they do not change the instrument, so sending them again is safe) after a timeout, an empty
+      reply or a reply that does not have one part per query of a compound message, with a growing delay
+    - resynchronises the stream before a retry without reopening the port: the buffers are cleared and a sentinel
+      query (*IDN?) is sent, replies are read until the sentinel's reply comes back, which drains replies that
+      arrived late
+    - raises typed errors: TransportTimeout (also a TimeoutError), OutOfSync and RetriesExhausted, all
+      async_transport.TransportError
+
+    LS350 = LS350_Driver(ResilientResource(res, timeouts={'CRVPT?': 1000}))
+
+A reply that arrives but cannot be parsed (ProcessorError) is only noticed by the driver; the driver then calls
+recover(), which resynchronises and allows the query to be sent again while retries are left.
+"""
+import threading
+import time
+
+from async_transport import TransportError
+
+# pyvisa status code of a timeout, VI_ERROR_TMO
+VI_ERROR_TMO = -1073807339
+
+
+class TransportTimeout(TransportError, TimeoutError):
+    pass
+
+
+class OutOfSync(TransportError):
+    """The replies no longer match the messages they answer."""
+    pass
+
+
+class RetriesExhausted(TransportError):
+    def __init__(self, message, errors):
+        super().__init__('{} failed {} times, last error: {}'.format(message, len(errors), errors[-1]))
+        self.errors = errors
+
+
+def is_timeout(error):
+    """True for the timeouts of pyvisa (VisaIOError VI_ERROR_TMO), of the emulators and of a replayed log."""
+    return isinstance(error, TimeoutError) or getattr(error, 'error_code', None) == VI_ERROR_TMO or \
+        'VI_ERROR_TMO' in str(error)
+
+
+def identification_reply(reply):
+    """Looks like the reply to *IDN?: manufacturer, model, serial number, firmware."""
+    return reply.count(',') == 3
+
+
+class ResilientResource(object):
+    def __init__(self, resource, timeouts=None, default_timeout=300, retries=2, backoff=(0.05, 1.0),
+                 sentinel='*IDN?', sentinel_reply=identification_reply, max_stale=4, separator=';',
+                 sleep=time.sleep):
+        """
+        :param resource: pyvisa resource (or emulator, recording, ...) to wrap
+        :param timeouts: dict of command mnemonic -> timeout budget in ms, e.g. {'CRVPT?': 1000}
+        :param default_timeout: budget in ms of the mnemonics not in timeouts; the timeout of a compound message is the
+                                sum of the budgets of its parts
+        :param retries: number of times a query is sent again
+        :param backoff: (first, longest) delay in seconds before a retry, doubled after every retry
+        :param sentinel: query sent to resynchronise the stream
+        :param sentinel_reply: returns True for the reply to the sentinel, until the first reply to the sentinel is
+                               known; the next ones must be equal to it
+        :param max_stale: number of stale replies read and dropped while resynchronising
+        """
+        self.resource = resource
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sentinel = sentinel
+        self.sentinel_reply = sentinel_reply
+        self.max_stale = max_stale
+        self.separator = separator
+        self.sleep = sleep
+
+        self.identity = None  # Reply to the sentinel
+        self.lock = threading.RLock()
+        self.current_timeout = None
+        self.statistics = {'retries': 0, 'timeouts': 0, 'empty': 0, 'out_of_sync': 0, 'resyncs': 0,
+                           'stale_replies': 0}
+
+    def mnemonics(self, message):
+        return [part.split(None, 1)[0] for part in message.split(self.separator) if part.strip()]
+
+    def budget(self, message):
+        budget = sum(self.timeouts.get(mnemonic, self.default_timeout) for mnemonic in self.mnemonics(message))
+        return max(budget, self.default_timeout)
+
+    def set_timeout(self, timeout):
+        # Setting an attribute of a pyvisa resource is a call into the VISA library, only do it when it changes
+        if timeout != self.current_timeout:
+            self.resource.timeout = timeout
+            self.current_timeout = timeout
+
+    def transaction(self, operation, message, *args):
+        """Run operation with the timeout budget of message, raising typed errors."""
+        self.set_timeout(self.budget(message))
+        try:
+            return operation(*args)
+        except TransportError:
+            raise
+        except Exception as e:
+            if is_timeout(e):
+                self.statistics['timeouts'] += 1
+                raise TransportTimeout('No reply to {!r} within {} ms'.format(message, self.current_timeout)) from e
+            raise TransportError('{!r} failed: {}'.format(message, e)) from e
+
+    def check(self, message, reply):
+        if reply is None or not reply.strip():
+            self.statistics['empty'] += 1
+            raise OutOfSync('Empty reply to {!r}'.format(message))
+        n_queries = sum(mnemonic.endswith('?') for mnemonic in self.mnemonics(message))
+        if len(reply.strip().split(self.separator)) != n_queries:
+            self.statistics['out_of_sync'] += 1
+            raise OutOfSync('Reply {!r} does not answer {!r}'.format(reply, message))
+
+    def query(self, message):
+        with self.lock:
+            errors = []
+            reply = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.statistics['retries'] += 1
+                    self.sleep(min(self.backoff[0] * 2 ** (attempt - 1), self.backoff[1]))
+                    try:
+                        self.resync()
+                    except TransportError as e:
+                        errors.append(e)
+                        continue
+                try:
+                    reply = self.transaction(self.resource.query, message, message)
+                    self.check(message, reply)
+                    if message == self.sentinel and self.identity is None:
+                        self.identity = reply.strip()
+                    return reply
+                except (TransportTimeout, OutOfSync) as e:
+                    errors.append(e)
+            if reply is not None and reply.strip() and isinstance(errors[-1], OutOfSync) and \
+                    all(isinstance(error, OutOfSync) for error in errors):
+                # The instrument answers every time, just not one part per query: let the driver deal with it (see
+                # Driver.query_many)
+                return reply
+            raise RetriesExhausted(repr(message), errors)
+
+    def write(self, message):
+        with self.lock:
+            return self.transaction(self.resource.write, message, message)
+
+    def read(self):
+        with self.lock:
+            return self.transaction(self.resource.read, '')
+
+    def clear(self):
+        with self.lock:
+            return self.transaction(self.resource.clear, '')
+
+    def resync(self):
+        """Flush the stream and read until the reply to the sentinel query comes back."""
+        with self.lock:
+            self.statistics['resyncs'] += 1
+            self.transaction(self.resource.clear, self.sentinel)
+            self.transaction(self.resource.write, self.sentinel, self.sentinel)
+            for _ in range(self.max_stale + 1):
+                reply = self.transaction(self.resource.read, self.sentinel).strip()
+                if reply == self.identity or (self.identity is None and self.sentinel_reply(reply)):
+                    self.identity = reply
+                    return
+                self.statistics['stale_replies'] += 1
+            raise OutOfSync('No reply to {!r} after {} stale replies'.format(self.sentinel, self.max_stale))
+
+    def recover(self, attempt):
+        """
+        Called by the driver when the reply to a query could not be processed.
+
+        :param attempt: number of times the query failed so far
+        :return: True if the query may be sent again, the stream has been resynchronised
+        """
+        if attempt > self.retries:
+            return False
+        with self.lock:
+            self.statistics['retries'] += 1
+            self.sleep(min(self.backoff[0] * 2 ** (attempt - 1), self.backoff[1]))
+            try:
+                self.resync()
+            except TransportError:
+                return False
+        return True
+
+    def close(self):
+        self.resource.close()
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
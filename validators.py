@@ -37,6 +37,19 @@ class ValidateRange(Validator):
                 raise ValidationError("The input {} must be >= {}".format(value, self.min))
 
 
+class ValidateLength(Validator):
+    def __init__(self, min=None, max=None):
+        super().__init__()
+        self.min = min
+        self.max = max
+
+    def __call__(self, value):
+        if self.max is not None and len(value) > self.max:
+            raise ValidationError("The input {} must be at most {} characters long".format(value, self.max))
+        if self.min is not None and len(value) < self.min:
+            raise ValidationError("The input {} must be at least {} characters long".format(value, self.min))
+
+
 class ValidateInArray(Validator):
     def __init__(self, array):
         super().__init__()